@@ -1,11 +1,24 @@
 from __future__ import annotations
 
 import asyncio
+import collections.abc
 import json
 import time
-from contextvars import Token
+from contextvars import ContextVar, Token
 from textwrap import dedent
-from typing import Any, Callable, Dict, List, Optional, Type, Union
+from typing import (
+    Any,
+    AsyncGenerator,
+    AsyncIterable,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Type,
+    Union,
+)
 
 import asyncpg
 import asyncpg.pool
@@ -24,6 +37,29 @@ from ..misc import ctx_span_get, ctx_span_reset, ctx_span_set
 
 JsonType = Union[None, int, float, str, bool, List[Any], Dict[str, Any]]
 ConnFactory = Callable[['Postgres', asyncpg.Connection], 'Connection']
+CopyRecords = Union[Iterable[Sequence[Any]], AsyncIterable[Sequence[Any]]]
+
+# количество строк из асинхронного итератора в одной команде COPY
+COPY_CHUNK_SIZE = 10000
+
+# отставание реплики в секундах, 0 если реплика догнала мастер
+REPLICA_LAG_QUERY = '''
+SELECT CASE
+    WHEN NOT pg_is_in_recovery()
+        OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()
+    THEN 0
+    ELSE COALESCE(
+        EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0
+    )
+END::float8
+'''
+
+# соединение, в транзакции которого находится текущая задача: чтение
+# через Postgres внутри транзакции выполняется в этом соединении и видит
+# незафиксированные изменения
+_ctx_xact_conn: ContextVar[Optional['Connection']] = ContextVar(
+    '_ctx_xact_conn', default=None
+)
 
 
 class PostgresConfig(BaseModel):
@@ -32,6 +68,45 @@ class PostgresConfig(BaseModel):
         description="Строка подключения к базе данных",
         example="postgresql://own@localhost:5432/main",
     )
+    replica_urls: List[str] = Field(
+        [],
+        description="Строки подключения к репликам базы данных",
+        example=["postgresql://own@replica:5432/main"],
+    )
+    replica_reads: bool = Field(
+        True,
+        description=(
+            "Выполнять query_one и query_all вне транзакций на репликах"
+        ),
+    )
+    replica_max_lag: float = Field(
+        10.0,
+        description=(
+            "Максимальное отставание реплики в секундах, после которого "
+            "она исключается из балансировки. Установите значение 0, "
+            "чтобы не проверять отставание"
+        ),
+    )
+    replica_check_interval: float = Field(
+        5.0,
+        description="Интервал проверки реплик в секундах",
+    )
+    replica_connect_timeout: float = Field(
+        5.0,
+        description=(
+            "Время ожидания подключения к реплике в секундах. Реплика, к "
+            "которой не удалось подключиться, исключается из балансировки "
+            "до следующей проверки"
+        ),
+    )
+    pool_metrics_interval: Optional[float] = Field(
+        5.0,
+        gt=0,
+        description=(
+            "Интервал публикации метрик пулов соединений в секундах. Если "
+            "не задан, метрики пулов не публикуются"
+        ),
+    )
     pool_min_size: int = Field(
         4, description="Минимальное количество соединений в пуле"
     )
@@ -53,6 +128,31 @@ class PostgresConfig(BaseModel):
             "необходимо отключить этот механизм"
         ),
     )
+    statement_cache_size: int = Field(
+        100,
+        description=(
+            "Размер кэша подготовленных запросов каждого соединения. "
+            "Запросы вытесняются из кэша по LRU и подготавливаются заново "
+            "после изменения схемы. Установите значение 0, чтобы "
+            "отключить кэш"
+        ),
+    )
+    max_cached_statement_lifetime: float = Field(
+        300.0,
+        description=(
+            "Количество секунд, после которых запрос удаляется из кэша "
+            "подготовленных запросов. Установите значение 0, чтобы "
+            "запросы хранились до вытеснения"
+        ),
+    )
+    max_cacheable_statement_size: int = Field(
+        15 * 1024,
+        description=(
+            "Максимальная длина текста запроса, который помещается в кэш "
+            "подготовленных запросов. Установите значение 0, чтобы снять "
+            "ограничение"
+        ),
+    )
     connect_max_attempts: int = Field(
         10,
         description=(
@@ -87,6 +187,10 @@ class PgSpan(Span):
     NAME_PREPARE = 'db::prepare'
     NAME_QUERY_ONE_PREPARED = 'db::execute_query_one'
     NAME_QUERY_ALL_PREPARED = 'db::execute_query_all'
+    NAME_COPY_IN = 'db::copy_in'
+    NAME_COPY_OUT = 'db::copy_out'
+    NAME_ITERATE = 'db::iterate'
+    NAME_POOL = 'db::pool'
 
     P8S_NAME_ACQUIRE = 'db_connection'
     P8S_NAME_XACT_COMMITED = 'db_xact_commited'
@@ -98,11 +202,21 @@ class PgSpan(Span):
     P8S_NAME_PREPARE = 'db_prepare'
     P8S_NAME_QUERY_ONE_PREPARED = 'db_execute_query_one'
     P8S_NAME_QUERY_ALL_PREPARED = 'db_execute_query_all'
+    P8S_NAME_COPY_IN = 'db_copy_in'
+    P8S_NAME_COPY_OUT = 'db_copy_out'
+    P8S_NAME_ITERATE = 'db_iterate'
+    P8S_NAME_POOL = 'db_pool'
 
     TAG_POOL_MAX_SIZE = 'db.pool.size'
     TAG_POOL_FREE_COUNT = 'db.pool.free'
+    TAG_ENDPOINT = 'db.endpoint'
+    TAG_REPLICA_LAG = 'db.replica.lag'
+    TAG_REPLICA_HEALTHY = 'db.replica.healthy'
 
     TAG_QUERY_NAME = 'db.query'
+    TAG_COPY_ROWS = 'db.copy.rows'
+    TAG_COPY_BYTES = 'db.copy.bytes'
+    TAG_ROWS = 'db.rows'
 
     ANN_PID = 'pg_pid'
     ANN_ACQUIRE = 'pg_conn'
@@ -123,6 +237,16 @@ class PgSpan(Span):
         return super().finish(ts, exception)
 
 
+class _Replica:
+    def __init__(self, url: str) -> None:
+        self.url = url
+        self.name = mask_url_pwd(url) or ''
+        self.pool: Optional[asyncpg.pool.Pool] = None
+        self.healthy = False
+        self.lag: Optional[float] = None
+        self.error: Optional[str] = None
+
+
 class Postgres(Component):
     def __init__(
         self,
@@ -133,6 +257,10 @@ class Postgres(Component):
     ) -> None:
         self.cfg = cfg
         self._pool: Optional[asyncpg.pool.Pool] = None
+        self._replicas = [_Replica(url) for url in cfg.replica_urls]
+        self._replica_idx = 0
+        self._check_fut: Optional[asyncio.Future] = None
+        self._metrics_fut: Optional[asyncio.Future] = None
         self._connections: List['Connection'] = []
 
         if connection_factory is None:
@@ -167,18 +295,45 @@ class Postgres(Component):
         with wrap2span(
             name=PgSpan.NAME_CONNECT, kind=PgSpan.KIND_CLIENT, app=self.app
         ):
-            self._pool = await asyncpg.create_pool(
-                dsn=self.cfg.url,
-                max_size=self.cfg.pool_max_size,
-                min_size=self.cfg.pool_min_size,
-                max_queries=self.cfg.pool_max_queries,
-                max_inactive_connection_lifetime=(
-                    self.cfg.pool_max_inactive_connection_lifetime
-                ),
-                init=Postgres._conn_init,
-            )
+            self._pool = await self._create_pool(self.cfg.url)
         self.app.log_info("Connected to %s", self._masked_url)
 
+    async def _connect_replica(self, replica: _Replica) -> None:
+        if self.app is None:  # pragma: no cover
+            raise UserWarning('Unattached component')
+
+        self.app.log_info("Connecting to replica %s", replica.name)
+
+        with wrap2span(
+            name=PgSpan.NAME_CONNECT, kind=PgSpan.KIND_CLIENT, app=self.app
+        ):
+            # недоступная реплика не должна задерживать запуск и проверку
+            # остальных реплик
+            replica.pool = await asyncio.wait_for(
+                self._create_pool(replica.url),
+                self.cfg.replica_connect_timeout,
+            )
+        self.app.log_info("Connected to replica %s", replica.name)
+
+    async def _create_pool(self, dsn: Optional[str]) -> asyncpg.pool.Pool:
+        return await asyncpg.create_pool(
+            dsn=dsn,
+            max_size=self.cfg.pool_max_size,
+            min_size=self.cfg.pool_min_size,
+            max_queries=self.cfg.pool_max_queries,
+            max_inactive_connection_lifetime=(
+                self.cfg.pool_max_inactive_connection_lifetime
+            ),
+            statement_cache_size=self.cfg.statement_cache_size,
+            max_cached_statement_lifetime=(
+                self.cfg.max_cached_statement_lifetime
+            ),
+            max_cacheable_statement_size=(
+                self.cfg.max_cacheable_statement_size
+            ),
+            init=Postgres._conn_init,
+        )
+
     @staticmethod
     async def _conn_init(conn: asyncpg.pool.PoolConnectionProxy) -> None:
         def _json_encoder(value: JsonType) -> str:
@@ -216,14 +371,150 @@ class Postgres(Component):
         for i in range(self.cfg.connect_max_attempts):
             try:
                 await self._connect()
-                return
+                break
             except Exception as e:
                 self.app.log_err(str(e))
                 await asyncio.sleep(self.cfg.connect_retry_delay)
-        raise PrepareError("Could not connect to %s" % self._masked_url)
+        else:
+            raise PrepareError("Could not connect to %s" % self._masked_url)
+
+        # недоступная реплика не мешает запуску: до успешной проверки
+        # запросы выполняются на мастере
+        await self._check_replicas()
 
     async def start(self) -> None:
-        pass
+        if len(self._replicas) > 0:
+            self._check_fut = asyncio.ensure_future(self._check())
+        if self.cfg.pool_metrics_interval is not None:
+            self._metrics_fut = asyncio.ensure_future(self._pool_metrics())
+
+    async def _check(self) -> None:
+        while True:
+            await asyncio.sleep(self.cfg.replica_check_interval)
+            try:
+                await self._check_replicas()
+            except Exception as err:
+                self.app.log_err(err)
+
+    async def _pool_metrics(self) -> None:
+        if self.cfg.pool_metrics_interval is None:  # pragma: no cover
+            raise UserWarning
+        while True:
+            await asyncio.sleep(self.cfg.pool_metrics_interval)
+            try:
+                self._sample_pools()
+            except Exception as err:
+                self.app.log_err(err)
+
+    async def _check_replicas(self) -> None:
+        if self.app is None:  # pragma: no cover
+            raise UserWarning('Unattached component')
+
+        await asyncio.gather(
+            *(self._check_replica(replica) for replica in self._replicas)
+        )
+
+    async def _check_replica(self, replica: _Replica) -> None:
+        if self.app is None:  # pragma: no cover
+            raise UserWarning('Unattached component')
+
+        timeout = self.cfg.replica_check_interval
+        healthy = False
+        try:
+            if replica.pool is None:
+                await self._connect_replica(replica)
+            if replica.pool is None:  # pragma: no cover
+                raise UserWarning
+            async with replica.pool.acquire(timeout=timeout) as conn:
+                lag: float = await conn.fetchval(
+                    REPLICA_LAG_QUERY, timeout=timeout
+                )
+            replica.lag = lag
+            replica.error = None
+            healthy = (
+                self.cfg.replica_max_lag <= 0
+                or lag <= self.cfg.replica_max_lag
+            )
+        except Exception as err:
+            # одна и та же ошибка логируется один раз
+            if replica.error != str(err):
+                self.app.log_err(err)
+            replica.error = str(err)
+
+        if healthy and not replica.healthy:
+            self.app.log_info("Replica %s is enabled", replica.name)
+        elif not healthy and replica.healthy:
+            self.app.log_warn(
+                "Replica %s is disabled (lag %s)",
+                replica.name,
+                replica.lag,
+            )
+        replica.healthy = healthy
+
+    def _sample_pools(self) -> None:
+        self._sample_pool(self._masked_url or '', self._pool, True, 0.0)
+        for replica in self._replicas:
+            self._sample_pool(
+                replica.name, replica.pool, replica.healthy, replica.lag
+            )
+
+    def _sample_pool(
+        self,
+        endpoint: str,
+        pool: Optional[asyncpg.pool.Pool],
+        healthy: bool,
+        lag: Optional[float],
+    ) -> None:
+        with wrap2span(
+            name=PgSpan.NAME_POOL,
+            cls=PgSpan,
+            ignore_ctx=True,
+            app=self.app,
+        ) as span:
+            span.set_name4adapter(
+                self.app.logger.ADAPTER_PROMETHEUS, PgSpan.P8S_NAME_POOL
+            )
+            span.tag(PgSpan.TAG_ENDPOINT, endpoint)
+            if pool is not None:
+                span.tag(PgSpan.TAG_POOL_MAX_SIZE, pool._queue.maxsize)
+                span.tag(PgSpan.TAG_POOL_FREE_COUNT, pool._queue.qsize())
+            span.tag(PgSpan.TAG_REPLICA_HEALTHY, int(healthy))
+            if lag is not None:
+                span.tag(PgSpan.TAG_REPLICA_LAG, lag)
+
+    def _pick_replica(self) -> Optional[_Replica]:
+        replicas = [r for r in self._replicas if r.healthy]
+        if len(replicas) == 0:
+            return None
+        self._replica_idx = (self._replica_idx + 1) % len(replicas)
+        return replicas[self._replica_idx]
+
+    def _xact_connection(
+        self, replica: Optional[bool]
+    ) -> Optional['Connection']:
+        # явный выбор реплики или мастера выполняет запрос в отдельном
+        # соединении
+        if replica is not None:
+            return None
+        conn = _ctx_xact_conn.get()
+        if conn is None or conn._db is not self:
+            return None
+        # задача, запущенная внутри транзакции, может выполняться после ее
+        # завершения и освобождения соединения
+        if conn not in self._connections or not conn.in_transaction:
+            return None
+        # соединение занято курсором conn.iterate(): чтение выполняется в
+        # отдельном соединении и не видит незафиксированных изменений
+        if conn._iterating:
+            return None
+        return conn
+
+    def _read_connection(
+        self, replica: Optional[bool]
+    ) -> 'ConnectionContextManager':
+        if replica is None:
+            replica = self.cfg.replica_reads
+        return self.connection(replica=replica)
 
     async def stop(self) -> None:
         if self.app is None:  # pragma: no cover
@@ -254,14 +545,34 @@ class Postgres(Component):
                 timeout=max(stop_timeout - stop_start + stop_start, 0.001),
             )
 
+        if self._check_fut is not None:
+            self._check_fut.cancel()
+            self._check_fut = None
+        if self._metrics_fut is not None:
+            self._metrics_fut.cancel()
+            self._metrics_fut = None
+
         if self._pool:
             self.app.log_info("Disconnecting from %s" % self._masked_url)
             await self._pool.close()
 
+        for replica in self._replicas:
+            if replica.pool is not None:
+                self.app.log_info(
+                    "Disconnecting from replica %s" % replica.name
+                )
+                await replica.pool.close()
+                replica.pool = None
+
     def connection(
-        self, acquire_timeout: Optional[float] = None
+        self, acquire_timeout: Optional[float] = None, replica: bool = False
     ) -> 'ConnectionContextManager':
-        return ConnectionContextManager(self, acquire_timeout=acquire_timeout)
+        # без доступных реплик соединение берется из пула мастера
+        return ConnectionContextManager(
+            self,
+            acquire_timeout=acquire_timeout,
+            replica=self._pick_replica() if replica else None,
+        )
 
     async def query_one(
         self,
@@ -270,8 +581,18 @@ class Postgres(Component):
         timeout: Optional[float] = None,
         query_name: Optional[str] = None,
         model_cls: Optional[Type[BaseModel]] = None,
+        replica: Optional[bool] = None,
     ) -> Optional[Union[asyncpg.Record, BaseModel]]:
-        async with self.connection() as conn:
+        xact_conn = self._xact_connection(replica)
+        if xact_conn is not None:
+            return await xact_conn.query_one(
+                query,
+                *args,
+                timeout=timeout,
+                query_name=query_name,
+                model_cls=model_cls,
+            )
+        async with self._read_connection(replica) as conn:
             res = await conn.query_one(
                 query,
                 *args,
@@ -288,8 +609,18 @@ class Postgres(Component):
         timeout: Optional[float] = None,
         query_name: Optional[str] = None,
         model_cls: Optional[Type[BaseModel]] = None,
+        replica: Optional[bool] = None,
     ) -> List[Union[asyncpg.Record, BaseModel]]:
-        async with self.connection() as conn:
+        xact_conn = self._xact_connection(replica)
+        if xact_conn is not None:
+            return await xact_conn.query_all(
+                query,
+                *args,
+                timeout=timeout,
+                query_name=query_name,
+                model_cls=model_cls,
+            )
+        async with self._read_connection(replica) as conn:
             res = await conn.query_all(
                 query,
                 *args,
@@ -325,6 +656,51 @@ class Postgres(Component):
             )
         return res
 
+    async def copy_in(
+        self,
+        table_name: str,
+        *,
+        records: Optional[CopyRecords] = None,
+        source: Any = None,
+        columns: Optional[List[str]] = None,
+        schema_name: Optional[str] = None,
+        timeout: Optional[float] = None,
+        query_name: Optional[str] = None,
+        **options: Any,
+    ) -> str:
+        async with self.connection() as conn:
+            res = await conn.copy_in(
+                table_name,
+                records=records,
+                source=source,
+                columns=columns,
+                schema_name=schema_name,
+                timeout=timeout,
+                query_name=query_name,
+                **options,
+            )
+        return res
+
+    async def copy_out(
+        self,
+        query: str,
+        *args: Any,
+        output: Any,
+        timeout: Optional[float] = None,
+        query_name: Optional[str] = None,
+        **options: Any,
+    ) -> str:
+        async with self.connection() as conn:
+            res = await conn.copy_out(
+                query,
+                *args,
+                output=output,
+                timeout=timeout,
+                query_name=query_name,
+                **options,
+            )
+        return res
+
     async def health(self) -> None:
         async with self.connection() as conn:
             await conn.execute('SELECT 1', query_name='health')
@@ -332,9 +708,14 @@ class Postgres(Component):
 
 class ConnectionContextManager:
     def __init__(
-        self, db: Postgres, acquire_timeout: Optional[float] = None
+        self,
+        db: Postgres,
+        acquire_timeout: Optional[float] = None,
+        replica: Optional[_Replica] = None,
     ) -> None:
         self._db = db
+        self._replica = replica
+        self._pool: Optional[asyncpg.pool.Pool] = None
         self._conn: Optional[asyncpg.Connection] = None
         self._acquire_timeout = acquire_timeout
         self._pg_conn: Optional['Connection'] = None
@@ -342,7 +723,11 @@ class ConnectionContextManager:
         self._ctx_token: Optional[Token] = None
 
     async def __aenter__(self) -> 'Connection':
-        if self._db is None or self._db._pool is None:  # noqa
+        if self._replica is not None:
+            self._pool = self._replica.pool
+        else:
+            self._pool = self._db._pool  # noqa
+        if self._pool is None:
             raise UserWarning
         pspan = ctx_span_get()
 
@@ -360,10 +745,12 @@ class ConnectionContextManager:
         span.set_name4adapter(
             self._db.app.logger.ADAPTER_PROMETHEUS, PgSpan.P8S_NAME_ACQUIRE
         )
+        if self._replica is not None:
+            span.tag(PgSpan.TAG_ENDPOINT, self._replica.name)
         self._ctx_token = ctx_span_set(span)
         span.start()
         try:
-            self._conn = await self._db._pool.acquire(  # noqa
+            self._conn = await self._pool.acquire(
                 timeout=self._acquire_timeout
             )
             span.annotate(PgSpan.ANN_ACQUIRE, '')
@@ -372,7 +759,7 @@ class ConnectionContextManager:
             ctx_span_reset(self._ctx_token)
             raise
         else:
-            pool_queue = self._db._pool._queue  # noqa
+            pool_queue = self._pool._queue  # noqa
             pg_conn = self._conn._con  # noqa
             pid = pg_conn.get_server_pid()
             span.tag(PgSpan.TAG_POOL_MAX_SIZE, pool_queue.maxsize)
@@ -381,7 +768,7 @@ class ConnectionContextManager:
             span.annotate4adapter(
                 self._db.app.logger.ADAPTER_ZIPKIN,
                 PgSpan.ANN_PID,
-                default_json_encode({'pid': str(pid)}),
+                lambda: default_json_encode({'pid': str(pid)}),
             )
 
             self._pg_conn = self._db._connection_factory(self._db, self._conn)
@@ -391,11 +778,7 @@ class ConnectionContextManager:
     async def __aexit__(
         self, exc_type: type, exc: BaseException, tb: type
     ) -> bool:
-        if (
-            self._conn is None
-            or self._db is None  # noqa
-            or self._db._pool is None
-        ):  # noqa
+        if self._conn is None or self._pool is None:
             raise UserWarning
         if self._ctx_token is not None:
             ctx_span_reset(self._ctx_token)
@@ -403,7 +786,7 @@ class ConnectionContextManager:
             self._span.finish()
         if self._pg_conn is not None:
             self._db._connections.remove(self._pg_conn)  # noqa
-        await self._db._pool.release(self._conn)  # noqa
+        await self._pool.release(self._conn)
         return False
 
 
@@ -427,6 +810,7 @@ class TransactionContextManager:
         self._tr: Optional[asyncpg.transaction.Transaction] = None
         self._span: Optional[PgSpan] = None
         self._ctx_token: Optional[Token] = None
+        self._xact_token: Optional[Token] = None
 
     async def __aenter__(self) -> 'asyncpg.transaction.Transaction':
         if self._conn.in_transaction:
@@ -445,7 +829,7 @@ class TransactionContextManager:
             span.annotate4adapter(
                 self._conn._db.app.logger.ADAPTER_ZIPKIN,
                 PgSpan.ANN_PID,
-                default_json_encode({'pid': str(self._conn.pid)}),
+                lambda: default_json_encode({'pid': str(self._conn.pid)}),
             )
 
             if self._xact_lock is not None:
@@ -463,6 +847,7 @@ class TransactionContextManager:
             span.finish(exception=err)
             ctx_span_reset(self._ctx_token)
             raise
+        self._xact_token = _ctx_xact_conn.set(self._conn)
         return self._tr
 
     async def __aexit__(
@@ -482,19 +867,26 @@ class TransactionContextManager:
                     PgSpan.P8S_NAME_XACT_COMMITED,
                 )
 
-        async with self._conn._lock:
-            if self._span is not None:
-                self._span.annotate(
-                    PgSpan.ANN_XACT_END,
-                    'ROLLBACK' if exc_type is not None else 'COMMIT',
-                )
-            if self._tr is None:  # pragma: no cover
-                raise UserWarning
-            await self._tr.__aexit__(exc_type, exc, tb)
-            self._tr = None
-
-            if self._xact_lock is not None:
-                self._xact_lock.release()
+        try:
+            async with self._conn._lock:
+                if self._span is not None:
+                    self._span.annotate(
+                        PgSpan.ANN_XACT_END,
+                        'ROLLBACK' if exc_type is not None else 'COMMIT',
+                    )
+                if self._tr is None:  # pragma: no cover
+                    raise UserWarning
+                await self._tr.__aexit__(exc_type, exc, tb)
+                self._tr = None
+
+                if self._xact_lock is not None:
+                    self._xact_lock.release()
+        finally:
+            # чтение через Postgres не должно попадать в соединение и после
+            # неудачной фиксации
+            if self._xact_token is not None:
+                _ctx_xact_conn.reset(self._xact_token)
+                self._xact_token = None
 
         if self._conn is None:  # pragma: no cover
             raise UserWarning
@@ -538,36 +930,40 @@ class PreparedStatement:
             span.annotate4adapter(
                 self._conn._db.app.logger.ADAPTER_ZIPKIN,
                 PgSpan.ANN_PID,
-                self._json_encode({'pid': str(self._conn.pid)}),
+                lambda: self._json_encode({'pid': str(self._conn.pid)}),
             )
             span.annotate(PgSpan.ANN_STMT_NAME, self.stmt_name)
             span.annotate4adapter(
                 self._conn._db.app.logger.ADAPTER_ZIPKIN,
                 PgSpan.ANN_STMT_NAME,
-                self._json_encode({'statement_name': self.stmt_name}),
+                lambda: self._json_encode({'statement_name': self.stmt_name}),
             )
             if self._query_name is not None:
                 span.tag(PgSpan.TAG_QUERY_NAME, self._query_name)
             async with self._conn._lock:
                 if self._conn._db.cfg.log_query:
-                    args_enc = self._json_encode(args)
+                    args_enc = _LazyJson(self._json_encode, lambda: args)
                     span.annotate(PgSpan.ANN_PARAMS, args_enc)
                     span.annotate4adapter(
                         self._conn._db.app.logger.ADAPTER_ZIPKIN,
                         PgSpan.ANN_PARAMS,
-                        self._json_encode({'query_params': args_enc}),
+                        lambda: self._json_encode(
+                            {'query_params': args_enc()}
+                        ),
                     )
 
                 res = await self._pg_stmt.fetchrow(*args, timeout=timeout)
 
                 if self._conn._db.cfg.log_result:
-                    _res = dict(res) if res is not None else None
-                    res_enc = self._json_encode(_res)
+                    res_enc = _LazyJson(
+                        self._json_encode,
+                        lambda: dict(res) if res is not None else None,
+                    )
                     span.annotate(PgSpan.ANN_RESULT, res_enc)
                     span.annotate4adapter(
                         self._conn._db.app.logger.ADAPTER_ZIPKIN,
                         PgSpan.ANN_RESULT,
-                        self._json_encode({'result': res_enc}),
+                        lambda: self._json_encode({'result': res_enc()}),
                     )
 
                 return res
@@ -589,41 +985,108 @@ class PreparedStatement:
             span.annotate4adapter(
                 self._conn._db.app.logger.ADAPTER_ZIPKIN,
                 PgSpan.ANN_PID,
-                self._json_encode({'pid': str(self._conn.pid)}),
+                lambda: self._json_encode({'pid': str(self._conn.pid)}),
             )
             span.annotate(PgSpan.ANN_STMT_NAME, self.stmt_name)
             span.annotate4adapter(
                 self._conn._db.app.logger.ADAPTER_ZIPKIN,
                 PgSpan.ANN_STMT_NAME,
-                self._json_encode({'statement_name': self.stmt_name}),
+                lambda: self._json_encode({'statement_name': self.stmt_name}),
             )
             if self._query_name is not None:
                 span.tag(PgSpan.TAG_QUERY_NAME, self._query_name)
             async with self._conn._lock:
                 if self._conn._db.cfg.log_query:
-                    args_enc = self._json_encode(args)
+                    args_enc = _LazyJson(self._json_encode, lambda: args)
                     span.annotate(PgSpan.ANN_PARAMS, args_enc)
                     span.annotate4adapter(
                         self._conn._db.app.logger.ADAPTER_ZIPKIN,
                         PgSpan.ANN_PARAMS,
-                        self._json_encode({'query_params': args_enc}),
+                        lambda: self._json_encode(
+                            {'query_params': args_enc()}
+                        ),
                     )
 
                 res = await self._pg_stmt.fetch(*args, timeout=timeout)
 
                 if self._conn._db.cfg.log_result:
-                    res_dict = [dict(row) for row in res]
-                    res_enc = self._json_encode(res_dict)
+                    res_enc = _LazyJson(
+                        self._json_encode, lambda: [dict(row) for row in res]
+                    )
                     span.annotate(PgSpan.ANN_RESULT, res_enc)
                     span.annotate4adapter(
                         self._conn._db.app.logger.ADAPTER_ZIPKIN,
                         PgSpan.ANN_RESULT,
-                        self._json_encode({'result': res_enc}),
+                        lambda: self._json_encode({'result': res_enc()}),
                     )
 
                 return res
 
 
+class _LazyJson:
+    # значение кодируется в JSON при первом чтении аннотации адаптером
+    # и используется повторно для остальных адаптеров
+    def __init__(
+        self, encode: Callable[[Any], str], value: Callable[[], Any]
+    ) -> None:
+        self._encode = encode
+        self._value = value
+        self._res: Optional[str] = None
+
+    def __call__(self) -> str:
+        if self._res is None:
+            self._res = self._encode(self._value())
+        return self._res
+
+
+class _CopyCounter:
+    # подсчет байт, переданных через COPY в потоковом режиме
+    def __init__(self) -> None:
+        self.bytes: Optional[int] = None
+
+    def source(self, source: Any) -> Any:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            self.bytes = memoryview(source).nbytes
+        elif isinstance(source, collections.abc.AsyncIterable):
+            self.bytes = 0
+            return self._iter(source)
+        return source
+
+    async def _iter(self, source: AsyncIterable[bytes]) -> AsyncGenerator:
+        async for data in source:
+            self.bytes += len(data)  # type: ignore
+            yield data
+
+    def output(self, output: Any) -> Any:
+        if not callable(output) or hasattr(output, 'write'):
+            return output
+        self.bytes = 0
+
+        async def _writer(data: bytes) -> None:
+            self.bytes += len(data)  # type: ignore
+            await output(data)
+
+        return _writer
+
+
+def _copy_rows(status: str) -> int:
+    # статус команды: "COPY <количество строк>"
+    return int(status.split()[-1])
+
+
+async def _chunks(
+    records: AsyncIterable[Sequence[Any]], size: int
+) -> AsyncGenerator[List[Sequence[Any]], None]:
+    chunk: List[Sequence[Any]] = []
+    async for record in records:
+        chunk.append(record)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if len(chunk) > 0:
+        yield chunk
+
+
 class Connection:
     def __init__(
         self,
@@ -636,6 +1099,7 @@ class Connection:
         self._pid = conn.get_server_pid()
         self._lock = asyncio.Lock()
         self._xact_lock = asyncio.Lock()
+        self._iterating = False
         self._json_encode = json_encode
 
     @property
@@ -679,7 +1143,7 @@ class Connection:
                 span.annotate4adapter(
                     self._db.app.logger.ADAPTER_ZIPKIN,
                     PgSpan.ANN_PID,
-                    self._json_encode({'pid': str(self.pid)}),
+                    lambda: self._json_encode({'pid': str(self.pid)}),
                 )
 
                 if self._db.cfg.log_query:
@@ -687,14 +1151,18 @@ class Connection:
                     span.annotate4adapter(
                         self._db.app.logger.ADAPTER_ZIPKIN,
                         PgSpan.ANN_QUERY,
-                        self._json_encode({'query': dedent(query).strip()}),
+                        lambda: self._json_encode(
+                            {'query': dedent(query).strip()}
+                        ),
                     )
-                    args_enc = self._json_encode(args)
+                    args_enc = _LazyJson(self._json_encode, lambda: args)
                     span.annotate(PgSpan.ANN_PARAMS, args_enc)
                     span.annotate4adapter(
                         self._db.app.logger.ADAPTER_ZIPKIN,
                         PgSpan.ANN_PARAMS,
-                        self._json_encode({'query_params': args_enc}),
+                        lambda: self._json_encode(
+                            {'query_params': args_enc()}
+                        ),
                     )
                 res = await self._conn.execute(query, *args, timeout=timeout)
                 if self._db.cfg.log_result:
@@ -702,7 +1170,7 @@ class Connection:
                     span.annotate4adapter(
                         self._db.app.logger.ADAPTER_ZIPKIN,
                         PgSpan.ANN_RESULT,
-                        self._json_encode({'result': str(res)}),
+                        lambda: self._json_encode({'result': str(res)}),
                     )
                 return res
 
@@ -730,7 +1198,7 @@ class Connection:
                 span.annotate4adapter(
                     self._db.app.logger.ADAPTER_ZIPKIN,
                     PgSpan.ANN_PID,
-                    self._json_encode({'pid': str(self.pid)}),
+                    lambda: self._json_encode({'pid': str(self.pid)}),
                 )
 
                 if self._db.cfg.log_query:
@@ -738,14 +1206,18 @@ class Connection:
                     span.annotate4adapter(
                         self._db.app.logger.ADAPTER_ZIPKIN,
                         PgSpan.ANN_QUERY,
-                        self._json_encode({'query': dedent(query).strip()}),
+                        lambda: self._json_encode(
+                            {'query': dedent(query).strip()}
+                        ),
                     )
-                    args_enc = self._json_encode(args)
+                    args_enc = _LazyJson(self._json_encode, lambda: args)
                     span.annotate(PgSpan.ANN_PARAMS, args_enc)
                     span.annotate4adapter(
                         self._db.app.logger.ADAPTER_ZIPKIN,
                         PgSpan.ANN_PARAMS,
-                        self._json_encode({'query_params': args_enc}),
+                        lambda: self._json_encode(
+                            {'query_params': args_enc()}
+                        ),
                     )
                 res = await self._conn.executemany(
                     query, args, timeout=timeout
@@ -755,7 +1227,7 @@ class Connection:
                     span.annotate4adapter(
                         self._db.app.logger.ADAPTER_ZIPKIN,
                         PgSpan.ANN_RESULT,
-                        self._json_encode({'result': str(res)}),
+                        lambda: self._json_encode({'result': str(res)}),
                     )
                 return res
 
@@ -784,31 +1256,37 @@ class Connection:
                 span.annotate4adapter(
                     self._db.app.logger.ADAPTER_ZIPKIN,
                     PgSpan.ANN_PID,
-                    self._json_encode({'pid': str(self.pid)}),
+                    lambda: self._json_encode({'pid': str(self.pid)}),
                 )
                 if self._db.cfg.log_query:
                     span.annotate(PgSpan.ANN_QUERY, query)
                     span.annotate4adapter(
                         self._db.app.logger.ADAPTER_ZIPKIN,
                         PgSpan.ANN_QUERY,
-                        self._json_encode({'query': dedent(query).strip()}),
+                        lambda: self._json_encode(
+                            {'query': dedent(query).strip()}
+                        ),
                     )
-                    args_enc = self._json_encode(args)
+                    args_enc = _LazyJson(self._json_encode, lambda: args)
                     span.annotate(PgSpan.ANN_PARAMS, args_enc)
                     span.annotate4adapter(
                         self._db.app.logger.ADAPTER_ZIPKIN,
                         PgSpan.ANN_PARAMS,
-                        self._json_encode({'query_params': args_enc}),
+                        lambda: self._json_encode(
+                            {'query_params': args_enc()}
+                        ),
                     )
                 res = await self._conn.fetchrow(query, *args, timeout=timeout)
                 if self._db.cfg.log_result:
-                    _res = dict(res) if res is not None else None
-                    res_enc = self._json_encode(_res)
+                    res_enc = _LazyJson(
+                        self._json_encode,
+                        lambda: dict(res) if res is not None else None,
+                    )
                     span.annotate(PgSpan.ANN_RESULT, res_enc)
                     span.annotate4adapter(
                         self._db.app.logger.ADAPTER_ZIPKIN,
                         PgSpan.ANN_RESULT,
-                        self._json_encode({'result': res_enc}),
+                        lambda: self._json_encode({'result': res_enc()}),
                     )
                 if res is None:
                     return None
@@ -842,7 +1320,7 @@ class Connection:
                 span.annotate4adapter(
                     self._db.app.logger.ADAPTER_ZIPKIN,
                     PgSpan.ANN_PID,
-                    self._json_encode({'pid': str(self.pid)}),
+                    lambda: self._json_encode({'pid': str(self.pid)}),
                 )
 
                 if self._db.cfg.log_query:
@@ -850,24 +1328,29 @@ class Connection:
                     span.annotate4adapter(
                         self._db.app.logger.ADAPTER_ZIPKIN,
                         PgSpan.ANN_QUERY,
-                        self._json_encode({'query': dedent(query).strip()}),
+                        lambda: self._json_encode(
+                            {'query': dedent(query).strip()}
+                        ),
                     )
-                    args_enc = self._json_encode(args)
+                    args_enc = _LazyJson(self._json_encode, lambda: args)
                     span.annotate(PgSpan.ANN_PARAMS, args_enc)
                     span.annotate4adapter(
                         self._db.app.logger.ADAPTER_ZIPKIN,
                         PgSpan.ANN_PARAMS,
-                        self._json_encode({'query_params': args_enc}),
+                        lambda: self._json_encode(
+                            {'query_params': args_enc()}
+                        ),
                     )
                 res = await self._conn.fetch(query, *args, timeout=timeout)
                 if self._db.cfg.log_result:
-                    res_dict = [dict(row) for row in res]
-                    res_enc = self._json_encode(res_dict)
+                    res_enc = _LazyJson(
+                        self._json_encode, lambda: [dict(row) for row in res]
+                    )
                     span.annotate(PgSpan.ANN_RESULT, res_enc)
                     span.annotate4adapter(
                         self._db.app.logger.ADAPTER_ZIPKIN,
                         PgSpan.ANN_RESULT,
-                        self._json_encode({'result': res_enc}),
+                        lambda: self._json_encode({'result': res_enc()}),
                     )
 
                 if model_cls is not None:
@@ -897,14 +1380,16 @@ class Connection:
                 span.annotate4adapter(
                     self._db.app.logger.ADAPTER_ZIPKIN,
                     PgSpan.ANN_PID,
-                    self._json_encode({'pid': str(self.pid)}),
+                    lambda: self._json_encode({'pid': str(self.pid)}),
                 )
                 if self._db.cfg.log_query:
                     span.annotate(PgSpan.ANN_QUERY, query)
                     span.annotate4adapter(
                         self._db.app.logger.ADAPTER_ZIPKIN,
                         PgSpan.ANN_QUERY,
-                        self._json_encode({'query': dedent(query).strip()}),
+                        lambda: self._json_encode(
+                            {'query': dedent(query).strip()}
+                        ),
                     )
                 pg_stmt = await self._conn.prepare(query, timeout=timeout)
                 stmt_name = pg_stmt._state.name
@@ -916,7 +1401,262 @@ class Connection:
                 span.annotate4adapter(
                     self._db.app.logger.ADAPTER_ZIPKIN,
                     PgSpan.ANN_STMT_NAME,
-                    self._json_encode({'statement_name': stmt_name}),
+                    lambda: self._json_encode({'statement_name': stmt_name}),
                 )
 
                 return stmt
+
+    async def copy_in(
+        self,
+        table_name: str,
+        *,
+        records: Optional[CopyRecords] = None,
+        source: Any = None,
+        columns: Optional[List[str]] = None,
+        schema_name: Optional[str] = None,
+        timeout: float = None,
+        query_name: Optional[str] = None,
+        **options: Any,
+    ) -> str:
+        # records: строки для бинарного COPY (в т.ч. асинхронный итератор),
+        # source: данные в формате COPY (bytes, файл, путь или асинхронный
+        # итератор bytes), options: параметры формата для source
+        if (records is None) == (source is None):
+            raise UserWarning('Either records or source is required')
+        with wrap2span(
+            name=PgSpan.NAME_COPY_IN,
+            kind=PgSpan.KIND_CLIENT,
+            cls=PgSpan,
+            app=self._db.app,
+        ) as span:
+            span.set_name4adapter(
+                self._db.app.logger.ADAPTER_PROMETHEUS, PgSpan.P8S_NAME_COPY_IN
+            )
+            if query_name is not None:
+                span.tag(PgSpan.TAG_QUERY_NAME, query_name)
+            async with self._lock:
+                span.annotate(PgSpan.ANN_PID, self.pid)
+                span.annotate4adapter(
+                    self._db.app.logger.ADAPTER_ZIPKIN,
+                    PgSpan.ANN_PID,
+                    lambda: self._json_encode({'pid': str(self.pid)}),
+                )
+                if self._db.cfg.log_query:
+                    query = 'COPY %s%s' % (
+                        schema_name + '.' if schema_name else '',
+                        table_name,
+                    )
+                    span.annotate(PgSpan.ANN_QUERY, query)
+                    span.annotate4adapter(
+                        self._db.app.logger.ADAPTER_ZIPKIN,
+                        PgSpan.ANN_QUERY,
+                        lambda: self._json_encode({'query': query}),
+                    )
+                counter = _CopyCounter()
+                if source is not None:
+                    res = await self._conn.copy_to_table(
+                        table_name,
+                        source=counter.source(source),
+                        columns=columns,
+                        schema_name=schema_name,
+                        timeout=timeout,
+                        **options,
+                    )
+                elif isinstance(records, collections.abc.AsyncIterable):
+                    # строки читаются порциями, не накапливаясь в памяти;
+                    # вне транзакции на время загрузки открывается своя
+                    # транзакция, чтобы ошибка не оставила часть порций
+                    xact = None
+                    if not self.in_transaction:
+                        xact = self._conn.transaction()
+                        await xact.start()
+                    rows = 0
+                    try:
+                        async for chunk in _chunks(records, COPY_CHUNK_SIZE):
+                            rows += _copy_rows(
+                                await self._conn.copy_records_to_table(
+                                    table_name,
+                                    records=chunk,
+                                    columns=columns,
+                                    schema_name=schema_name,
+                                    timeout=timeout,
+                                )
+                            )
+                    except BaseException:
+                        if xact is not None:
+                            await xact.rollback()
+                        raise
+                    if xact is not None:
+                        await xact.commit()
+                    res = 'COPY %d' % rows
+                else:
+                    res = await self._conn.copy_records_to_table(
+                        table_name,
+                        records=records,
+                        columns=columns,
+                        schema_name=schema_name,
+                        timeout=timeout,
+                    )
+                span.tag(PgSpan.TAG_COPY_ROWS, _copy_rows(res))
+                if counter.bytes is not None:
+                    span.tag(PgSpan.TAG_COPY_BYTES, counter.bytes)
+                if self._db.cfg.log_result:
+                    span.annotate(PgSpan.ANN_RESULT, str(res))
+                    span.annotate4adapter(
+                        self._db.app.logger.ADAPTER_ZIPKIN,
+                        PgSpan.ANN_RESULT,
+                        lambda: self._json_encode({'result': str(res)}),
+                    )
+                return res
+
+    async def copy_out(
+        self,
+        query: str,
+        *args: Any,
+        output: Any,
+        timeout: float = None,
+        query_name: Optional[str] = None,
+        **options: Any,
+    ) -> str:
+        # output: файл, путь или корутина, получающая данные порциями
+        with wrap2span(
+            name=PgSpan.NAME_COPY_OUT,
+            kind=PgSpan.KIND_CLIENT,
+            cls=PgSpan,
+            app=self._db.app,
+        ) as span:
+            span.set_name4adapter(
+                self._db.app.logger.ADAPTER_PROMETHEUS,
+                PgSpan.P8S_NAME_COPY_OUT,
+            )
+            if query_name is not None:
+                span.tag(PgSpan.TAG_QUERY_NAME, query_name)
+            async with self._lock:
+                span.annotate(PgSpan.ANN_PID, self.pid)
+                span.annotate4adapter(
+                    self._db.app.logger.ADAPTER_ZIPKIN,
+                    PgSpan.ANN_PID,
+                    lambda: self._json_encode({'pid': str(self.pid)}),
+                )
+                if self._db.cfg.log_query:
+                    span.annotate(PgSpan.ANN_QUERY, query)
+                    span.annotate4adapter(
+                        self._db.app.logger.ADAPTER_ZIPKIN,
+                        PgSpan.ANN_QUERY,
+                        lambda: self._json_encode(
+                            {'query': dedent(query).strip()}
+                        ),
+                    )
+                    args_enc = _LazyJson(self._json_encode, lambda: args)
+                    span.annotate(PgSpan.ANN_PARAMS, args_enc)
+                    span.annotate4adapter(
+                        self._db.app.logger.ADAPTER_ZIPKIN,
+                        PgSpan.ANN_PARAMS,
+                        lambda: self._json_encode(
+                            {'query_params': args_enc()}
+                        ),
+                    )
+                counter = _CopyCounter()
+                res = await self._conn.copy_from_query(
+                    query,
+                    *args,
+                    output=counter.output(output),
+                    timeout=timeout,
+                    **options,
+                )
+                span.tag(PgSpan.TAG_COPY_ROWS, _copy_rows(res))
+                if counter.bytes is not None:
+                    span.tag(PgSpan.TAG_COPY_BYTES, counter.bytes)
+                if self._db.cfg.log_result:
+                    span.annotate(PgSpan.ANN_RESULT, str(res))
+                    span.annotate4adapter(
+                        self._db.app.logger.ADAPTER_ZIPKIN,
+                        PgSpan.ANN_RESULT,
+                        lambda: self._json_encode({'result': str(res)}),
+                    )
+                return res
+
+    async def iterate(
+        self,
+        query: str,
+        *args: Any,
+        prefetch: Optional[int] = None,
+        timeout: float = None,
+        query_name: Optional[str] = None,
+        model_cls: Optional[Type[BaseModel]] = None,
+    ) -> AsyncGenerator[Union[asyncpg.Record, BaseModel], None]:
+        # строки читаются курсором на стороне сервера порциями по prefetch,
+        # вне транзакции на время чтения открывается своя транзакция.
+        # Спан не становится текущим, так как между строками выполняется
+        # код вызывающего. Прерванную итерацию нужно закрыть через aclose()
+        pspan = ctx_span_get()
+        if pspan is None:
+            span: PgSpan = self._db.app.logger.span_new(  # type: ignore
+                PgSpan.NAME_ITERATE, PgSpan.KIND_CLIENT, cls=PgSpan
+            )
+        else:
+            span = pspan.new_child(  # type: ignore
+                PgSpan.NAME_ITERATE, PgSpan.KIND_CLIENT, cls=PgSpan
+            )
+        span.set_name4adapter(
+            self._db.app.logger.ADAPTER_PROMETHEUS, PgSpan.P8S_NAME_ITERATE
+        )
+        if query_name is not None:
+            span.tag(PgSpan.TAG_QUERY_NAME, query_name)
+        span.start()
+        rows = 0
+        try:
+            async with self._lock:
+                span.annotate(PgSpan.ANN_PID, self.pid)
+                span.annotate4adapter(
+                    self._db.app.logger.ADAPTER_ZIPKIN,
+                    PgSpan.ANN_PID,
+                    lambda: self._json_encode({'pid': str(self.pid)}),
+                )
+                if self._db.cfg.log_query:
+                    span.annotate(PgSpan.ANN_QUERY, query)
+                    span.annotate4adapter(
+                        self._db.app.logger.ADAPTER_ZIPKIN,
+                        PgSpan.ANN_QUERY,
+                        lambda: self._json_encode(
+                            {'query': dedent(query).strip()}
+                        ),
+                    )
+                    args_enc = _LazyJson(self._json_encode, lambda: args)
+                    span.annotate(PgSpan.ANN_PARAMS, args_enc)
+                    span.annotate4adapter(
+                        self._db.app.logger.ADAPTER_ZIPKIN,
+                        PgSpan.ANN_PARAMS,
+                        lambda: self._json_encode(
+                            {'query_params': args_enc()}
+                        ),
+                    )
+                xact = None
+                if not self.in_transaction:
+                    xact = self._conn.transaction()
+                    await xact.start()
+                self._iterating = True
+                try:
+                    cursor = self._conn.cursor(
+                        query, *args, prefetch=prefetch, timeout=timeout
+                    )
+                    async for row in cursor:
+                        rows += 1
+                        if model_cls is not None:
+                            yield model_cls(**(dict(row)))
+                        else:
+                            yield row
+                except BaseException:
+                    self._iterating = False
+                    if xact is not None:
+                        await xact.rollback()
+                    raise
+                self._iterating = False
+                if xact is not None:
+                    await xact.commit()
+        except Exception as err:
+            span.error(err)
+            raise
+        finally:
+            span.tag(PgSpan.TAG_ROWS, rows)
+            span.finish()
@@ -1,7 +1,7 @@
 import re
-from typing import Dict
+from typing import Dict, List
 
-from prometheus_client import Histogram, start_http_server
+from prometheus_client import Gauge, Histogram, start_http_server
 from pydantic import Field
 
 import ipapp.logger  # noqa
@@ -90,11 +90,66 @@ DEFAULT_HISTOGRAM_LABELS: LabelsCfg = {  # {name: {label: tag}, }
         'method': 'rpc.method',
         'code': 'rpc.code',
     },
+    'task_exec': {
+        'le': DEFAULT_LE,  # le mapping to quantiles
+        'error': 'error.class',
+        'name': 'dbtm.task_name',
+        'status': 'dbtm.task_status',
+    },
 }
 DEFAULT_HISTOGRAM_DOCS = {
     'http_in': 'Incoming HTTP request',
     'http_out': 'Outgoing HTTP request',
+    'task_exec': 'Task execution',
+}
+
+DEFAULT_GAUGE_LABELS: LabelsCfg = {  # {name: {label: tag}, }
+    'task_pending': {
+        'span': 'task_queue',  # span name
+        'value': 'dbtm.queue.pending',  # tag with gauge value
+        'queue': 'dbtm.queue',
+    },
+    'task_due': {
+        'span': 'task_queue',  # span name
+        'value': 'dbtm.queue.due',  # tag with gauge value
+        'queue': 'dbtm.queue',
+    },
+    'task_lag': {
+        'span': 'task_queue',  # span name
+        'value': 'dbtm.queue.lag',  # tag with gauge value
+        'queue': 'dbtm.queue',
+    },
+    'db_pool_size': {
+        'span': 'db_pool',  # span name
+        'value': 'db.pool.size',  # tag with gauge value
+        'endpoint': 'db.endpoint',
+    },
+    'db_pool_free': {
+        'span': 'db_pool',  # span name
+        'value': 'db.pool.free',  # tag with gauge value
+        'endpoint': 'db.endpoint',
+    },
+    'db_replica_healthy': {
+        'span': 'db_pool',  # span name
+        'value': 'db.replica.healthy',  # tag with gauge value
+        'endpoint': 'db.endpoint',
+    },
+    'db_replica_lag': {
+        'span': 'db_pool',  # span name
+        'value': 'db.replica.lag',  # tag with gauge value
+        'endpoint': 'db.endpoint',
+    },
 }
+DEFAULT_GAUGE_DOCS = {
+    'task_pending': 'Number of tasks waiting for execution',
+    'task_due': 'Number of tasks whose eta has come',
+    'task_lag': 'Seconds since the eta of the oldest due task',
+    'db_pool_size': 'Maximum number of connections in the pool',
+    'db_pool_free': 'Number of free connections in the pool',
+    'db_replica_healthy': 'Whether the endpoint receives read queries',
+    'db_replica_lag': 'Replication lag of the endpoint in seconds',
+}
+GAUGE_SPECIAL_LABELS = ('span', 'value')
 
 
 class PrometheusConfig(AbcConfig):
@@ -105,6 +160,8 @@ class PrometheusConfig(AbcConfig):
     port: int = Field(9213, description="Порт публикации Prometheus метрик")
     hist_labels: LabelsCfg = {}
     hist_docs: Dict[str, str] = {}
+    gauge_labels: LabelsCfg = {}
+    gauge_docs: Dict[str, str] = {}
 
 
 class PrometheusAdapter(AbcAdapter):
@@ -116,6 +173,10 @@ class PrometheusAdapter(AbcAdapter):
         self.p8s_hists: Dict[str, Histogram] = {}
         self.p8s_hist_labels: LabelsCfg = {}
         self.p8s_hist_docs: Dict[str, str] = {}
+        self.p8s_gauges: Dict[str, Gauge] = {}
+        self.p8s_gauge_labels: LabelsCfg = {}
+        # {span name: [gauge name, ]}
+        self.p8s_gauge_spans: Dict[str, List[str]] = {}
 
     async def start(self, logger: 'ipapp.logger.Logger') -> None:
         self.p8s_hists = {}  # Histograms
@@ -141,6 +202,25 @@ class PrometheusAdapter(AbcAdapter):
             self.p8s_hists[hist_name] = Histogram(
                 hist_name, doc, labelnames=labelnames, buckets=buckets
             )
+
+        self.p8s_gauges = {}
+        self.p8s_gauge_spans = {}
+        self.p8s_gauge_labels = dict_merge(
+            DEFAULT_GAUGE_LABELS, self.cfg.gauge_labels
+        )
+        gauge_docs = dict_merge(DEFAULT_GAUGE_DOCS, self.cfg.gauge_docs)
+        for gauge_name, labels_cfg in self.p8s_gauge_labels.items():
+            labelnames = [
+                label
+                for label in labels_cfg.keys()
+                if label not in GAUGE_SPECIAL_LABELS
+            ]
+            doc = gauge_docs.get(gauge_name) or gauge_name
+            self.p8s_gauges[gauge_name] = Gauge(
+                gauge_name, doc, labelnames=labelnames
+            )
+            span_name = labels_cfg.get('span', gauge_name)
+            self.p8s_gauge_spans.setdefault(span_name, []).append(gauge_name)
         start_http_server(self.cfg.port, self.cfg.addr)
 
     def handle(self, span: Span) -> None:
@@ -165,6 +245,24 @@ class PrometheusAdapter(AbcAdapter):
                 hist = hist.labels(**labels)
             hist.observe(span.duration)
 
+        for gauge_name in self.p8s_gauge_spans.get(name or '', []):
+            self._set_gauge(gauge_name, tags)
+
+    def _set_gauge(self, gauge_name: str, tags: Dict[str, str]) -> None:
+        labels_cfg = self.p8s_gauge_labels[gauge_name]
+        value = tags.get(labels_cfg.get('value', 'value'))
+        if value is None:
+            return
+        gauge: Gauge = self.p8s_gauges[gauge_name]
+        labels = {
+            label: tags.get(tag) or ''
+            for label, tag in labels_cfg.items()
+            if label not in GAUGE_SPECIAL_LABELS
+        }
+        if labels:
+            gauge = gauge.labels(**labels)
+        gauge.set(float(value))
+
     async def stop(self) -> None:
         if self.cfg is None:
             raise AdapterConfigurationError(
@@ -1,5 +1,14 @@
 import asyncio
-from typing import Any, Callable, Coroutine, List, Mapping, Optional, Type
+from typing import (
+    Any,
+    Callable,
+    Coroutine,
+    List,
+    Mapping,
+    Optional,
+    Set,
+    Type,
+)
 
 import ipapp.app
 
@@ -23,6 +32,7 @@ class Logger:
         self.app = app
         self._configs: List[Coroutine[Any, Any, None]] = []
         self.adapters: List[AbcAdapter] = []
+        self._adapter_names: Set[str] = set()
         self.default_sampled = True
         self.default_debug = False
         self._started = False
@@ -89,8 +99,12 @@ class Logger:
         #         raise UserWarning('Invalid configuration class')
         self._configs.append(adapter.start(self))
         self.adapters.append(adapter)
+        self._adapter_names.add(adapter.name)
         return adapter
 
+    def has_adapter(self, name: str) -> bool:
+        return name in self._adapter_names
+
     def add_before_handle_cb(self, fn: Callable[[Span], None]) -> None:
         self._before_handle_callbacks.append(fn)
 
@@ -4,7 +4,17 @@ import time
 import traceback
 from contextvars import Token
 from types import TracebackType
-from typing import Any, Dict, List, Mapping, Optional, Tuple, Type
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    Optional,
+    Tuple,
+    Type,
+    Union,
+)
 
 import aiozipkin.helpers as azh
 import aiozipkin.utils as azu
@@ -14,6 +24,20 @@ import ipapp.misc as misc
 
 RE_P8S_METRIC_NAME = re.compile(r'[^a-zA-Z0-9_]')
 
+# значение аннотации или функция, вычисляющая его при первом чтении
+AnnValue = Union[str, Callable[[], Any]]
+Annotations = Dict[str, List[Tuple[AnnValue, float]]]
+
+
+def _resolve_annotations(
+    anns: Annotations,
+) -> Dict[str, List[Tuple[str, float]]]:
+    for items in anns.values():
+        for i, (value, ts) in enumerate(items):
+            if callable(value):
+                items[i] = (str(value()), ts)
+    return anns  # type: ignore
+
 
 class Span:
     KIND_CLIENT = 'CLIENT'
@@ -49,10 +73,8 @@ class Span:
         self._name: str = ''
         self._name4adapter: Dict[str, str] = {}
         self._kind: Optional[str] = None
-        self._annotations: Dict[str, List[Tuple[str, float]]] = {}
-        self._annotations4adapter: Dict[
-            str, Dict[str, List[Tuple[str, float]]]
-        ] = {}
+        self._annotations: Annotations = {}
+        self._annotations4adapter: Dict[str, Annotations] = {}
         self._tags: Dict[str, str] = {}
         self._tags4adapter: Dict[str, Dict[str, str]] = {}
         self._start_stamp: Optional[float] = None
@@ -217,25 +239,36 @@ class Span:
 
     @property
     def annotations(self) -> Dict[str, List[Tuple[str, float]]]:
-        return self._annotations
+        return _resolve_annotations(self._annotations)
 
     def annotate(
         self, kind: str, value: Any, ts: Optional[float] = None
     ) -> 'Span':
+        """
+        value может быть функцией без аргументов: она будет вызвана только
+        при чтении аннотации адаптером
+        """
         if kind not in self._annotations:
             self._annotations[kind] = []
-        self._annotations[kind].append((str(value), ts or time.time()))
+        if not callable(value):
+            value = str(value)
+        self._annotations[kind].append((value, ts or time.time()))
         return self
 
     def annotate4adapter(
         self, adapter: str, kind: str, value: Any, ts: Optional[float] = None
     ) -> None:
+        if self.logger is not None and not self.logger.has_adapter(adapter):
+            # адаптер не подключен, аннотацию некому прочитать
+            return
         if adapter not in self._annotations4adapter:
             self._annotations4adapter[adapter] = {}
         if kind not in self._annotations4adapter[adapter]:
             self._annotations4adapter[adapter][kind] = []
+        if not callable(value):
+            value = str(value)
         self._annotations4adapter[adapter][kind].append(
-            (str(value), ts or time.time())
+            (value, ts or time.time())
         )
 
     def get_annotations4adapter(
@@ -244,10 +277,10 @@ class Span:
         if adapter not in self._annotations4adapter:
             anns: Dict[str, List[Tuple[str, float]]] = {}
         else:
-            anns = self._annotations4adapter[adapter]
+            anns = _resolve_annotations(self._annotations4adapter[adapter])
 
         if merge:
-            return misc.dict_merge(self._annotations, anns)
+            return misc.dict_merge(self.annotations, anns)
         else:
             return anns
 
@@ -17,6 +17,8 @@ class JsonRpcHttpHandlerConfig(BaseModel):
     discover_enabled: bool = True
     cors_enabled: bool = True
     cors_origin: str = 'https://playground.open-rpc.org'
+    thread_pool_size: Optional[int] = None
+    process_pool_size: Optional[int] = None
 
 
 class JsonRpcHttpHandler(_ServerHandler):
@@ -41,6 +43,8 @@ class JsonRpcHttpHandler(_ServerHandler):
             discover_enabled=self._cfg.discover_enabled,
             servers=self._servers,
             external_docs=self._external_docs,
+            thread_pool_size=self._cfg.thread_pool_size,
+            process_pool_size=self._cfg.process_pool_size,
         )
         if self._cfg.healthcheck_path:
             self._setup_healthcheck(self._cfg.healthcheck_path)
@@ -52,6 +56,7 @@ class JsonRpcHttpHandler(_ServerHandler):
 
     async def stop(self) -> None:
         await self._rpc.stop_scheduler()
+        self._rpc.shutdown()
 
     def _get_cors_headers(self) -> Dict[str, str]:
         if self._cfg.cors_enabled:
@@ -76,12 +76,18 @@ class JsonRpcExecutor:
         scheduler_kwargs: Optional[Dict[str, Any]] = None,
         servers: Optional[List[Server]] = None,
         external_docs: Optional[ExternalDocs] = None,
+        thread_pool_size: Optional[int] = None,
+        process_pool_size: Optional[int] = None,
     ) -> None:
         self._registry = registry
         self._app = app
         self._discover_enabled = discover_enabled
         self._discover_result: Optional[Dict[str, Any]] = None
-        self._ex = _Executor(registry)
+        self._ex = _Executor(
+            registry,
+            thread_pool_size=thread_pool_size,
+            process_pool_size=process_pool_size,
+        )
         self._loop = loop
         self._protocol = rpc.JSONRPCProtocol()
         self._scheduler: Optional[aiojobs.Scheduler] = None
@@ -100,6 +106,9 @@ class JsonRpcExecutor:
             await self._scheduler.close()
             self._scheduler = None
 
+    def shutdown(self) -> None:
+        self._ex.shutdown()
+
     async def exec(self, request: bytes) -> bytes:
         try:
             req = self._parse_request(request)
@@ -52,6 +52,16 @@ class RpcServerChannelConfig(PikaChannelConfig):
     propagate_trace: bool = Field(
         True, description="Передавать заголовки спанов в заголовках сообщений"
     )
+    thread_pool_size: Optional[int] = Field(
+        None,
+        description="Количество потоков для методов с executor='thread'. "
+        "Если не задано, используется пул цикла событий по умолчанию",
+    )
+    process_pool_size: Optional[int] = Field(
+        None,
+        description="Количество процессов для методов с executor='process'. "
+        "Если не задано, равно количеству процессоров",
+    )
 
 
 class RpcClientChannelConfig(PikaChannelConfig):
@@ -87,7 +97,12 @@ class RpcServerChannel(PikaChannel):
         )
         await self.qos(prefetch_count=self.cfg.prefetch_count)
         self._lock = asyncio.Lock()
-        self._rpc = JsonRpcExecutor(self.registry, self.amqp.app)
+        self._rpc = JsonRpcExecutor(
+            self.registry,
+            self.amqp.app,
+            thread_pool_size=self.cfg.thread_pool_size,
+            process_pool_size=self.cfg.process_pool_size,
+        )
 
     async def start(self) -> None:
         await self.consume(self.cfg.queue, self._message)
@@ -96,6 +111,7 @@ class RpcServerChannel(PikaChannel):
         if self._consumer_tag is not None:
             await self.cancel()
             await self._lock.acquire()
+        self._rpc.shutdown()
 
     async def _message(
         self, body: bytes, deliver: Deliver, proprties: Properties
@@ -1,7 +1,10 @@
 import asyncio
+import contextvars
 import inspect
 import warnings
-from functools import wraps
+from concurrent.futures import Executor as PoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial, wraps
 from types import MethodType
 from typing import (
     Any,
@@ -25,6 +28,9 @@ from pydantic import BaseConfig, BaseModel, ValidationError, create_model
 
 from .error import InvalidArguments, MethodNotFound, RpcError
 
+EXECUTOR_THREAD = 'thread'
+EXECUTOR_PROCESS = 'process'
+
 
 class _PydanticConfig(BaseConfig):
     arbitrary_types_allowed = True
@@ -57,6 +63,7 @@ class RpcRegistry(list):
         response_ref: Optional[str] = None,
         validators: Optional[Dict[str, dict]] = None,
         examples: Optional[List[Dict[str, Optional[str]]]] = None,
+        executor: Optional[str] = None,
     ) -> Callable:
         def decorator(func: Callable) -> Callable:
             func_name = name or func.__name__
@@ -74,6 +81,7 @@ class RpcRegistry(list):
                 response_ref,
                 validators,
                 examples,
+                executor,
             )
 
             setattr(func, '__rpc_registry__', self)
@@ -87,6 +95,7 @@ class RpcRegistry(list):
             setattr(func, "__rpc_request_ref__", request_ref)
             setattr(func, "__rpc_response_ref__", response_ref)
             setattr(func, "__rpc_examples__", examples)
+            setattr(func, "__rpc_executor__", executor)
 
             if validators is not None:
                 setattr(func, "__validators__", validators)
@@ -178,6 +187,7 @@ def _validate_method(
     response_ref: Optional[str],
     validators: Optional[Dict[str, dict]],
     examples: Optional[List[Dict[str, Optional[str]]]],
+    executor: Optional[str] = None,
 ) -> None:
     if func_name is not None and not isinstance(func_name, str):
         raise UserWarning('Method name must be a string')
@@ -223,6 +233,8 @@ def _validate_method(
     if examples is not None:
         _validate_examples(examples)
 
+    _validate_executor(func, executor)
+
     if validators is not None:
         unknown = set(validators.keys()) - set(func.__code__.co_varnames)
         if unknown:
@@ -232,6 +244,20 @@ def _validate_method(
             )
 
 
+def _validate_executor(func: Callable, executor: Optional[str]) -> None:
+    if executor is None:
+        return
+    if executor not in (EXECUTOR_THREAD, EXECUTOR_PROCESS):
+        raise UserWarning(
+            'Method executor must be "%s" or "%s"'
+            '' % (EXECUTOR_THREAD, EXECUTOR_PROCESS)
+        )
+    if asyncio.iscoroutinefunction(func):
+        raise UserWarning(
+            'Method executor is not supported for coroutine functions'
+        )
+
+
 def _validate_examples(examples: Any) -> None:
     if not isinstance(examples, list):
         raise UserWarning()
@@ -266,6 +292,7 @@ class _Method:
         self._validators: Dict[str, dict] = {}
         if hasattr(func, '__validators__'):
             self._validators = func.__validators__  # type: ignore
+        self.executor: Optional[str] = getattr(func, '__rpc_executor__', None)
 
     def _analyse_arguments(self, func: Callable) -> None:
         is_method = isinstance(func, MethodType)
@@ -328,6 +355,10 @@ class _Method:
         _kwargs = self._validate_arguments(args, kwargs)
         return self.func(**_kwargs)
 
+    def bind(self, *args: Any, **kwargs: Any) -> Callable[[], Any]:
+        _kwargs = self._validate_arguments(args, kwargs)
+        return partial(self.func, **_kwargs)
+
     def _validate_arguments(
         self, args: Tuple[Any, ...], kwargs: Dict[str, Any]
     ) -> Dict[str, Any]:
@@ -410,8 +441,18 @@ class _Method:
 
 
 class Executor:
-    def __init__(self, registry: Union[RpcRegistry, object]) -> None:
+    def __init__(
+        self,
+        registry: Union[RpcRegistry, object],
+        *,
+        thread_pool_size: Optional[int] = None,
+        process_pool_size: Optional[int] = None,
+    ) -> None:
         self._handler = registry
+        self._thread_pool_size = thread_pool_size
+        self._process_pool_size = process_pool_size
+        self._thread_pool: Optional[ThreadPoolExecutor] = None
+        self._process_pool: Optional[ProcessPoolExecutor] = None
         self._methods: Dict[str, _Method] = {}
         for fn in self.iter_handler(registry):
             name = getattr(fn, '__rpc_name__', fn.__name__)
@@ -450,8 +491,48 @@ class Executor:
         if fn is None:
             raise MethodNotFound()
 
+        if fn.executor is not None:
+            return await self._exec_in_pool(fn, _args, _kwargs)
+
         result = fn(*_args, **_kwargs)
         if asyncio.iscoroutine(result):
             result = await result
 
         return result
+
+    async def _exec_in_pool(
+        self, fn: _Method, args: Tuple[Any, ...], kwargs: Dict[str, Any]
+    ) -> Any:
+        call = fn.bind(*args, **kwargs)
+        loop = asyncio.get_event_loop()
+        if fn.executor == EXECUTOR_PROCESS:
+            return await loop.run_in_executor(self._get_process_pool(), call)
+        # контекст (app, span и т.д.) доступен в обработчике и в потоке
+        ctx = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._get_thread_pool(), ctx.run, call
+        )
+
+    def _get_thread_pool(self) -> Optional[PoolExecutor]:
+        if self._thread_pool_size is None:
+            return None  # executor цикла событий по умолчанию
+        if self._thread_pool is None:
+            self._thread_pool = ThreadPoolExecutor(
+                max_workers=self._thread_pool_size
+            )
+        return self._thread_pool
+
+    def _get_process_pool(self) -> PoolExecutor:
+        if self._process_pool is None:
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self._process_pool_size
+            )
+        return self._process_pool
+
+    def shutdown(self) -> None:
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False)
+            self._thread_pool = None
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=False)
+            self._process_pool = None
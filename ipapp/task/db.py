@@ -1,19 +1,25 @@
 from __future__ import annotations
 
 import asyncio
+import heapq
+import random
 import time
 import traceback
 import warnings
 from contextlib import asynccontextmanager
+from copy import copy
 from dataclasses import dataclass
-from datetime import datetime, timedelta, timezone
+from datetime import date, datetime, timedelta, timezone
+from functools import partial
 from typing import (
     Any,
     AsyncGenerator,
     Callable,
     Dict,
+    Iterable,
     List,
     Optional,
+    Set,
     Tuple,
     Type,
     Union,
@@ -21,6 +27,7 @@ from typing import (
 
 import asyncpg
 import asyncpg.exceptions
+import asyncpg.pool
 import pytz
 from crontab import CronTab
 from pydantic import BaseModel, Field
@@ -45,8 +52,66 @@ STATUS_ERROR = 'error'
 STATUS_RETRY = 'retry'
 STATUS_CANCELED = 'canceled'
 
+QUEUE_DEFAULT = 'default'
 
-CREATE_TABLE_QUERY = """\
+LOG_ALWAYS = 'always'
+LOG_ERRORS_ONLY = 'errors_only'
+LOG_SAMPLED = 'sampled'
+LOG_POLICIES = (LOG_ALWAYS, LOG_ERRORS_ONLY, LOG_SAMPLED)
+
+PARTITIONED_TABLES = ('task_arch', 'task_log')
+
+# колонки, добавленные после первой версии схемы. Значения по умолчанию
+# постоянные, поэтому таблицы не перезаписываются (PostgreSQL 11+), и
+# при запуске колонки добавляются в существующую базу автоматически
+ADD_COLUMNS_QUERY = """\
+ALTER TABLE {schema}.task
+  ADD COLUMN IF NOT EXISTS priority integer NOT NULL DEFAULT 0;
+
+ALTER TABLE {schema}.task
+  ADD COLUMN IF NOT EXISTS queue text NOT NULL DEFAULT 'default';
+
+ALTER TABLE {schema}.task_pending
+  ADD COLUMN IF NOT EXISTS dedupe boolean NOT NULL DEFAULT false;
+
+ALTER TABLE {schema}.task
+  ADD COLUMN IF NOT EXISTS depends_on bigint[];
+"""
+
+# индексы по добавленным колонкам для существующей базы. Запуск с
+# create_database_objects создает их с блокировкой записи в task_pending,
+# поэтому на рабочей базе их создают заранее, каждый запрос отдельно и
+# вне транзакции:
+#     for query in MIGRATE_INDEXES_QUERIES:
+#         await conn.execute(query.format(schema=schema))
+# Индекс, не созданный из-за ошибки, остается помеченным как INVALID: его
+# нужно удалить и выполнить запрос повторно
+MIGRATE_INDEXES_QUERIES = (
+    """\
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_pending_queue_priority_idx
+  ON {schema}.task_pending
+  USING btree
+  (queue, priority, eta)
+  WHERE status = ANY (ARRAY['pending'::{schema}.task_status,
+                            'retry'::{schema}.task_status])""",
+    """\
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS
+  task_pending_reference_dedupe_idx
+  ON {schema}.task_pending
+  USING btree
+  (reference)
+  WHERE dedupe""",
+    """\
+CREATE INDEX CONCURRENTLY IF NOT EXISTS task_pending_depends_on_idx
+  ON {schema}.task_pending
+  USING gin
+  (depends_on)
+  WHERE depends_on IS NOT NULL""",
+)
+
+
+CREATE_TABLE_QUERY = (
+    """\
 
 
 CREATE SCHEMA IF NOT EXISTS {schema};
@@ -122,6 +187,9 @@ CREATE TABLE IF NOT EXISTS {schema}.task_arch
 )
 INHERITS ({schema}.task);
 
+"""
+    + ADD_COLUMNS_QUERY
+    + """\
 CREATE TABLE IF NOT EXISTS {schema}.task_log
 (
   id bigserial NOT NULL,
@@ -150,11 +218,40 @@ CREATE INDEX IF NOT EXISTS task_pending_eta_idx
   WHERE status = ANY (ARRAY['pending'::{schema}.task_status,
                             'retry'::{schema}.task_status]);
 
+CREATE INDEX IF NOT EXISTS task_pending_queue_priority_idx
+  ON {schema}.task_pending
+  USING btree
+  (queue, priority, eta)
+  WHERE status = ANY (ARRAY['pending'::{schema}.task_status,
+                            'retry'::{schema}.task_status]);
+
+DROP INDEX IF EXISTS {schema}.task_pending_priority_idx;
+
+DROP INDEX IF EXISTS {schema}.task_pending_queue_eta_idx;
+
+CREATE INDEX IF NOT EXISTS task_pending_progress_idx
+  ON {schema}.task_pending
+  USING btree
+  (last_stamp)
+  WHERE status = 'progress'::{schema}.task_status;
+
 CREATE INDEX IF NOT EXISTS task_pending_reference_idx
   ON {schema}.task_pending
   USING btree
   (reference);
 
+CREATE UNIQUE INDEX IF NOT EXISTS task_pending_reference_dedupe_idx
+  ON {schema}.task_pending
+  USING btree
+  (reference)
+  WHERE dedupe;
+
+CREATE INDEX IF NOT EXISTS task_pending_depends_on_idx
+  ON {schema}.task_pending
+  USING gin
+  (depends_on)
+  WHERE depends_on IS NOT NULL;
+
 CREATE INDEX IF NOT EXISTS task_arch_reference_idx
   ON {schema}.task_arch
   USING btree
@@ -165,6 +262,7 @@ CREATE INDEX IF NOT EXISTS task_log_task_id_idx
   USING btree
   (task_id);
 """
+)
 
 
 class Task(BaseModel):
@@ -178,6 +276,8 @@ class Task(BaseModel):
     retries: Optional[int]
     trace_id: Optional[str]
     trace_span_id: Optional[str]
+    priority: int = 0
+    queue: str = QUEUE_DEFAULT
 
 
 @dataclass
@@ -189,14 +289,112 @@ class PeriodicTask:
     date_attr: Optional[str] = None
 
 
+@dataclass
+class TaskLimit:
+    max_concurrency: Optional[int] = None
+    rate_limit: Optional[float] = None
+    running: int = 0
+    tokens: float = 0.0
+    stamp: float = 0.0
+
+    def _refill(self, now: float) -> None:
+        if self.rate_limit is None:
+            return
+        self.tokens = min(
+            max(self.rate_limit, 1.0),
+            self.tokens + (now - self.stamp) * self.rate_limit,
+        )
+        self.stamp = now
+
+    def slots(self, now: float, batch_size: int) -> int:
+        slots = batch_size
+        if self.max_concurrency is not None:
+            slots = min(slots, self.max_concurrency - self.running)
+        if self.rate_limit is not None:
+            self._refill(now)
+            slots = min(slots, int(self.tokens))
+        return max(slots, 0)
+
+    def wait(self, now: float) -> Optional[float]:
+        # через сколько секунд освободится место по ограничению частоты,
+        # None - место освободится по завершении задачи
+        if self.rate_limit is None or self.tokens >= 1:
+            return None
+        self._refill(now)
+        return max((1 - self.tokens) / self.rate_limit, 0)
+
+    def acquire(self) -> None:
+        self.running += 1
+        if self.rate_limit is not None:
+            self.tokens -= 1
+
+    def release(self) -> None:
+        self.running -= 1
+
+
+@dataclass
+class RetryPolicy:
+    backoff: Optional[float] = None
+    max_delay: Optional[float] = None
+    jitter: Optional[float] = None
+
+    def delay(self, retry_delay: float, retries: int) -> float:
+        # retry_delay * backoff ^ retries, не больше max_delay,
+        # уменьшенная случайным образом не более чем на долю jitter
+        delay = retry_delay
+        if self.backoff is not None:
+            delay *= self.backoff**retries
+        if self.max_delay is not None:
+            delay = min(delay, self.max_delay)
+        if self.jitter:
+            delay *= 1 - self.jitter * random.random()  # nosec
+        return delay
+
+
+@dataclass
+class ScheduleItem:
+    func: TaskHandler
+    params: dict
+    reference: Optional[str] = None
+    eta: Optional[ETA] = None
+    max_retries: Optional[int] = None
+    retry_delay: Optional[float] = None
+    priority: Optional[int] = None
+    queue: Optional[str] = None
+
+
+@dataclass
+class TaskResult:
+    task: Task
+    started: float
+    finished: float
+    result: Any
+    error: Optional[Exception]
+    error_str: Optional[str]
+    traceback: Optional[str]
+    retry_delay: Optional[float] = None
+    log: bool = True
+
+
 class TaskManagerSpan(Span):
     NAME_SCHEDULE = 'dbtm::schedule'
+    NAME_SCHEDULE_MANY = 'dbtm::schedule_many'
     NAME_SCAN = 'dbtm::scan'
     NAME_EXEC = 'dbtm::exec'
+    NAME_QUEUE = 'dbtm::queue'
+
+    P8S_NAME_EXEC = 'task_exec'
+    P8S_NAME_QUEUE = 'task_queue'
 
     TAG_PARENT_TRACE_ID = 'dbtm.parent_trace_id'
     TAG_TASK_ID = 'dbtm.task_id'
     TAG_TASK_NAME = 'dbtm.task_name'
+    TAG_TASK_STATUS = 'dbtm.task_status'
+    TAG_TASKS_COUNT = 'dbtm.tasks_count'
+    TAG_QUEUE = 'dbtm.queue'
+    TAG_QUEUE_PENDING = 'dbtm.queue.pending'
+    TAG_QUEUE_DUE = 'dbtm.queue.due'
+    TAG_QUEUE_LAG = 'dbtm.queue.lag'
 
     ANN_ETA = 'eta'
     ANN_DELAY = 'delay'
@@ -205,12 +403,55 @@ class TaskManagerSpan(Span):
 
 
 class Retry(Exception):
-    def __init__(self, err: Exception) -> None:
+    def __init__(
+        self,
+        err: Exception,
+        *,
+        delay: Optional[float] = None,
+        backoff: Optional[float] = None,
+        max_delay: Optional[float] = None,
+        jitter: Optional[float] = None,
+    ) -> None:
+        super().__init__(err)
         self.err = err
+        # задержка перед повторной попыткой, если задана, заменяет
+        # вычисленную по политике задачи
+        self.delay = delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.jitter = jitter
 
     def __str__(self) -> str:
         return 'Retry: %r' % (str(self.err) or repr(self.err))
 
+    def __reduce__(self) -> Tuple[Any, ...]:
+        # исключение из задачи с executor='process' возвращается через
+        # pickle, параметры повтора передаются вместе с ним
+        return (
+            partial(
+                Retry,
+                delay=self.delay,
+                backoff=self.backoff,
+                max_delay=self.max_delay,
+                jitter=self.jitter,
+            ),
+            (self.err,),
+        )
+
+
+class TaskError(Exception):
+    def __init__(self, task_id: int, status: str, error: Optional[str]):
+        self.task_id = task_id
+        self.status = status
+        self.error = error
+
+    def __str__(self) -> str:
+        return 'Task %s finished with status %s: %s' % (
+            self.task_id,
+            self.status,
+            self.error,
+        )
+
 
 class TaskManagerConfig(BaseModel):
     db_url: Optional[str] = Field(
@@ -231,9 +472,51 @@ class TaskManagerConfig(BaseModel):
             "Задержка перед повторной попыткой подключения к базе данных"
         ),
     )
+    db_pool_min_size: int = Field(
+        1, description="Минимальное количество соединений в пуле"
+    )
+    db_pool_max_size: int = Field(
+        4, description="Максимальное количество соединений в пуле"
+    )
     batch_size: int = Field(
         1, description="Количество задач, которое берется в работу за раз"
     )
+    queues: Optional[List[str]] = Field(
+        None,
+        description="Очереди, задачи из которых берутся в работу. "
+        "Если не заданы, задачи берутся из всех очередей",
+        example=["default"],
+    )
+    shards: Optional[int] = Field(
+        None,
+        ge=1,
+        description="Количество секций (id % shards), между которыми "
+        "распределяются обработчики. Обработчик берет задачи из своей "
+        "секции и из остальных, только если в своей не хватило задач "
+        "на пачку",
+    )
+    shard: Optional[int] = Field(
+        None,
+        ge=0,
+        description="Номер секции обработчика от 0 до shards-1. "
+        "Если не задан, выбирается случайно",
+    )
+    max_concurrency: Optional[int] = Field(
+        None,
+        description="Максимальное количество одновременно выполняемых задач. "
+        "Если задано, новые задачи берутся в работу по мере освобождения "
+        "мест, не дожидаясь выполнения всей пачки",
+    )
+    thread_pool_size: Optional[int] = Field(
+        None,
+        description="Количество потоков для задач с executor='thread'. "
+        "Если не задано, используется пул цикла событий по умолчанию",
+    )
+    process_pool_size: Optional[int] = Field(
+        None,
+        description="Количество процессов для задач с executor='process'. "
+        "Если не задано, равно количеству процессоров",
+    )
     max_scan_interval: float = Field(
         60.0, description="Максимальный интервал для поиска новых задач"
     )
@@ -248,6 +531,94 @@ class TaskManagerConfig(BaseModel):
         description="При запуске будет попытка создать объекты базы данных, "
         "если они не существуют",
     )
+    batch_finalize: bool = Field(
+        False,
+        description="Сохранять результаты выполнения задач одним запросом "
+        "на всю пачку задач, взятых в работу за раз",
+    )
+    use_notify: bool = Field(
+        True,
+        description="Уведомлять обработчики о новых задачах через "
+        "LISTEN/NOTIFY, не дожидаясь очередного поиска задач",
+    )
+    notify_results: bool = Field(
+        False,
+        description="Уведомлять о завершении задач через LISTEN/NOTIFY, "
+        "чтобы result() в другом экземпляре получал результат сразу. "
+        "Без уведомлений результат проверяется раз в max_scan_interval. "
+        "Уведомление отправляется при завершении каждой задачи",
+    )
+    log_policy: str = Field(
+        LOG_ALWAYS,
+        description="Какие выполнения задач записываются в task_log: "
+        "always - все, errors_only - только завершенные с ошибкой, "
+        "sampled - все с ошибкой и доля успешных (log_sample_rate). "
+        "Результат успешной задачи без записи в task_log можно получить "
+        "через result() только в том же экземпляре, в другом result() "
+        "вызывает TaskError",
+        example=LOG_ERRORS_ONLY,
+    )
+    log_sample_rate: float = Field(
+        0.01,
+        ge=0,
+        le=1,
+        description="Доля успешных выполнений, записываемых в task_log "
+        "при log_policy=sampled",
+    )
+    lease_timeout: Optional[float] = Field(
+        None,
+        gt=0,
+        description="Время в секундах, через которое задача в статусе "
+        "progress без отметки от выполняющего ее обработчика считается "
+        "зависшей: она расходует попытку и возвращается в статус retry, "
+        "а без оставшихся попыток завершается с ошибкой. Отметка "
+        "обновляется каждую треть этого времени. Если не задано, "
+        "зависшие задачи не возвращаются",
+    )
+    metrics_interval: Optional[float] = Field(
+        None,
+        gt=0,
+        description="Интервал в секундах, с которым собираются метрики "
+        "очередей задач: количество ожидающих задач, количество задач, "
+        "время выполнения которых наступило, и задержка самой старой из "
+        "них. Если не задан, метрики очередей не собираются. Метрики "
+        "собирает один экземпляр из всех подключенных к базе данных",
+    )
+    metrics_count_limit: int = Field(
+        10000,
+        gt=0,
+        description="Предел подсчета ожидающих и наступивших задач в "
+        "очереди для метрик: большие значения не уточняются",
+    )
+    partitioning: bool = Field(
+        False,
+        description="Хранить task_arch и task_log в посуточных секциях "
+        "(дочерних таблицах), которые создаются заранее и удаляются "
+        "целиком по истечении срока хранения",
+    )
+    partition_premake: int = Field(
+        3,
+        ge=0,
+        description="На сколько суток вперед создавать секции",
+    )
+    partition_retention_days: Optional[int] = Field(
+        None,
+        ge=1,
+        description="Срок хранения секций в сутках. "
+        "Если не задан, секции не удаляются",
+    )
+    partition_maintenance_interval: float = Field(
+        3600.0, description="Интервал обслуживания секций в секундах"
+    )
+    depends_sweep_interval: Optional[float] = Field(
+        None,
+        gt=0,
+        description="Интервал в секундах, с которым отменяются ожидающие "
+        "задачи, родительские задачи которых завершились неуспешно или "
+        "удалены из архива. Если не задан, такие задачи не отменяются. "
+        "Достаточно задать в одном экземпляре",
+        example=60.0,
+    )
 
 
 class TaskManager(Component):
@@ -264,17 +635,55 @@ class TaskManager(Component):
                 stacklevel=2,
             )
 
-        self._executor: Executor = Executor(registry)
+        self._executor: Executor = Executor(
+            registry,
+            thread_pool_size=cfg.thread_pool_size,
+            process_pool_size=cfg.process_pool_size,
+        )
         self.cfg = cfg
         self._stopping = False
         self._scan_fut: Optional[asyncio.Future] = None
+        self._in_flight: Set[asyncio.Future] = set()
+        # id задач, взятых в работу этим обработчиком
+        self._running: Set[int] = set()
+        self._lease_fut: Optional[asyncio.Future] = None
+        self._metrics_fut: Optional[asyncio.Future] = None
+        self._sweep_fut: Optional[asyncio.Future] = None
+        # очереди, по которым уже отправлялись метрики
+        self._metrics_queues: Set[str] = set()
+        # ожидающие результата задачи, см. result()
+        self._waiters: Dict[int, List[asyncio.Future]] = {}
         self.stamp_early: float = 0.0
         self._lock: Optional[asyncio.Lock] = None
         self._db: Optional[Db] = None
         self._tick_fut: Optional[asyncio.Future] = None
         self._tick_lock: Optional[asyncio.Lock] = None
+        self._partition_fut: Optional[asyncio.Future] = None
         self._periodic_tasks: List[PeriodicTask] = []
         self._find_periodic_tasks(registry)
+        self._limits: Dict[str, TaskLimit] = {}
+        self._find_task_limits(registry)
+        self._retry_policies: Dict[str, RetryPolicy] = {}
+        self._find_retry_policies(registry)
+        _validate_log_policy(cfg.log_policy)
+        self._log_policies: Dict[str, str] = {
+            getattr(fn, '__rpc_name__'): getattr(fn, '__task_log_policy__')
+            for fn in Executor.iter_handler(registry)
+            if hasattr(fn, '__task_log_policy__')
+        }
+        # (количество секций, номер секции обработчика)
+        self._shard: Optional[Tuple[int, int]] = None
+        if cfg.shards is not None:
+            shard = cfg.shard
+            if shard is None:
+                shard = random.randrange(cfg.shards)  # nosec
+            if shard >= cfg.shards:
+                raise UserWarning(
+                    'Task manager shard must be less than shards'
+                )
+            self._shard = (cfg.shards, shard)
+        elif cfg.shard is not None:
+            raise UserWarning('Task manager shard requires shards')
         self._registry = registry
 
     def _check_deprecated_decorator(self) -> None:
@@ -299,6 +708,12 @@ class TaskManager(Component):
         self._db = Db(self, self.cfg)
         await self._db.init()
 
+        if self.cfg.partitioning:
+            await self._maintain_partitions()
+            self._partition_fut = asyncio.ensure_future(
+                self._partition_maintenance()
+            )
+
         self._tick_lock = asyncio.Lock()
         self._tick_fut = asyncio.ensure_future(self._tick())
 
@@ -306,6 +721,15 @@ class TaskManager(Component):
         if self.app is None:  # pragma: no cover
             raise UserWarning('Unattached component')
 
+        if self.cfg.lease_timeout is not None:
+            self._lease_fut = asyncio.ensure_future(self._lease())
+
+        if self.cfg.metrics_interval is not None:
+            self._metrics_fut = asyncio.ensure_future(self._metrics())
+
+        if self.cfg.depends_sweep_interval is not None:
+            self._sweep_fut = asyncio.ensure_future(self._sweep_dependents())
+
         if not self.cfg.idle:
             self._scan_fut = asyncio.ensure_future(self._scan())
 
@@ -320,16 +744,184 @@ class TaskManager(Component):
             self._tick_lock = None
             self._tick_fut = None
 
+        if self._partition_fut is not None:
+            self._partition_fut.cancel()
+            self._partition_fut = None
+
         if self._lock is None:
             return
         await self._lock.acquire()
         if self._scan_fut is not None:
             if not self._scan_fut.done():
                 await self._scan_fut
+        if len(self._in_flight) > 0:
+            await asyncio.wait(self._in_flight)
+
+        if self._lease_fut is not None:
+            self._lease_fut.cancel()
+            self._lease_fut = None
+
+        if self._metrics_fut is not None:
+            self._metrics_fut.cancel()
+            self._metrics_fut = None
+
+        if self._sweep_fut is not None:
+            self._sweep_fut.cancel()
+            self._sweep_fut = None
+
+        if self._db is not None:
+            await self._db.close()
+        self._executor.shutdown()
 
     async def health(self) -> None:
         if self._db is not None:
-            await self._db.health(lock=True)
+            await self._db.health()
+
+    async def _partition_maintenance(self) -> None:
+        while True:
+            await asyncio.sleep(self.cfg.partition_maintenance_interval)
+            try:
+                await self._maintain_partitions()
+            except Exception as err:
+                self.app.log_err(err)
+
+    async def _maintain_partitions(self) -> None:
+        if self._db is None:  # pragma: no cover
+            raise UserWarning
+        today = datetime.now(timezone.utc).date()
+        known: Set[Tuple[str, date]] = set()
+        async with self._db.transaction() as db:
+            await db.lock_partitions()
+            for table in PARTITIONED_TABLES:
+                days = set(await db.partition_list(table))
+                for i in range(self.cfg.partition_premake + 1):
+                    day = today + timedelta(days=i)
+                    if day not in days:
+                        await db.partition_create(table, day)
+                        days.add(day)
+                if self.cfg.partition_retention_days is not None:
+                    expired = today - timedelta(
+                        days=self.cfg.partition_retention_days
+                    )
+                    for day in sorted(days):
+                        if day < expired:
+                            await db.partition_drop(table, day)
+                            days.discard(day)
+                known.update((table, day) for day in days)
+        self._db.set_partitions(known)
+
+    async def _lease(self) -> None:
+        if self._db is None:  # pragma: no cover
+            raise UserWarning
+        if self.cfg.lease_timeout is None:  # pragma: no cover
+            raise UserWarning
+        while True:
+            await asyncio.sleep(self.cfg.lease_timeout / 3)
+            try:
+                if len(self._running) > 0:
+                    await self._db.task_heartbeat(list(self._running))
+                task_ids, failed = await self._db.task_reap(
+                    self.cfg.lease_timeout, self._reap_delay
+                )
+                if len(task_ids) > 0:
+                    self.app.log_warn(
+                        'Stuck tasks returned to retry: %s', task_ids
+                    )
+                    if not self.cfg.idle:
+                        self._scan_in(0)
+                if len(failed) > 0:
+                    self.app.log_warn(
+                        'Stuck tasks out of retries: %s',
+                        [task.id for task in failed],
+                    )
+                    for task in failed:
+                        await self._finalize(self._lease_expired(task))
+            except Exception as err:
+                self.app.log_err(err)
+
+    @staticmethod
+    def _lease_expired(task: Task) -> TaskResult:
+        # падение обработчика считается неудачной попыткой выполнения
+        now = time.time()
+        err = Exception('Lease expired')
+        return TaskResult(
+            task=task,
+            started=now,
+            finished=now,
+            result=None,
+            error=err,
+            error_str=str(err),
+            traceback=None,
+        )
+
+    def _reap_delay(self, task: Task) -> float:
+        # повтор откладывается так же, как после неудачной попытки
+        retries = 0 if task.retries is None else task.retries + 1
+        return self._retry_delay(self._lease_expired(task), retries)
+
+    async def _sweep_dependents(self) -> None:
+        if self.cfg.depends_sweep_interval is None:  # pragma: no cover
+            raise UserWarning
+        while True:
+            await asyncio.sleep(self.cfg.depends_sweep_interval)
+            try:
+                await self._cancel_orphans()
+            except Exception as err:
+                self.app.log_err(err)
+
+    async def _cancel_orphans(self) -> None:
+        # задачи, отмена которых не выполнилась после завершения
+        # родительской задачи, или родительская задача которых удалена
+        # вместе с секцией архива
+        if self._db is None:  # pragma: no cover
+            raise UserWarning
+        canceled = await self._db.task_cancel_orphans()
+        if len(canceled) == 0:
+            return
+        self.app.log_warn('Orphaned dependent tasks canceled: %s', canceled)
+        for task_id in canceled:
+            self._set_result(task_id, STATUS_CANCELED, None, None)
+
+    async def _metrics(self) -> None:
+        if self.cfg.metrics_interval is None:  # pragma: no cover
+            raise UserWarning
+        while True:
+            try:
+                await self._sample_queues()
+            except Exception as err:
+                self.app.log_err(err)
+            await asyncio.sleep(self.cfg.metrics_interval)
+
+    async def _sample_queues(self) -> None:
+        if self._db is None:  # pragma: no cover
+            raise UserWarning
+        # по опустевшим очередям отправляются нули
+        if not await self._db.lock_metrics():
+            return
+        stats = {
+            queue: (0, 0, 0.0)
+            for queue in self._metrics_queues | set(self.cfg.queues or [])
+        }
+        stats.update(
+            await self._db.task_queue_stats(self.cfg.metrics_count_limit)
+        )
+        self._metrics_queues.update(stats.keys())
+
+        for queue, (pending, due, lag) in stats.items():
+            with wrap2span(
+                name=TaskManagerSpan.NAME_QUEUE,
+                cls=TaskManagerSpan,
+                ignore_ctx=True,
+                app=self.app,
+            ) as span:
+                span.set_name4adapter(
+                    self.app.logger.ADAPTER_PROMETHEUS,
+                    TaskManagerSpan.P8S_NAME_QUEUE,
+                )
+                span.tag(TaskManagerSpan.TAG_QUEUE, queue)
+                span.tag(TaskManagerSpan.TAG_QUEUE_PENDING, pending)
+                span.tag(TaskManagerSpan.TAG_QUEUE_DUE, due)
+                span.tag(TaskManagerSpan.TAG_QUEUE_LAG, lag)
 
     def _find_periodic_tasks(
         self, registry: Union['TaskRegistry', object]
@@ -350,25 +942,63 @@ class TaskManager(Component):
 
             self._periodic_tasks.append(task)
 
+    def _find_task_limits(
+        self, registry: Union['TaskRegistry', object]
+    ) -> None:
+        self._limits = {}
+        for fn in Executor.iter_handler(registry):
+            max_concurrency = getattr(fn, '__task_max_concurrency__', None)
+            rate_limit = getattr(fn, '__task_rate_limit__', None)
+            if max_concurrency is None and rate_limit is None:
+                continue
+            limit = TaskLimit(max_concurrency, rate_limit)
+            if rate_limit is not None:
+                limit.tokens = max(rate_limit, 1.0)
+                limit.stamp = time.monotonic()
+            self._limits[getattr(fn, '__rpc_name__')] = limit
+
+    def _find_retry_policies(
+        self, registry: Union['TaskRegistry', object]
+    ) -> None:
+        self._retry_policies = {}
+        for fn in Executor.iter_handler(registry):
+            policy = RetryPolicy(
+                backoff=getattr(fn, '__task_retry_backoff__', None),
+                max_delay=getattr(fn, '__task_retry_max_delay__', None),
+                jitter=getattr(fn, '__task_retry_jitter__', None),
+            )
+            if policy != RetryPolicy():
+                self._retry_policies[getattr(fn, '__rpc_name__')] = policy
+
     async def _tick(self) -> None:
         if not self._tick_lock:  # pragma: no cover
             raise UserWarning
         if self._db is None:  # pragma: no cover
             raise UserWarning
         tz = pytz.timezone(self.cfg.timezone)
+        # куча (время следующего запуска, номер задачи, задача)
+        heap: List[Tuple[datetime, int, PeriodicTask]] = []
         boot = True
         while True:
             next_sleep: Optional[float] = None
-            to_exec: List[Tuple[Callable, datetime, Optional[str]]] = []
+            task_delay: Optional[float] = None
             async with self._tick_lock:
+                to_exec: List[Tuple[Callable, datetime, Optional[str]]] = []
+                due: List[Tuple[datetime, int, PeriodicTask]] = []
+                scheduled: List[Tuple[datetime, int, PeriodicTask]] = []
+                if boot:
+                    due = [
+                        (datetime.min, i, task)
+                        for i, task in enumerate(self._periodic_tasks)
+                    ]
                 try:
-                    async with self._db.transaction():
-                        await self._db.lock_tick_table()
-                        now, last = await self._db.get_last_tick_stamp(
+                    async with self._db.transaction() as db:
+                        await db.lock_tick_table()
+                        now, last = await db.get_last_tick_stamp(
                             self.cfg.timezone
                         )
                         if last is None:
-                            now, last = await self._db.create_last_tick_stamp(
+                            now, last = await db.create_last_tick_stamp(
                                 self.cfg.timezone
                             )
                         if now is None:  # pragma: no cover
@@ -377,48 +1007,74 @@ class TaskManager(Component):
                         now = tz.localize(now)
                         last = tz.localize(last)
 
-                        # now = now + timedelta(microseconds=1)
-                        for task in self._periodic_tasks:
-                            if boot and not task.strict:
-                                next_dt = now + timedelta(
-                                    seconds=task.crontab.next(now)
-                                )
-                            else:
-                                next_dt = last + timedelta(
-                                    seconds=task.crontab.next(last)
-                                )
-                            # TODO pass next_dt to tasks as arg
-                            while next_dt <= now:
-                                to_exec.append(
-                                    (task.fn, next_dt, task.date_attr)
-                                )
-                                if not task.strict:
-                                    next_dt = now + timedelta(
-                                        seconds=task.crontab.next(now)
-                                    )
-                                    break
-                                next_dt += timedelta(
-                                    seconds=task.crontab.next(next_dt)
-                                )
+                        # пересчитываются только задачи, время запуска
+                        # которых наступило
+                        while len(heap) > 0 and heap[0][0] <= now:
+                            due.append(heapq.heappop(heap))
 
-                            next_secs = (next_dt - now).total_seconds()
-                            if next_sleep is None or next_sleep > next_secs:
-                                if next_secs > 0:
-                                    next_sleep = next_secs
+                        for _, i, task in due:
+                            next_dt = self._tick_task(
+                                task, boot, now, last, to_exec
+                            )
+                            scheduled.append((next_dt, i, task))
+
+                        if len(to_exec) > 0:
+                            # все наступившие запуски планируются одним
+                            # запросом в транзакции отметки времени
+                            items = [
+                                ScheduleItem(
+                                    fn, {attr: dt} if attr is not None else {}
+                                )
+                                for fn, dt, attr in to_exec
+                            ]
+                            _, task_delay = await db.task_add_many(
+                                [self._schedule_row(item) for item in items]
+                            )
 
-                        await self._db.update_last_tick_stamp(now)
+                        await db.update_last_tick_stamp(now)
                 except Exception as err:
                     self.app.log_err(err)
-                    to_exec = []
-
-            for fn, date_attr_val, date_attr_name in to_exec:
-                params = {}
-                if date_attr_name is not None:
-                    params = {date_attr_name: date_attr_val}
-                await self.schedule(fn, params)
-
+                    if not boot:
+                        # вернуть задачи в кучу для повторной попытки
+                        for item in due:
+                            heapq.heappush(heap, item)
+                else:
+                    boot = False
+                    for item in scheduled:
+                        heapq.heappush(heap, item)
+                    if len(heap) > 0:
+                        next_sleep = max((heap[0][0] - now).total_seconds(), 0)
+
+            if task_delay is not None and not self.cfg.idle:
+                self._scan_in(task_delay)
+
+            if not boot and len(heap) == 0:
+                # периодических задач нет
+                return
             await asyncio.sleep(next_sleep if next_sleep is not None else 1)
-            boot = False
+
+    @staticmethod
+    def _tick_task(
+        task: PeriodicTask,
+        boot: bool,
+        now: datetime,
+        last: datetime,
+        to_exec: List[Tuple[Callable, datetime, Optional[str]]],
+    ) -> datetime:
+        # добавляет в to_exec наступившие запуски задачи и возвращает
+        # время следующего запуска
+        if boot and not task.strict:
+            next_dt = now + timedelta(seconds=task.crontab.next(now))
+        else:
+            next_dt = last + timedelta(seconds=task.crontab.next(last))
+        # TODO pass next_dt to tasks as arg
+        while next_dt <= now:
+            to_exec.append((task.fn, next_dt, task.date_attr))
+            if not task.strict:
+                next_dt = now + timedelta(seconds=task.crontab.next(now))
+                break
+            next_dt += timedelta(seconds=task.crontab.next(next_dt))
+        return next_dt
 
     async def schedule(
         self,
@@ -429,6 +1085,10 @@ class TaskManager(Component):
         max_retries: Optional[int] = None,
         retry_delay: Optional[float] = None,
         propagate_trace: bool = False,
+        priority: Optional[int] = None,
+        queue: Optional[str] = None,
+        dedupe: bool = False,
+        depends_on: Optional[List[int]] = None,
     ) -> int:
         with wrap2span(
             name=TaskManagerSpan.NAME_SCHEDULE,
@@ -439,27 +1099,29 @@ class TaskManager(Component):
             if self._db is None:  # pragma: no cover
                 raise UserWarning
 
-            if not isinstance(func, str):
-                if not hasattr(func, '__rpc_name__'):  # pragma: no cover
-                    raise UserWarning('Invalid task handler')
-                func_name = getattr(func, '__rpc_name__')
-            else:
-                func_name = func
+            func_name = self._task_name(func)
+
+            if dedupe and reference is None:
+                raise UserWarning('Deduplicated task requires reference')
+            if dedupe and depends_on:
+                # при дубликате была бы возвращена уже запланированная
+                # задача с другими родительскими задачами
+                raise UserWarning(
+                    'Deduplicated task can not depend on other tasks'
+                )
 
             if max_retries is None:
                 max_retries = getattr(func, '__task_max_retries__', 0)
             if retry_delay is None:
                 retry_delay = getattr(func, '__task_retry_delay__', 60.0)
+            if priority is None:
+                priority = getattr(func, '__task_priority__', 0)
+            if queue is None:
+                queue = getattr(func, '__task_queue__', QUEUE_DEFAULT)
 
             span.name = '%s::%s' % (TaskManagerSpan.NAME_SCHEDULE, func_name)
 
-            eta_dt: Optional[datetime] = None
-            if isinstance(eta, int) or isinstance(eta, float):
-                eta_dt = datetime.fromtimestamp(eta, tz=timezone.utc)
-            elif isinstance(eta, datetime):
-                eta_dt = eta
-            elif eta is not None:  # pragma: no cover
-                raise UserWarning
+            eta_dt = self._eta2dt(eta)
 
             if eta_dt is not None:
                 span.annotate(
@@ -472,39 +1134,215 @@ class TaskManager(Component):
                 reference,
                 max_retries,
                 retry_delay,
+                priority,
+                queue,
             ]
             if propagate_trace:
                 add_params.append(span.trace_id)
                 add_params.append(span.id)
-            task_id, task_delay = await self._db.task_add(
-                *add_params,
-                lock=True,
-            )
+            if depends_on:
+                # родительские задачи в task_pending блокируются до
+                # фиксации вставки: они не завершатся между проверкой и
+                # вставкой, и отмена зависимых задач увидит новую задачу
+                async with self._db.transaction() as db:
+                    await db.task_lock_parents(depends_on)
+                    await self._check_parents(db, depends_on)
+                    task_id, task_delay = await db.task_add(
+                        *add_params, dedupe=dedupe, depends_on=depends_on
+                    )
+            else:
+                task_id, task_delay = await self._db.task_add(
+                    *add_params, dedupe=dedupe
+                )
 
             span.annotate(TaskManagerSpan.ANN_DELAY, 'Delay: %s' % task_delay)
 
-            eta_float = self.loop.time() + task_delay
-            self.stamp_early = eta_float
-            self.loop.call_at(eta_float, self._scan_later, eta_float)
+            self._scan_in(task_delay)
 
             return task_id
 
+    @staticmethod
+    async def _check_parents(db: 'Db', depends_on: List[int]) -> None:
+        parents = await db.task_status_many(depends_on)
+        unknown = set(depends_on) - set(parents.keys())
+        if unknown:
+            raise UserWarning('Unknown parent tasks: %s' % sorted(unknown))
+        for parent_id, status in parents.items():
+            if status in (STATUS_ERROR, STATUS_CANCELED):
+                raise TaskError(parent_id, status, None)
+
+    async def schedule_many(
+        self,
+        items: Iterable[ScheduleItem],
+        propagate_trace: bool = False,
+    ) -> List[int]:
+        with wrap2span(
+            name=TaskManagerSpan.NAME_SCHEDULE_MANY,
+            kind=Span.KIND_CLIENT,
+            cls=TaskManagerSpan,
+            app=self.app,
+        ) as span:
+            if self._db is None:  # pragma: no cover
+                raise UserWarning
+
+            rows = [self._schedule_row(item) for item in items]
+
+            span.tag(TaskManagerSpan.TAG_TASKS_COUNT, len(rows))
+            if len(rows) == 0:
+                span.skip()
+                return []
+
+            if propagate_trace:
+                task_ids, task_delay = await self._db.task_add_many(
+                    rows, span.trace_id, span.id
+                )
+            else:
+                task_ids, task_delay = await self._db.task_add_many(rows)
+
+            span.annotate(TaskManagerSpan.ANN_DELAY, 'Delay: %s' % task_delay)
+
+            self._scan_in(task_delay)
+
+            return task_ids
+
+    @classmethod
+    def _schedule_row(cls, item: ScheduleItem) -> Tuple[Any, ...]:
+        # строка для Db.task_add_many
+        max_retries = item.max_retries
+        if max_retries is None:
+            max_retries = getattr(item.func, '__task_max_retries__', 0)
+        retry_delay = item.retry_delay
+        if retry_delay is None:
+            retry_delay = getattr(item.func, '__task_retry_delay__', 60.0)
+        priority = item.priority
+        if priority is None:
+            priority = getattr(item.func, '__task_priority__', 0)
+        queue = item.queue
+        if queue is None:
+            queue = getattr(item.func, '__task_queue__', QUEUE_DEFAULT)
+        return (
+            cls._eta2dt(item.eta),
+            cls._task_name(item.func),
+            item.params,
+            item.reference,
+            max_retries,
+            retry_delay,
+            priority,
+            queue,
+        )
+
+    @staticmethod
+    def _task_name(func: TaskHandler) -> str:
+        if isinstance(func, str):
+            return func
+        if not hasattr(func, '__rpc_name__'):  # pragma: no cover
+            raise UserWarning('Invalid task handler')
+        return getattr(func, '__rpc_name__')
+
+    @staticmethod
+    def _eta2dt(eta: Optional[ETA]) -> Optional[datetime]:
+        if isinstance(eta, int) or isinstance(eta, float):
+            return datetime.fromtimestamp(eta, tz=timezone.utc)
+        elif isinstance(eta, datetime):
+            return eta
+        elif eta is not None:  # pragma: no cover
+            raise UserWarning
+        return None
+
     async def cancel(self, task_id: int) -> bool:
         if self._db is None or self._lock is None:  # pragma: no cover
             raise UserWarning
         async with self._lock:
-            async with self._db.transaction():
-                task = await self._db.task_search4cancel(task_id, lock=False)
+            async with self._db.transaction() as db:
+                task = await db.task_search4cancel(task_id)
                 if task is not None:
-                    await self._db.task_move_arch(
+                    await db.task_move_arch(
                         task_id,
                         STATUS_CANCELED,
                         None,
-                        lock=False,
                         with_trace_id=task.trace_id is not None,
                     )
-                    return True
-                return False
+                    canceled = await db.task_cancel_dependents([task_id])
+                else:
+                    return False
+            for canceled_id in [task_id] + canceled:
+                self._set_result(canceled_id, STATUS_CANCELED, None, None)
+            return True
+
+    async def result(
+        self, task_id: int, timeout: Optional[float] = None
+    ) -> Any:
+        if self._db is None:  # pragma: no cover
+            raise UserWarning
+        fut = self.loop.create_future()
+        self._waiters.setdefault(task_id, []).append(fut)
+        try:
+            status, res, error = await asyncio.wait_for(
+                self._wait_result(task_id, fut), timeout
+            )
+        finally:
+            waiters = self._waiters.get(task_id)
+            if waiters is not None and fut in waiters:
+                waiters.remove(fut)
+                if len(waiters) == 0:
+                    del self._waiters[task_id]
+        # успешная задача с ошибкой - результат не записан в task_log
+        if status != STATUS_SUCCESSFUL or error is not None:
+            raise TaskError(task_id, status, error)
+        return res
+
+    async def _wait_result(
+        self, task_id: int, fut: asyncio.Future
+    ) -> Tuple[str, Any, Optional[str]]:
+        if self._db is None:  # pragma: no cover
+            raise UserWarning
+        if self.cfg.notify_results:
+            await self._db.listen(
+                self._db.result_channel, self._result_notification
+            )
+        while True:
+            # задача могла завершиться до подписки на уведомления
+            res = await self._db.task_result(task_id)
+            if res is not None:
+                return res
+            try:
+                return await asyncio.wait_for(
+                    asyncio.shield(fut), self.cfg.max_scan_interval
+                )
+            except asyncio.TimeoutError:
+                continue
+
+    def _result_notification(
+        self,
+        connection: asyncpg.Connection,
+        pid: int,
+        channel: str,
+        payload: str,
+    ) -> None:
+        try:
+            task_id = int(payload)
+        except ValueError:
+            return
+        if task_id in self._waiters:
+            asyncio.ensure_future(self._fetch_result(task_id))
+
+    async def _fetch_result(self, task_id: int) -> None:
+        if self._db is None:  # pragma: no cover
+            raise UserWarning
+        try:
+            res = await self._db.task_result(task_id)
+        except Exception as err:
+            self.app.log_err(err)
+            return
+        if res is not None:
+            self._set_result(task_id, *res)
+
+    def _set_result(
+        self, task_id: int, status: str, res: Any, error: Optional[str]
+    ) -> None:
+        for fut in self._waiters.pop(task_id, []):
+            if not fut.done():
+                fut.set_result((status, res, error))
 
     async def _scan(self) -> List[int]:
         if self.app is None or self._lock is None:  # pragma: no cover
@@ -513,6 +1351,8 @@ class TaskManager(Component):
             return []
         async with self._lock:
             delay = 1.0  # default: 1 second
+            if self.cfg.use_notify:
+                await self._listen()
             try:
                 with wrap2span(
                     name=TaskManagerSpan.NAME_SCAN,
@@ -540,9 +1380,39 @@ class TaskManager(Component):
             finally:
                 if not self._stopping:
                     self._scan_fut = None
-                    eta = self.loop.time() + delay
-                    self.stamp_early = eta
-                    self.loop.call_at(eta, self._scan_later, eta)
+                    self._scan_in(delay)
+
+    def _scan_in(self, delay: float) -> None:
+        now = self.loop.time()
+        eta = now + delay
+        if now < self.stamp_early <= eta:
+            # более ранний поиск задач уже запланирован
+            return
+        self.stamp_early = eta
+        self.loop.call_at(eta, self._scan_later, eta)
+
+    async def _listen(self) -> None:
+        if self._db is None:  # pragma: no cover
+            raise UserWarning
+        try:
+            await self._db.listen(self._db.channel, self._notification)
+        except Exception as err:
+            self.app.log_err(err)
+
+    def _notification(
+        self,
+        connection: asyncpg.Connection,
+        pid: int,
+        channel: str,
+        payload: str,
+    ) -> None:
+        if self._stopping or self.cfg.idle:
+            return
+        try:
+            delay = float(payload)
+        except ValueError:
+            delay = 0.0
+        self._scan_in(delay)
 
     def _scan_later(self, when: float) -> None:
         if self._db is None:  # pragma: no cover
@@ -559,12 +1429,32 @@ class TaskManager(Component):
     async def _search_and_exec(self) -> Tuple[List[Task], float]:
         if self._db is None:  # pragma: no cover
             raise UserWarning
-        async with self._db.transaction():
+        batch_size = self.cfg.batch_size
+        if self.cfg.max_concurrency is not None:
+            batch_size = min(
+                batch_size, self.cfg.max_concurrency - len(self._in_flight)
+            )
+            if batch_size <= 0:
+                # поиск будет запущен по завершении одной из задач
+                return [], self.cfg.max_scan_interval
 
-            tasks = await self._db.task_search(self.cfg.batch_size, lock=False)
+        limits, blocked, limit_delay = self._limit_slots(batch_size)
+
+        async with self._db.transaction() as db:
+
+            tasks = await db.task_search(batch_size, limits, self._shard)
+            if self._shard is not None and len(tasks) < batch_size:
+                # в своей секции не хватило задач, забираем из остальных
+                tasks += await db.task_search(
+                    batch_size - len(tasks), self._slots_left(limits, tasks)
+                )
             span.annotate(TaskManagerSpan.ANN_TASKS, repr(tasks))
             if len(tasks) == 0:
-                next_delay = await self._db.task_next_delay(lock=False)
+                next_delay = await db.task_next_delay(blocked)
+                if limit_delay is not None and (
+                    next_delay is None or next_delay > limit_delay
+                ):
+                    next_delay = limit_delay
                 if (
                     next_delay is None
                     or next_delay >= self.cfg.max_scan_interval
@@ -574,12 +1464,92 @@ class TaskManager(Component):
                     return tasks, 0
                 return tasks, next_delay
 
-        coros = [self._exec(span.trace_id, task) for task in tasks]
-        await asyncio.gather(*coros)
+        for task in tasks:
+            self._running.add(task.id)
+            if task.name in self._limits:
+                self._limits[task.name].acquire()
+
+        if self.cfg.max_concurrency is not None:
+            for task in tasks:
+                fut = asyncio.ensure_future(
+                    self._exec_in_flight(span.trace_id, task)
+                )
+                self._in_flight.add(fut)
+                fut.add_done_callback(self._exec_done)
+            return tasks, 0
+
+        try:
+            coros = [self._exec(span.trace_id, task) for task in tasks]
+            results = await asyncio.gather(*coros)
+
+            if self.cfg.batch_finalize:
+                await self._finalize_many(
+                    [res for res in results if res is not None]
+                )
+        finally:
+            for task in tasks:
+                self._task_done(task)
 
         return tasks, 0
 
-    async def _exec(self, parent_trace_id: str, task: Task) -> None:
+    def _limit_slots(
+        self, batch_size: int
+    ) -> Tuple[Optional[Dict[str, int]], List[str], Optional[float]]:
+        # сколько задач с ограничениями можно взять в работу, какие
+        # задачи брать нельзя и когда по ним освободится место
+        if len(self._limits) == 0:
+            return None, [], None
+        now = time.monotonic()
+        slots: Dict[str, int] = {}
+        blocked: List[str] = []
+        delay: Optional[float] = None
+        for name, limit in self._limits.items():
+            slots[name] = limit.slots(now, batch_size)
+            if slots[name] > 0:
+                continue
+            blocked.append(name)
+            wait = limit.wait(now)
+            if wait is not None and (delay is None or wait < delay):
+                delay = wait
+        return slots, blocked, delay
+
+    @staticmethod
+    def _slots_left(
+        limits: Optional[Dict[str, int]], tasks: List[Task]
+    ) -> Optional[Dict[str, int]]:
+        if limits is None:
+            return None
+        slots = dict(limits)
+        for task in tasks:
+            if task.name in slots:
+                slots[task.name] -= 1
+        return slots
+
+    def _task_done(self, task: Task) -> None:
+        self._running.discard(task.id)
+        if task.name in self._limits:
+            self._limits[task.name].release()
+
+    async def _exec_in_flight(self, parent_trace_id: str, task: Task) -> None:
+        try:
+            result = await self._exec(parent_trace_id, task)
+            if result is not None:
+                try:
+                    await self._finalize(result)
+                except Exception as err:
+                    self.app.log_err(err)
+        finally:
+            self._task_done(task)
+
+    def _exec_done(self, fut: asyncio.Future) -> None:
+        self._in_flight.discard(fut)
+        if not fut.cancelled():
+            fut.exception()  # ошибка уже залогирована в _exec
+        self._scan_in(0)
+
+    async def _exec(
+        self, parent_trace_id: str, task: Task
+    ) -> Optional[TaskResult]:
         with wrap2span(
             name=TaskManagerSpan.NAME_EXEC,
             kind=Span.KIND_SERVER,
@@ -595,6 +1565,10 @@ class TaskManager(Component):
                 raise UserWarning
 
             span.name = '%s::%s' % (TaskManagerSpan.NAME_EXEC, task.name)
+            span.set_name4adapter(
+                self.app.logger.ADAPTER_PROMETHEUS,
+                TaskManagerSpan.P8S_NAME_EXEC,
+            )
             span.tag(TaskManagerSpan.TAG_PARENT_TRACE_ID, parent_trace_id)
             span.tag(TaskManagerSpan.TAG_TASK_ID, task.id)
             span.tag(TaskManagerSpan.TAG_TASK_NAME, task.name)
@@ -619,103 +1593,367 @@ class TaskManager(Component):
                     self.app.log_err(err)
                 time_finish = time.time()
 
-                await self._db.task_log_add(
-                    task.id,
-                    task.eta,
-                    time_begin,
-                    time_finish,
-                    res,
-                    err_str,
-                    err_trace,
-                    lock=True,
+                result = TaskResult(
+                    task=task,
+                    started=time_begin,
+                    finished=time_finish,
+                    result=res,
+                    error=err,
+                    error_str=err_str,
+                    traceback=err_trace,
                 )
-
-                if task.retries is None:
-                    retries = 0
-                else:
-                    retries = task.retries + 1
-
-                if err is not None:
-                    if isinstance(err, Retry):
-                        if retries >= task.max_retries:
-                            await self._db.task_move_arch(
-                                task.id,
-                                STATUS_ERROR,
-                                retries,
-                                lock=True,
-                                with_trace_id=task.trace_id is not None,
-                            )
-                        else:
-                            await self._db.task_retry(
-                                task.id,
-                                retries,
-                                task.retry_delay.total_seconds(),
-                                lock=True,
-                            )
-                    else:
-                        await self._db.task_move_arch(
-                            task.id,
-                            STATUS_ERROR,
-                            retries,
-                            lock=True,
-                            with_trace_id=task.trace_id is not None,
-                        )
-                else:
-                    await self._db.task_move_arch(
-                        task.id,
-                        STATUS_SUCCESSFUL,
-                        retries,
-                        lock=True,
-                        with_trace_id=task.trace_id is not None,
-                    )
+                status, retries = self._result_status(result)
+                span.tag(TaskManagerSpan.TAG_TASK_STATUS, status)
+                if status == STATUS_RETRY:
+                    result.retry_delay = self._retry_delay(result, retries)
+                result.log = self._need_log(task.name, status)
+                if self.cfg.batch_finalize:
+                    return result
+
+                await self._finalize(result)
+                return None
             except Exception as err:
                 span.error(err)
                 self.app.log_err(err)
                 raise
 
+    @staticmethod
+    def _result_status(result: TaskResult) -> Tuple[str, int]:
+        task = result.task
+        if task.retries is None:
+            retries = 0
+        else:
+            retries = task.retries + 1
+
+        if result.error is None:
+            return STATUS_SUCCESSFUL, retries
+        if isinstance(result.error, Retry) and retries < task.max_retries:
+            return STATUS_RETRY, retries
+        return STATUS_ERROR, retries
+
+    def _retry_delay(self, result: TaskResult, retries: int) -> float:
+        task = result.task
+        err = result.error
+        policy = self._retry_policies.get(task.name, RetryPolicy())
+        if isinstance(err, Retry):
+            if err.delay is not None:
+                return err.delay
+            policy = RetryPolicy(
+                backoff=(
+                    err.backoff if err.backoff is not None else policy.backoff
+                ),
+                max_delay=(
+                    err.max_delay
+                    if err.max_delay is not None
+                    else policy.max_delay
+                ),
+                jitter=err.jitter if err.jitter is not None else policy.jitter,
+            )
+        return policy.delay(task.retry_delay.total_seconds(), retries)
+
+    def _need_log(self, task_name: str, status: str) -> bool:
+        if status != STATUS_SUCCESSFUL:
+            return True
+        policy = self._log_policies.get(task_name, self.cfg.log_policy)
+        if policy == LOG_ERRORS_ONLY:
+            return False
+        if policy == LOG_SAMPLED:
+            return random.random() < self.cfg.log_sample_rate  # nosec
+        return True
+
+    @staticmethod
+    def _result_retry_delay(result: TaskResult) -> float:
+        if result.retry_delay is not None:
+            return result.retry_delay
+        return result.task.retry_delay.total_seconds()
+
+    async def _finalize(self, result: TaskResult) -> None:
+        if self._db is None:  # pragma: no cover
+            raise UserWarning
+        task = result.task
+
+        if result.log:
+            await self._db.task_log_add(
+                task.id,
+                task.eta,
+                result.started,
+                result.finished,
+                result.result,
+                result.error_str,
+                result.traceback,
+            )
+
+        status, retries = self._result_status(result)
+        if status == STATUS_RETRY:
+            await self._db.task_retry(
+                task.id,
+                retries,
+                self._result_retry_delay(result),
+            )
+        else:
+            await self._db.task_move_arch(
+                task.id,
+                status,
+                retries,
+                with_trace_id=task.trace_id is not None,
+            )
+            self._set_result(task.id, status, result.result, result.error_str)
+            if status != STATUS_SUCCESSFUL:
+                await self._cancel_dependents([task.id])
+
+    async def _finalize_many(self, results: List[TaskResult]) -> None:
+        if self._db is None:  # pragma: no cover
+            raise UserWarning
+        if len(results) == 0:
+            return
+
+        logs: List[Tuple[Any, ...]] = []
+        archive: List[Tuple[int, str, int]] = []
+        retry: List[Tuple[Task, int, float]] = []
+        finished: List[Tuple[int, str, Any, Optional[str]]] = []
+        for result in results:
+            task = result.task
+            if result.log:
+                logs.append(
+                    (
+                        task.id,
+                        task.eta,
+                        result.started,
+                        result.finished,
+                        result.result,
+                        result.error_str,
+                        result.traceback,
+                    )
+                )
+            status, retries = self._result_status(result)
+            if status == STATUS_RETRY:
+                retry.append((task, retries, self._result_retry_delay(result)))
+            else:
+                archive.append((task.id, status, retries))
+                finished.append(
+                    (task.id, status, result.result, result.error_str)
+                )
+
+        try:
+            await self._db.task_finalize_many(
+                logs,
+                archive,
+                with_trace_id=any(
+                    result.task.trace_id is not None for result in results
+                ),
+            )
+        except Exception as err:
+            # пакетная запись не выполнена целиком, пишем по одной задаче
+            self.app.log_err(err)
+            for result in results:
+                try:
+                    await self._finalize(result)
+                except Exception as e:
+                    self.app.log_err(e)
+            return
+
+        for task_id, status, res, error in finished:
+            self._set_result(task_id, status, res, error)
+
+        failed = [
+            task_id
+            for task_id, status, _, _ in finished
+            if status != STATUS_SUCCESSFUL
+        ]
+        if len(failed) > 0:
+            try:
+                await self._cancel_dependents(failed)
+            except Exception as e:
+                self.app.log_err(e)
+
+        for task, retries, delay in retry:
+            try:
+                await self._db.task_retry(task.id, retries, delay)
+            except Exception as e:
+                self.app.log_err(e)
+
+    async def _cancel_dependents(self, task_ids: List[int]) -> None:
+        # зависимые задачи не выполнятся, если родительская завершилась
+        # с ошибкой или была отменена
+        if self._db is None:  # pragma: no cover
+            raise UserWarning
+        for task_id in await self._db.task_cancel_dependents(task_ids):
+            self._set_result(task_id, STATUS_CANCELED, None, None)
+
 
 class Db:
     def __init__(self, tm: TaskManager, cfg: TaskManagerConfig) -> None:
-        self._lock = asyncio.Lock()
         self._tm = tm
         self._cfg = cfg
+        self._pool: Optional[asyncpg.pool.Pool] = None
+        # соединение текущей транзакции, см. transaction()
         self._conn: Optional[asyncpg.Connection] = None
+        self._listen_conn: Optional[asyncpg.Connection] = None
+        self._listen_lock = asyncio.Lock()
+        # соединение с блокировкой сбора метрик очередей
+        self._metrics_conn: Optional[asyncpg.Connection] = None
+        # каналы и обработчики уведомлений, а также каналы, на которые
+        # подписано текущее соединение
+        self._listeners: Dict[str, Callable] = {}
+        self._listening: Set[str] = set()
+        # существующие секции (таблица, день), общие для копий из transaction()
+        self._partitions: Set[Tuple[str, date]] = set()
 
     async def init(self) -> None:
-        try:
-            await self.get_conn(can_reconnect=True)
-        except Exception as err:
-            raise PrepareError(str(err))
-
-    @property
-    def _masked_url(self) -> Optional[str]:
-        if self._cfg.db_url is not None:
-            return mask_url_pwd(self._cfg.db_url)
-        return None
-
-    async def get_conn(self, can_reconnect: bool) -> asyncpg.Connection:
-        if self._conn is not None and not self._conn.is_closed():
-            return self._conn
-        if not can_reconnect:
-            raise Exception('Not connected to %s' % self._masked_url)
         for _ in range(self._cfg.db_connect_max_attempts):
             try:
                 self._tm.app.logger.app.log_info(
                     "Connecting to %s", self._masked_url
                 )
-                self._conn = await asyncpg.connect(self._cfg.db_url)
+                self._pool = await asyncpg.create_pool(
+                    dsn=self._cfg.db_url,
+                    min_size=self._cfg.db_pool_min_size,
+                    max_size=self._cfg.db_pool_max_size,
+                    init=Postgres._conn_init,
+                )
 
                 await self._check_or_create_database_objects()
 
-                await Postgres._conn_init(self._conn)  # noqa
                 self._tm.app.logger.app.log_info(
                     "Connected to %s", self._masked_url
                 )
-                return self._conn
+                return
+            except PrepareError:
+                # повторное подключение не исправит схему базы данных
+                await self.close()
+                raise
             except Exception as err:
                 self._tm.app.logger.app.log_err(err)
+                await self.close()
                 await asyncio.sleep(self._cfg.db_connect_retry_delay)
-        raise Exception("Could not connect to %s" % self._masked_url)
+        raise PrepareError("Could not connect to %s" % self._masked_url)
+
+    async def close(self) -> None:
+        await self.unlisten()
+        if self._metrics_conn is not None:
+            conn, self._metrics_conn = self._metrics_conn, None
+            if not conn.is_closed():
+                await conn.close()
+        if self._pool is None:
+            return
+        pool, self._pool = self._pool, None
+        await pool.close()
+
+    @property
+    def _masked_url(self) -> Optional[str]:
+        if self._cfg.db_url is not None:
+            return mask_url_pwd(self._cfg.db_url)
+        return None
+
+    @property
+    def channel(self) -> str:
+        return '%s_task' % self._cfg.db_schema
+
+    @property
+    def result_channel(self) -> str:
+        return '%s_task_result' % self._cfg.db_schema
+
+    async def listen(self, channel: str, callback: Callable) -> None:
+        self._listeners[channel] = callback
+        async with self._listen_lock:
+            conn = self._listen_conn
+            if conn is None or conn.is_closed():
+                conn = await asyncpg.connect(self._cfg.db_url)
+                self._listen_conn = conn
+                self._listening = set()
+            for name, cb in self._listeners.items():
+                if name not in self._listening:
+                    await conn.add_listener(name, cb)
+                    self._listening.add(name)
+
+    async def unlisten(self) -> None:
+        if self._listen_conn is None:
+            return
+        conn, self._listen_conn = self._listen_conn, None
+        if not conn.is_closed():
+            await conn.close()
+
+    @staticmethod
+    def _partition_name(table: str, day: date) -> str:
+        return '%s_p%s' % (table, day.strftime('%Y%m%d'))
+
+    async def _partition(self, table: str) -> str:
+        # строки пишутся в секцию текущих суток. Если ее еще нет (после
+        # полуночи до обслуживания секций или при partition_premake=0),
+        # она создается: строки в родительской таблице не удалялись бы
+        # вместе с секциями
+        if not self._cfg.partitioning:
+            return table
+        day = datetime.now(timezone.utc).date()
+        if (table, day) not in self._partitions:
+            await self._partition_ensure(table, day)
+        return self._partition_name(table, day)
+
+    async def _partition_ensure(self, table: str, day: date) -> None:
+        # отдельное соединение, чтобы блокировка секций не держалась до
+        # конца текущей транзакции
+        if self._pool is None:  # pragma: no cover
+            raise Exception('Not connected to %s' % self._masked_url)
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                db = copy(self)
+                db._conn = conn
+                await db.lock_partitions()
+                await db.partition_create(table, day)
+        self._partitions.add((table, day))
+
+    def set_partitions(self, partitions: Iterable[Tuple[str, date]]) -> None:
+        self._partitions.clear()
+        self._partitions.update(partitions)
+
+    async def lock_partitions(self) -> None:
+        await self._execute(
+            'SELECT pg_advisory_xact_lock(hashtext($1))',
+            '%s.task_partitions' % self._cfg.db_schema,
+        )
+
+    async def partition_list(self, table: str) -> List[date]:
+        rows = await self._fetch(
+            'SELECT c.relname FROM pg_inherits i '
+            'JOIN pg_class c ON c.oid=i.inhrelid '
+            'JOIN pg_class p ON p.oid=i.inhparent '
+            'JOIN pg_namespace n ON n.oid=p.relnamespace '
+            'WHERE n.nspname=$1 AND p.relname=$2',
+            self._cfg.db_schema,
+            table,
+        )
+        prefix = '%s_p' % table
+        days = []
+        for row in rows:
+            name = row['relname']
+            if not name.startswith(prefix):
+                continue
+            try:
+                days.append(
+                    datetime.strptime(name[len(prefix) :], '%Y%m%d').date()
+                )
+            except ValueError:
+                continue
+        return days
+
+    async def partition_create(self, table: str, day: date) -> None:
+        query = (  # nosec
+            'CREATE TABLE IF NOT EXISTS {schema}.{partition} '
+            '(LIKE {schema}.{table} INCLUDING INDEXES) '
+            'INHERITS ({schema}.{table})'
+        ).format(
+            schema=self._cfg.db_schema,
+            partition=self._partition_name(table, day),
+            table=table,
+        )
+        await self._execute(query)
+
+    async def partition_drop(self, table: str, day: date) -> None:
+        query = 'DROP TABLE IF EXISTS %s.%s' % (  # nosec
+            self._cfg.db_schema,
+            self._partition_name(table, day),
+        )
+        await self._execute(query)
 
     async def _check_or_create_database_objects(self) -> None:
         # TODO сделать полноценное сравнение объектов в БД и их безопасную
@@ -733,6 +1971,57 @@ class Db:
             )
         except asyncpg.exceptions.UndefinedTableError:
             await self._create_database_objects()
+            return
+
+        # колонки приоритета, очереди, дедупликации и зависимостей
+        # добавлены позже и используются в запросах любого экземпляра
+        try:
+            await self._execute(
+                'SELECT priority,queue,dedupe,depends_on '  # nosec
+                'FROM {schema}.task_pending '
+                'LIMIT 0'.format(schema=self._cfg.db_schema)
+            )
+        except asyncpg.exceptions.UndefinedColumnError as err:
+            self._tm.app.log_warn(
+                'Task manager objects at %s are outdated (%s), adding columns',
+                self._masked_url,
+                err,
+            )
+            await self._add_columns()
+
+        # индексы по новым колонкам без create_database_objects не
+        # создаются, см. MIGRATE_INDEXES_QUERIES
+        res = await self._fetchrow(
+            'SELECT array_agg(n) AS missing FROM unnest($1::text[]) n '
+            'WHERE to_regclass($2 || \'.\' || n) IS NULL',
+            [
+                'task_pending_queue_priority_idx',
+                'task_pending_reference_dedupe_idx',
+                'task_pending_depends_on_idx',
+            ],
+            self._cfg.db_schema,
+        )
+        missing = res['missing'] if res is not None else None
+        if missing:
+            self._tm.app.log_warn(
+                'Task manager indexes %s are missing at %s, apply '
+                'ipapp.task.db.MIGRATE_INDEXES_QUERIES',
+                ', '.join(missing),
+                self._masked_url,
+            )
+
+    async def _add_columns(self) -> None:
+        # добавление колонки ждет завершения транзакций, читающих таблицу,
+        # и блокирует всех, кто встанет в очередь за ним. Ожидание
+        # ограничено, при ошибке подключение повторяется
+        if self._pool is None:  # pragma: no cover
+            raise Exception('Not connected to %s' % self._masked_url)
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                await conn.execute("SET LOCAL lock_timeout='5s'")
+                await conn.execute(
+                    ADD_COLUMNS_QUERY.format(schema=self._cfg.db_schema)
+                )
 
     async def _create_database_objects(self) -> None:
         try:
@@ -745,20 +2034,23 @@ class Db:
                 '' % (self._masked_url, err)
             )
 
+    @asynccontextmanager
+    async def _connection(self) -> AsyncGenerator[asyncpg.Connection, None]:
+        if self._conn is not None:
+            yield self._conn
+            return
+        if self._pool is None:  # pragma: no cover
+            raise Exception('Not connected to %s' % self._masked_url)
+        async with self._pool.acquire() as conn:
+            yield conn
+
     async def _fetch(
         self,
         query: str,
         *args: Any,
         timeout: Optional[float] = None,
-        lock: bool = False,
     ) -> List[asyncpg.Record]:
-        conn = await self.get_conn(can_reconnect=lock)
-        if lock:
-            async with self._lock:
-                if conn.is_in_transaction():  # pragma: no cover
-                    raise UserWarning
-                return await conn.fetch(query, *args, timeout=timeout)
-        else:
+        async with self._connection() as conn:
             return await conn.fetch(query, *args, timeout=timeout)
 
     async def _fetchrow(
@@ -766,15 +2058,8 @@ class Db:
         query: str,
         *args: Any,
         timeout: Optional[float] = None,
-        lock: bool = False,
     ) -> Optional[asyncpg.Record]:
-        conn = await self.get_conn(can_reconnect=lock)
-        if lock:
-            async with self._lock:
-                if conn.is_in_transaction():  # pragma: no cover
-                    raise UserWarning
-                return await conn.fetchrow(query, *args, timeout=timeout)
-        else:
+        async with self._connection() as conn:
             return await conn.fetchrow(query, *args, timeout=timeout)
 
     async def _execute(
@@ -782,15 +2067,8 @@ class Db:
         query: str,
         *args: Any,
         timeout: Optional[float] = None,
-        lock: bool = False,
     ) -> None:
-        conn = await self.get_conn(can_reconnect=lock)
-        if lock:
-            async with self._lock:
-                if conn.is_in_transaction():  # pragma: no cover
-                    raise UserWarning
-                await conn.execute(query, *args, timeout=timeout)
-        else:
+        async with self._connection() as conn:
             await conn.execute(query, *args, timeout=timeout)
 
     @asynccontextmanager
@@ -800,12 +2078,13 @@ class Db:
         readonly: bool = False,
         deferrable: bool = False,
     ) -> AsyncGenerator[Db, None]:
-        conn = await self.get_conn(can_reconnect=True)
-        async with self._lock:
+        async with self._connection() as conn:
             async with conn.transaction(
                 isolation=isolation, readonly=readonly, deferrable=deferrable
             ):
-                yield self
+                db = copy(self)
+                db._conn = conn
+                yield db
 
     async def task_add(
         self,
@@ -815,119 +2094,527 @@ class Db:
         reference: Optional[str],
         max_retries: int,
         retry_delay: float,
+        priority: int = 0,
+        queue: str = QUEUE_DEFAULT,
         trace_id: Optional[str] = None,
         trace_span_id: Optional[str] = None,
         *,
-        lock: bool = False,
+        dedupe: bool = False,
+        depends_on: Optional[List[int]] = None,
     ) -> Tuple[int, float]:
+        columns = (
+            'eta,name,params,reference,max_retries,retry_delay,priority,queue'
+        )
+        values = (
+            'COALESCE($1::timestamptz, NOW()),$2::text,$3::jsonb,$4::text,'
+            '$5::int,make_interval(secs=>$6::float),$7::int,$8::text'
+        )
+        query_params: Tuple[Any, ...] = (
+            eta,
+            name,
+            params,
+            reference,
+            max_retries,
+            retry_delay,
+            priority,
+            queue,
+        )
         if trace_id is not None:
+            columns += ',trace_id,trace_span_id'
+            values += ',$9::varchar,$10::varchar'
+            query_params += (trace_id, trace_span_id)
+
+        where = ''
+        if depends_on is not None:
+            query_params += (depends_on,)
+            columns += ',depends_on'
+            values += ',$%d::bigint[]' % len(query_params)
+            # каждая родительская задача ожидает выполнения или успешно
+            # завершена
+            where = (
+                'WHERE NOT EXISTS ('
+                'SELECT 1 FROM unnest($%d::bigint[]) d(id) '
+                'WHERE NOT EXISTS ('
+                'SELECT 1 FROM %s.task_pending t WHERE t.id=d.id) '
+                'AND NOT EXISTS ('
+                "SELECT 1 FROM %s.task_arch a WHERE a.id=d.id "
+                "AND a.status='successful')) "
+            ) % (len(query_params), self._cfg.db_schema, self._cfg.db_schema)
+
+        conflict = ''
+        if dedupe:
+            columns += ',dedupe'
+            values += ',true'
+            conflict = 'ON CONFLICT (reference) WHERE dedupe DO NOTHING '
+
+        query = (  # nosec
+            "INSERT INTO %s.task_pending(%s) SELECT %s %s%s"
+            "RETURNING id, "
+            "greatest(extract(epoch from eta-NOW()), 0) as delay"
+        ) % (self._cfg.db_schema, columns, values, where, conflict)
+
+        if dedupe:
+            # если задача с такой reference уже ожидает выполнения,
+            # возвращается ее id
             query = (  # nosec
-                "INSERT INTO %s.task_pending"
-                "(eta,name,params,reference,max_retries,retry_delay,"
-                "trace_id,trace_span_id) "
-                "VALUES(COALESCE($1, NOW()),$2,$3,$4,$5,"
-                "make_interval(secs=>$6::float),$7,$8) "
-                "RETURNING id, "
-                "greatest(extract(epoch from eta-NOW()), 0) as delay"
-            ) % self._cfg.db_schema
-            query_params: Tuple[Any, ...] = (
-                eta,
-                name,
-                params,
-                reference,
-                max_retries,
-                retry_delay,
-                trace_id,
-                trace_span_id,
-            )
+                "WITH ins AS (%s), t AS ("
+                "SELECT id, delay FROM ins "
+                "UNION ALL "
+                "SELECT id, greatest(extract(epoch from eta-NOW()), 0) "
+                "FROM %s.task_pending "
+                "WHERE dedupe AND reference=$4 "
+                "AND NOT EXISTS (SELECT 1 FROM ins)"
+                ") "
+            ) % (query, self._cfg.db_schema)
         else:
-            query = (  # nosec
-                "INSERT INTO %s.task_pending"
-                "(eta,name,params,reference,max_retries,retry_delay) "
-                "VALUES(COALESCE($1, NOW()),$2,$3,$4,$5,"
-                "make_interval(secs=>$6::float)) "
-                "RETURNING id, "
-                "greatest(extract(epoch from eta-NOW()), 0) as delay"
-            ) % self._cfg.db_schema
-            query_params = (
-                eta,
-                name,
-                params,
-                reference,
-                max_retries,
-                retry_delay,
+            query = "WITH t AS (%s) " % query  # nosec
+
+        if self._cfg.use_notify:
+            query += "SELECT id, delay, pg_notify($%d, delay::text) FROM t" % (
+                len(query_params) + 1
             )
+            query_params += (self.channel,)
+        else:
+            query += "SELECT id, delay FROM t"
+
+        res = await self._fetchrow(query, *query_params)
+        if res is None and dedupe:
+            # конкурентная вставка с той же reference не видна в снимке
+            # запроса, повторный запрос ее найдет
+            res = await self._fetchrow(query, *query_params)
+        if res is None and depends_on is not None:
+            raise UserWarning('Parent tasks are not pending or successful')
+        if res is None:  # pragma: no cover
+            raise UserWarning
+        return res['id'], res['delay']
 
-        res = await self._fetchrow(
-            query,
-            *query_params,
-            lock=lock,
+    async def task_add_many(
+        self,
+        rows: List[Tuple[Any, ...]],
+        trace_id: Optional[str] = None,
+        trace_span_id: Optional[str] = None,
+    ) -> Tuple[List[int], float]:
+        # rows: (eta, name, params, reference, max_retries, retry_delay,
+        #        priority, queue)
+        # возвращает id задач в порядке rows и задержку до самой ранней
+        columns = (
+            'id,eta,name,params,reference,max_retries,retry_delay,'
+            'priority,queue'
+        )
+        values = (
+            'id,COALESCE(eta,NOW()),name,params::jsonb,reference,'
+            'max_retries,make_interval(secs=>retry_delay),priority,queue'
         )
+        query_params: List[Any] = [
+            [row[0] for row in rows],
+            [row[1] for row in rows],
+            [default_json_encoder(row[2]) for row in rows],
+            [row[3] for row in rows],
+            [row[4] for row in rows],
+            [row[5] for row in rows],
+            [row[6] for row in rows],
+            [row[7] for row in rows],
+        ]
+        if trace_id is not None:
+            columns += ',trace_id,trace_span_id'
+            values += ',$9,$10'
+            query_params += [trace_id, trace_span_id]
+
+        notify = ''
+        if self._cfg.use_notify:
+            query_params.append(self.channel)
+            notify = ',pg_notify($%d, delay::text)' % len(query_params)
+
+        query = (  # nosec
+            "WITH t AS ("
+            "SELECT nextval('%s.task_id_seq') AS id, u.* "
+            "FROM unnest($1::timestamptz[],$2::text[],$3::text[],"
+            "$4::text[],$5::int[],$6::float[],$7::int[],$8::text[]) "
+            "WITH ORDINALITY AS u(eta,name,params,reference,max_retries,"
+            "retry_delay,priority,queue,n)"
+            "), ins AS ("
+            "INSERT INTO %s.task_pending(%s) SELECT %s FROM t "
+            "RETURNING eta"
+            ") "
+            "SELECT ids, delay%s FROM ("
+            "SELECT ARRAY(SELECT id FROM t ORDER BY n) AS ids,"
+            "(SELECT greatest(extract(epoch from min(eta)-NOW()), 0) "
+            "FROM ins) AS delay"
+            ") r"
+        ) % (
+            self._cfg.db_schema,
+            self._cfg.db_schema,
+            columns,
+            values,
+            notify,
+        )
+
+        res = await self._fetchrow(query, *query_params)
         if res is None:  # pragma: no cover
             raise UserWarning
-        return res['id'], res['delay']
+        return list(res['ids']), res['delay']
+
+    def _queues_filter(self, param_num: int) -> str:
+        if self._cfg.queues is None:
+            return ''
+        return 'queue=ANY($%d::text[]) AND ' % param_num
+
+    def _depends_filter(self) -> str:
+        # все родительские задачи успешно завершены, то есть находятся в
+        # архиве: задача становится доступной в том же запросе, которым
+        # завершается последняя из родительских
+        return (
+            "(depends_on IS NULL OR NOT EXISTS ("
+            "SELECT 1 FROM unnest(depends_on) d(id) WHERE NOT EXISTS ("
+            "SELECT 1 FROM %s.task_arch p "
+            "WHERE p.id=d.id AND p.status='successful'))) AND "
+        ) % self._cfg.db_schema
 
     async def task_search(
-        self, batch_size: int, *, lock: bool = False
+        self,
+        batch_size: int,
+        limits: Optional[Dict[str, int]] = None,
+        shard: Optional[Tuple[int, int]] = None,
     ) -> List[Task]:
-        query = (  # nosec
-            "UPDATE %s.task_pending SET status='progress',last_stamp=NOW() "
-            "WHERE id IN ("
-            "SELECT id FROM %s.task_pending "
-            "WHERE eta<NOW() AND "
+        # limits: сколько задач с указанным названием можно взять в работу
+        # shard: (количество секций, номер секции), из которой брать задачи
+        query_params: List[Any] = [batch_size]
+        if self._cfg.queues is not None:
+            query_params.append(self._cfg.queues)
+        shard_filter = ''
+        if shard is not None:
+            query_params.extend(shard)
+            shard_filter = 'id%%$%d::bigint=$%d::bigint AND ' % (
+                len(query_params) - 1,
+                len(query_params),
+            )
+        where = (
+            "eta<NOW() AND %s%s%s"
             "status=ANY(ARRAY['pending'::%s.task_status,"
             "'retry'::%s.task_status])"
-            "LIMIT $1 FOR UPDATE SKIP LOCKED) "
-            "RETURNING "
-            "*"
         ) % (
-            self._cfg.db_schema,
-            self._cfg.db_schema,
+            self._queues_filter(2),
+            shard_filter,
+            self._depends_filter(),
             self._cfg.db_schema,
             self._cfg.db_schema,
         )
 
-        res = await self._fetch(query, batch_size, lock=lock)
+        if not limits:
+            query = (  # nosec
+                "UPDATE %s.task_pending "
+                "SET status='progress',last_stamp=NOW() "
+                "WHERE id IN ("
+                "SELECT id FROM %s.task_pending "
+                "WHERE %s "
+                "ORDER BY priority,eta "
+                "LIMIT $1 FOR UPDATE SKIP LOCKED) "
+                "RETURNING "
+                "*"
+            ) % (self._cfg.db_schema, self._cfg.db_schema, where)
+        else:
+            query_params.append(list(limits.keys()))
+            query_params.append(list(limits.values()))
+            query = (  # nosec
+                "WITH a AS ("
+                "SELECT id,priority,eta FROM %(schema)s.task_pending "
+                "WHERE %(where)s AND name<>ALL($%(names)d::text[]) "
+                "ORDER BY priority,eta "
+                "LIMIT $1 FOR UPDATE SKIP LOCKED"
+                "), l AS ("
+                "SELECT t.* "
+                "FROM unnest($%(names)d::text[],$%(slots)d::int[]) "
+                "AS n(name,slots) "
+                "CROSS JOIN LATERAL ("
+                "SELECT id,priority,eta FROM %(schema)s.task_pending "
+                "WHERE %(where)s AND name=n.name "
+                "ORDER BY priority,eta "
+                "LIMIT n.slots FOR UPDATE SKIP LOCKED"
+                ") t"
+                ") "
+                "UPDATE %(schema)s.task_pending "
+                "SET status='progress',last_stamp=NOW() "
+                "WHERE id IN ("
+                "SELECT id FROM (SELECT * FROM a UNION ALL SELECT * FROM l) u "
+                "ORDER BY priority,eta LIMIT $1) "
+                "RETURNING "
+                "*"
+            ) % {
+                'schema': self._cfg.db_schema,
+                'where': where,
+                'names': len(query_params) - 1,
+                'slots': len(query_params),
+            }
+
+        res = await self._fetch(query, *query_params)
 
         return [Task(**dict(row)) for row in res]
 
-    async def task_search4cancel(
-        self, task_id: int, *, lock: bool = False
-    ) -> Optional[Task]:
+    async def task_search4cancel(self, task_id: int) -> Optional[Task]:
         query = (  # nosec
             "UPDATE %s.task_pending SET status='progress',last_stamp=NOW() "
             "WHERE id=$1 AND status IN ('retry','pending') "
             "RETURNING "
             "*"
         ) % (self._cfg.db_schema,)
-        res = await self._fetchrow(query, task_id, lock=lock)
+        res = await self._fetchrow(query, task_id)
         if res is None:
             return None
         return Task(**res)
 
-    async def task_next_delay(self, *, lock: bool = False) -> Optional[float]:
+    async def task_next_delay(
+        self, blocked: Optional[List[str]] = None
+    ) -> Optional[float]:
+        # blocked: названия задач, которые сейчас нельзя брать в работу
+        query_params: List[Any] = []
+        if self._cfg.queues is not None:
+            query_params.append(self._cfg.queues)
+        blocked_filter = ''
+        if blocked:
+            query_params.append(blocked)
+            blocked_filter = 'name<>ALL($%d::text[]) AND ' % len(query_params)
         query = (  # nosec
             "SELECT EXTRACT(EPOCH FROM eta-NOW())t "
             "FROM %s.task_pending "
-            "WHERE "
+            "WHERE %s%s%s"
             "status=ANY(ARRAY['pending'::%s.task_status,"
             "'retry'::%s.task_status])"
             "ORDER BY eta "
             "LIMIT 1 "
             "FOR SHARE SKIP LOCKED"
-        ) % (self._cfg.db_schema, self._cfg.db_schema, self._cfg.db_schema)
-        res = await self._fetchrow(query, lock=lock)
+        ) % (
+            self._cfg.db_schema,
+            self._queues_filter(1),
+            blocked_filter,
+            self._depends_filter(),
+            self._cfg.db_schema,
+            self._cfg.db_schema,
+        )
+        res = await self._fetchrow(query, *query_params)
         if res:
             return res['t']
         return None
 
+    async def lock_metrics(self) -> bool:
+        # метрики очередей собирает экземпляр, который держит сессионную
+        # блокировку на отдельном соединении, до его остановки
+        conn = self._metrics_conn
+        if conn is not None and not conn.is_closed():
+            return True
+        self._metrics_conn = None
+        conn = await asyncpg.connect(self._cfg.db_url)
+        try:
+            locked = await conn.fetchval(
+                'SELECT pg_try_advisory_lock(hashtext($1))',
+                '%s.task_metrics' % self._cfg.db_schema,
+            )
+        except BaseException:
+            await conn.close()
+            raise
+        if not locked:
+            await conn.close()
+            return False
+        self._metrics_conn = conn
+        return True
+
+    async def task_queue_stats(
+        self, count_limit: int
+    ) -> Dict[str, Tuple[int, int, float]]:
+        # очередь: (ожидающих задач, наступивших задач, задержка самой
+        # старой наступившей задачи в секундах). Очереди перебираются по
+        # индексу, количества считаются не дальше count_limit
+        active = (
+            "status=ANY(ARRAY['pending'::%s.task_status,"
+            "'retry'::%s.task_status])"
+        ) % (self._cfg.db_schema, self._cfg.db_schema)
+        query = (  # nosec
+            "WITH RECURSIVE q AS ("
+            "(SELECT queue FROM %(schema)s.task_pending WHERE %(active)s "
+            "ORDER BY queue LIMIT 1) "
+            "UNION ALL "
+            "SELECT (SELECT queue FROM %(schema)s.task_pending "
+            "WHERE %(active)s AND queue>q.queue ORDER BY queue LIMIT 1) "
+            "FROM q WHERE q.queue IS NOT NULL"
+            ") "
+            "SELECT queue,"
+            "(SELECT count(*) FROM (SELECT 1 FROM %(schema)s.task_pending "
+            "WHERE %(active)s AND queue=q.queue LIMIT $1) c) AS pending,"
+            "(SELECT count(*) FROM (SELECT 1 FROM %(schema)s.task_pending "
+            "WHERE %(active)s AND queue=q.queue AND eta<NOW() LIMIT $1) c) "
+            "AS due,"
+            "COALESCE((SELECT greatest(extract(epoch FROM NOW()-eta),0) "
+            "FROM %(schema)s.task_pending "
+            "WHERE %(active)s AND queue=q.queue ORDER BY eta LIMIT 1),0) "
+            "AS lag "
+            "FROM q WHERE q.queue IS NOT NULL"
+        ) % {'schema': self._cfg.db_schema, 'active': active}
+        res = await self._fetch(query, count_limit)
+        return {
+            row['queue']: (row['pending'], row['due'], float(row['lag']))
+            for row in res
+        }
+
+    async def task_status_many(self, task_ids: List[int]) -> Dict[int, str]:
+        query = (  # nosec
+            "SELECT id,status::text FROM %s.task WHERE id=ANY($1::bigint[])"
+        ) % self._cfg.db_schema
+        res = await self._fetch(query, task_ids)
+        return {row['id']: row['status'] for row in res}
+
+    async def task_lock_parents(self, task_ids: List[int]) -> None:
+        # ожидающие родительские задачи не удаляются из task_pending до
+        # конца транзакции
+        query = (  # nosec
+            "SELECT id FROM %s.task_pending WHERE id=ANY($1::bigint[]) "
+            "ORDER BY id FOR KEY SHARE"
+        ) % self._cfg.db_schema
+        await self._execute(query, task_ids)
+
+    async def task_cancel_dependents(self, task_ids: List[int]) -> List[int]:
+        # отменяет ожидающие задачи, зависящие от указанных напрямую или
+        # через другие задачи
+        seed = (  # nosec
+            "SELECT id FROM %s.task_pending WHERE depends_on && $1::bigint[]"
+        ) % self._cfg.db_schema
+        return await self._cancel_tree(seed, task_ids)
+
+    async def task_cancel_orphans(self) -> List[int]:
+        # отменяет ожидающие задачи, у которых есть родительская задача не
+        # в task_pending и не успешно завершенная в архиве, и задачи,
+        # зависящие от них
+        seed = (  # nosec
+            "SELECT id FROM %(schema)s.task_pending t "
+            "WHERE depends_on IS NOT NULL AND status<>'progress' "
+            "AND EXISTS ("
+            "SELECT 1 FROM unnest(t.depends_on) d(id) "
+            "WHERE NOT EXISTS ("
+            "SELECT 1 FROM %(schema)s.task_pending p WHERE p.id=d.id) "
+            "AND NOT EXISTS ("
+            "SELECT 1 FROM %(schema)s.task_arch a WHERE a.id=d.id "
+            "AND a.status='successful')) "
+            "FOR UPDATE SKIP LOCKED"
+        ) % {'schema': self._cfg.db_schema}
+        return await self._cancel_tree(seed)
+
+    async def _cancel_tree(self, seed: str, *args: Any) -> List[int]:
+        query = (  # nosec
+            "WITH RECURSIVE s AS (%(seed)s), d AS ("
+            "SELECT id FROM s "
+            "UNION "
+            "SELECT t.id FROM %(schema)s.task_pending t "
+            "JOIN d ON t.depends_on && ARRAY[d.id]"
+            "), del AS ("
+            "DELETE FROM %(schema)s.task_pending p USING d WHERE p.id=d.id "
+            "RETURNING p.id,p.eta,p.name,p.params,p.max_retries,"
+            "p.retry_delay,p.retries,p.reference,p.priority,p.queue,"
+            "p.depends_on"
+            ") "
+            "INSERT INTO %(schema)s.%(arch)s"
+            "(id,eta,name,params,max_retries,retry_delay,status,"
+            "retries,last_stamp,reference,priority,queue,depends_on)"
+            "SELECT "
+            "id,eta,name,params,max_retries,retry_delay,'canceled',"
+            "retries,NOW(),reference,priority,queue,depends_on "
+            "FROM del "
+            "RETURNING id"
+        ) % {
+            'seed': seed,
+            'schema': self._cfg.db_schema,
+            'arch': await self._partition('task_arch'),
+        }
+        query_params: Tuple[Any, ...] = args
+        if self._cfg.notify_results:
+            query += ',pg_notify($%d, id::text)' % (len(query_params) + 1)
+            query_params += (self.result_channel,)
+        res = await self._fetch(query, *query_params)
+        return [row['id'] for row in res]
+
+    async def task_heartbeat(self, task_ids: List[int]) -> None:
+        query = (  # nosec
+            "UPDATE %s.task_pending SET last_stamp=NOW() "
+            "WHERE id=ANY($1::bigint[]) AND status='progress'"
+        ) % self._cfg.db_schema
+        await self._execute(query, task_ids)
+
+    async def task_reap(
+        self, lease_timeout: float, retry_delay: Callable[[Task], float]
+    ) -> Tuple[List[int], List[Task]]:
+        # возвращает id задач, возвращенных в retry, и задачи, у которых
+        # не осталось попыток. Последние остаются в работе с обновленной
+        # отметкой, пока их не перенесут в архив.
+        # retry_delay: задержка повтора задачи в секундах
+        expired = (
+            "status='progress' "
+            "AND last_stamp<NOW()-make_interval(secs=>$1::float) "
+        )
+        async with self.transaction() as db:
+            query = (  # nosec
+                "SELECT * FROM %s.task_pending "
+                "WHERE %sAND COALESCE(retries+1,0)<max_retries "
+                "FOR UPDATE SKIP LOCKED"
+            ) % (self._cfg.db_schema, expired)
+            tasks = [
+                Task(**dict(row))
+                for row in await db._fetch(query, lease_timeout)
+            ]
+            res: List[asyncpg.Record] = []
+            if len(tasks) > 0:
+                query = (  # nosec
+                    "UPDATE %s.task_pending t "
+                    "SET status='retry',retries=COALESCE(t.retries+1,0),"
+                    "eta=NOW()+make_interval(secs=>d.delay),"
+                    "last_stamp=NOW() "
+                    "FROM unnest($1::bigint[],$2::float[]) d(id,delay) "
+                    "WHERE t.id=d.id "
+                    "RETURNING t.id"
+                ) % self._cfg.db_schema
+                query_params: Tuple[Any, ...] = (
+                    [task.id for task in tasks],
+                    [retry_delay(task) for task in tasks],
+                )
+                if self._cfg.use_notify:
+                    query = (  # nosec
+                        "WITH t AS (%s) SELECT id, pg_notify($3, '0') FROM t"
+                    ) % query
+                    query_params += (self.channel,)
+                res = await db._fetch(query, *query_params)
+
+        query = (  # nosec
+            "UPDATE %s.task_pending SET last_stamp=NOW() "
+            "WHERE %sAND COALESCE(retries+1,0)>=max_retries "
+            "RETURNING *"
+        ) % (self._cfg.db_schema, expired)
+        failed = await self._fetch(query, lease_timeout)
+        return (
+            [row['id'] for row in res],
+            [Task(**dict(row)) for row in failed],
+        )
+
+    async def task_result(
+        self, task_id: int
+    ) -> Optional[Tuple[str, Any, Optional[str]]]:
+        query = (  # nosec
+            "SELECT a.status::text,l.id AS log_id,l.result,l.error "
+            "FROM %s.task_arch a "
+            "LEFT JOIN LATERAL ("
+            "SELECT id,result,error FROM %s.task_log "
+            "WHERE task_id=a.id ORDER BY id DESC LIMIT 1"
+            ") l ON true "
+            "WHERE a.id=$1"
+        ) % (self._cfg.db_schema, self._cfg.db_schema)
+        res = await self._fetchrow(query, task_id)
+        if res is None:
+            return None
+        if res['status'] == STATUS_SUCCESSFUL and res['log_id'] is None:
+            # выполнение не записано в task_log по log_policy
+            return res['status'], None, 'Result is not logged'
+        return res['status'], res['result'], res['error']
+
     async def task_retry(
         self,
         task_id: int,
         retries: int,
         eta_delay: Optional[float],
-        *,
-        lock: bool = False,
     ) -> None:
         query = (  # nosec
             'UPDATE %s.task_pending SET status=$2,retries=$3,'
@@ -935,48 +2622,141 @@ class Db:
             'last_stamp=NOW() '
             'WHERE id=$1'
         ) % self._cfg.db_schema
-
-        await self._execute(
-            query, task_id, STATUS_RETRY, retries, eta_delay, lock=lock
+        query_params: Tuple[Any, ...] = (
+            task_id,
+            STATUS_RETRY,
+            retries,
+            eta_delay,
         )
 
+        if self._cfg.use_notify:
+            query += (
+                ' RETURNING pg_notify($5, '
+                'greatest(extract(epoch from eta-NOW()), 0)::text)'
+            )
+            query_params += (self.channel,)
+
+        await self._execute(query, *query_params)
+
     async def task_move_arch(
         self,
         task_id: int,
         status: str,
         retries: Optional[int],
         *,
-        lock: bool = False,
         with_trace_id: bool = False,
     ) -> None:
+        arch = await self._partition('task_arch')
         if with_trace_id:
             query = (  # nosec
                 'WITH del AS (DELETE FROM %s.task_pending WHERE id=$1 '
                 'RETURNING id,eta,name,params,max_retries,retry_delay,'
-                'retries,reference,trace_id,trace_span_id)'
-                'INSERT INTO %s.task_arch'
+                'retries,reference,priority,queue,depends_on,'
+                'trace_id,trace_span_id)'
+                'INSERT INTO %s.%s'
                 '(id,eta,name,params,max_retries,retry_delay,status,'
-                'retries,last_stamp,reference,trace_id,trace_span_id)'
+                'retries,last_stamp,reference,priority,queue,depends_on,'
+                'trace_id,trace_span_id)'
                 'SELECT '
                 'id,eta,name,params,max_retries,retry_delay,$2,'
-                'COALESCE($3,retries),NOW(),reference,'
-                'trace_id,trace_span_id '
+                'COALESCE($3,retries),NOW(),reference,priority,queue,'
+                'depends_on,trace_id,trace_span_id '
                 'FROM del'
-            ) % (self._cfg.db_schema, self._cfg.db_schema)
+            ) % (self._cfg.db_schema, self._cfg.db_schema, arch)
         else:
             query = (  # nosec
                 'WITH del AS (DELETE FROM %s.task_pending WHERE id=$1 '
                 'RETURNING id,eta,name,params,max_retries,retry_delay,'
-                'retries,reference)'
-                'INSERT INTO %s.task_arch'
+                'retries,reference,priority,queue,depends_on)'
+                'INSERT INTO %s.%s'
                 '(id,eta,name,params,max_retries,retry_delay,status,'
-                'retries,last_stamp,reference)'
+                'retries,last_stamp,reference,priority,queue,depends_on)'
                 'SELECT '
                 'id,eta,name,params,max_retries,retry_delay,$2,'
-                'COALESCE($3,retries),NOW(),reference '
+                'COALESCE($3,retries),NOW(),reference,priority,queue,'
+                'depends_on '
                 'FROM del'
-            ) % (self._cfg.db_schema, self._cfg.db_schema)
-        await self._execute(query, task_id, status, retries, lock=lock)
+            ) % (self._cfg.db_schema, self._cfg.db_schema, arch)
+        if self._cfg.notify_results:
+            query += ' RETURNING pg_notify($4, id::text)'
+            await self._execute(
+                query, task_id, status, retries, self.result_channel
+            )
+        else:
+            await self._execute(query, task_id, status, retries)
+
+    async def task_finalize_many(
+        self,
+        logs: List[Tuple[Any, ...]],
+        archive: List[Tuple[int, str, int]],
+        *,
+        with_trace_id: bool = False,
+    ) -> None:
+        # logs: (task_id, eta, started, finished, result, error, trace)
+        # archive: (task_id, status, retries)
+        columns = (
+            'id,eta,name,params,max_retries,retry_delay,status,'
+            'retries,last_stamp,reference,priority,queue,depends_on'
+        )
+        values = (
+            'id,eta,name,params,max_retries,retry_delay,'
+            'a_status::%s.task_status,COALESCE(a_retries,retries),NOW(),'
+            'reference,priority,queue,depends_on'
+        ) % self._cfg.db_schema
+        if with_trace_id:
+            columns += ',trace_id,trace_span_id'
+            values += ',trace_id,trace_span_id'
+        notify = ''
+        notify_params: Tuple[Any, ...] = ()
+        if self._cfg.notify_results:
+            notify = ' RETURNING pg_notify($11, id::text)'
+            notify_params = (self.result_channel,)
+
+        query = (  # nosec
+            'WITH l AS ('
+            'INSERT INTO %s.%s'
+            '(task_id,eta,started,finished,result,error,traceback)'
+            'SELECT task_id,eta,to_timestamp(started),to_timestamp(finished),'
+            'result::jsonb,error,traceback '
+            'FROM unnest($1::bigint[],$2::timestamptz[],$3::float[],'
+            '$4::float[],$5::text[],$6::text[],$7::text[]) '
+            'AS r(task_id,eta,started,finished,result,error,traceback)'
+            '), a AS ('
+            'SELECT * FROM unnest($8::bigint[],$9::text[],$10::int[]) '
+            'AS a(a_id,a_status,a_retries)'
+            '), del AS ('
+            'DELETE FROM %s.task_pending p USING a WHERE p.id=a.a_id '
+            'RETURNING p.*,a.a_status,a.a_retries'
+            ')'
+            'INSERT INTO %s.%s(%s) SELECT %s FROM del%s'
+        ) % (
+            self._cfg.db_schema,
+            await self._partition('task_log'),
+            self._cfg.db_schema,
+            self._cfg.db_schema,
+            await self._partition('task_arch'),
+            columns,
+            values,
+            notify,
+        )
+
+        await self._execute(
+            query,
+            [row[0] for row in logs],
+            [row[1] for row in logs],
+            [row[2] for row in logs],
+            [row[3] for row in logs],
+            [
+                default_json_encoder(row[4]) if row[4] is not None else None
+                for row in logs
+            ],
+            [row[5] for row in logs],
+            [row[6] for row in logs],
+            [row[0] for row in archive],
+            [row[1] for row in archive],
+            [row[2] for row in archive],
+            *notify_params,
+        )
 
     async def task_log_add(
         self,
@@ -987,19 +2767,17 @@ class Db:
         result: Any,
         error: Optional[str],
         trace: Optional[str],
-        *,
-        lock: bool = False,
     ) -> None:
         query = (  # nosec
-            'INSERT INTO %s.task_log'
+            'INSERT INTO %s.%s'
             '(task_id,eta,started,finished,result,error,traceback)'
             'VALUES($1,$2,to_timestamp($3),to_timestamp($4),'
             '$5::text::jsonb,$6,$7)'
-        ) % self._cfg.db_schema
+        ) % (self._cfg.db_schema, await self._partition('task_log'))
         js = default_json_encoder(result) if result is not None else None
 
         await self._execute(
-            query, task_id, eta, started, finished, js, error, trace, lock=lock
+            query, task_id, eta, started, finished, js, error, trace
         )
 
     async def lock_tick_table(self) -> None:
@@ -1041,8 +2819,8 @@ class Db:
         ) % self._cfg.db_schema
         await self._execute(query, stamp)
 
-    async def health(self, *, lock: bool = False) -> None:
-        await self._execute('SELECT 1', lock=lock)
+    async def health(self) -> None:
+        await self._execute('SELECT 1')
 
 
 class TaskRegistry(RpcRegistry):
@@ -1065,6 +2843,15 @@ class TaskRegistry(RpcRegistry):
         crontab_date_attr: Optional[str] = None,
         max_retries: Optional[int] = None,
         retry_delay: Optional[float] = None,
+        executor: Optional[str] = None,
+        priority: Optional[int] = None,
+        queue: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
+        rate_limit: Optional[float] = None,
+        retry_backoff: Optional[float] = None,
+        retry_max_delay: Optional[float] = None,
+        retry_jitter: Optional[float] = None,
+        log_policy: Optional[str] = None,
     ) -> Callable:
         def decorator(func: Callable) -> Callable:
             _validate_crontab_fn(
@@ -1075,6 +2862,23 @@ class TaskRegistry(RpcRegistry):
                 setattr(func, '__task_max_retries__', max_retries)
             if retry_delay is not None:
                 setattr(func, '__task_retry_delay__', retry_delay)
+            if priority is not None:
+                setattr(func, '__task_priority__', priority)
+            if queue is not None:
+                setattr(func, '__task_queue__', queue)
+            if max_concurrency is not None:
+                setattr(func, '__task_max_concurrency__', max_concurrency)
+            if rate_limit is not None:
+                setattr(func, '__task_rate_limit__', rate_limit)
+            if retry_backoff is not None:
+                setattr(func, '__task_retry_backoff__', retry_backoff)
+            if retry_max_delay is not None:
+                setattr(func, '__task_retry_max_delay__', retry_max_delay)
+            if retry_jitter is not None:
+                setattr(func, '__task_retry_jitter__', retry_jitter)
+            if log_policy is not None:
+                _validate_log_policy(log_policy)
+                setattr(func, '__task_log_policy__', log_policy)
             if crontab is not None:
                 setattr(func, '__crontab__', CronTab(crontab))
                 setattr(func, '__crontab_do_not_miss__', crontab_do_not_miss)
@@ -1092,6 +2896,7 @@ class TaskRegistry(RpcRegistry):
                 response_ref=response_ref,
                 validators=validators,
                 examples=examples,
+                executor=executor,
             )(func)
 
         return decorator
@@ -1135,3 +2940,10 @@ def _validate_crontab_fn(
                 'Task "%s" has not required argument "%s" for crontab'
                 % (task_name, crontab_date_attr)
             )
+
+
+def _validate_log_policy(log_policy: str) -> None:
+    if log_policy not in LOG_POLICIES:
+        raise UserWarning(
+            'Task log policy must be one of: %s' % ', '.join(LOG_POLICIES)
+        )
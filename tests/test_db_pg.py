@@ -1,6 +1,11 @@
+import asyncio
+
 import asyncpg
+import pytest
+from pydantic import BaseModel
 
 from ipapp import BaseApplication, BaseConfig
+from ipapp.db import pg
 from ipapp.db.pg import Postgres, PostgresConfig
 
 
@@ -101,3 +106,309 @@ async def test_prepare(loop, postgres_url):
         rows = await st2.query_all('30')
         assert len(rows) == 1
         assert rows[0]['a'] == '30'
+
+
+async def test_copy(loop, postgres_url, monkeypatch):
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'db',
+        Postgres(
+            PostgresConfig(url=postgres_url, log_result=True, log_query=True)
+        ),
+    )
+    await app.start()
+    db: Postgres = app.get('db')  # type: ignore
+
+    async def records():
+        for i in range(25):
+            yield (i, 'name%s' % i)
+
+    async def source():
+        yield b'100\tname100\n'
+        yield b'101\tname101\n'
+
+    out = []
+
+    async def output(data):
+        out.append(data)
+
+    async with db.connection() as conn:
+        await conn.execute(
+            'CREATE TEMPORARY TABLE _test_copy(id int, name text)'
+        )
+        res = await conn.copy_in(
+            '_test_copy', records=[(-1, 'a'), (-2, 'b')], query_name='db5'
+        )
+        assert res == 'COPY 2'
+        res = await conn.copy_in(
+            '_test_copy', records=records(), columns=['id', 'name']
+        )
+        assert res == 'COPY 25'
+        res = await conn.copy_in('_test_copy', source=source())
+        assert res == 'COPY 2'
+
+        res = await conn.copy_out(
+            'SELECT id,name FROM _test_copy WHERE id>=$1 ORDER BY id',
+            100,
+            output=output,
+        )
+        assert res == 'COPY 2'
+        assert b''.join(out) == b'100\tname100\n101\tname101\n'
+
+        r = await conn.query_one('SELECT COUNT(*) c FROM _test_copy')
+        assert r['c'] == 29
+
+        # ошибка посреди загрузки откатывает уже загруженные порции
+        async def broken():
+            for i in range(25):
+                yield (i, 'broken%s' % i)
+            raise Exception('broken')
+
+        monkeypatch.setattr(pg, 'COPY_CHUNK_SIZE', 10)
+        with pytest.raises(Exception, match='broken'):
+            await conn.copy_in('_test_copy', records=broken())
+        assert not conn.in_transaction
+        r = await conn.query_one('SELECT COUNT(*) c FROM _test_copy')
+        assert r['c'] == 29
+
+    await app.stop()
+
+
+async def test_iterate(loop, postgres_url):
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'db',
+        Postgres(
+            PostgresConfig(url=postgres_url, log_result=True, log_query=True)
+        ),
+    )
+    await app.start()
+    db: Postgres = app.get('db')  # type: ignore
+
+    class Row(BaseModel):
+        a: int
+
+    async with db.connection() as conn:
+        rows = [
+            row['a']
+            async for row in conn.iterate(
+                'SELECT generate_series(1, $1) a', 120, prefetch=50
+            )
+        ]
+        assert rows == list(range(1, 121))
+        assert not conn.in_transaction
+
+        async with conn.xact():
+            rows = [
+                row
+                async for row in conn.iterate(
+                    'SELECT generate_series(1, 3) a',
+                    query_name='db6',
+                    model_cls=Row,
+                )
+            ]
+        assert rows == [Row(a=1), Row(a=2), Row(a=3)]
+
+        # прерванная итерация освобождает соединение
+        it = conn.iterate('SELECT generate_series(1, 100) a')
+        async for row in it:
+            break
+        await it.aclose()
+        assert not conn.in_transaction
+        res = await conn.query_one('SELECT 1 a')
+        assert res['a'] == 1
+
+    await app.stop()
+
+
+async def test_statement_cache(loop, postgres_url):
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'db',
+        Postgres(
+            PostgresConfig(
+                url=postgres_url,
+                pool_min_size=1,
+                pool_max_size=1,
+                statement_cache_size=2,
+                max_cached_statement_lifetime=0,
+            )
+        ),
+    )
+    await app.start()
+    db: Postgres = app.get('db')  # type: ignore
+
+    for i in range(3):
+        res = await db.query_one('SELECT $1::int a', i, query_name='db7')
+        assert res['a'] == i
+    for query in ('SELECT 1 a', 'SELECT 2 a', 'SELECT 3 a'):
+        await db.query_all(query)
+
+    async with db.connection() as conn:
+        # кэш соединения сохраняется между получениями из пула
+        stmt_cache = conn._conn._con._stmt_cache  # noqa
+        assert stmt_cache.get_max_size() == 2
+        assert len(stmt_cache) == 2
+
+    await app.stop()
+
+
+async def test_replicas(loop, postgres_url, monkeypatch):
+    sep = '&' if '?' in postgres_url else '?'
+    replica_url = postgres_url + sep + 'application_name=replica'
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'db',
+        Postgres(
+            PostgresConfig(
+                url=postgres_url,
+                replica_urls=[replica_url, 'postgres://own@127.0.0.1:1/db'],
+            )
+        ),
+    )
+    await app.start()
+    db: Postgres = app.get('db')  # type: ignore
+
+    replica, dead = db._replicas  # noqa
+    assert replica.healthy
+    assert replica.lag == 0
+    assert not dead.healthy
+
+    query = "SELECT current_setting('application_name') a"
+    for _ in range(3):
+        res = await db.query_one(query)
+        assert res['a'] == 'replica'
+    res = await db.query_all(query)
+    assert res[0]['a'] == 'replica'
+    res = await db.query_one(query, replica=False)
+    assert res['a'] != 'replica'
+
+    async with db.connection() as conn:
+        async with conn.xact():
+            await conn.execute("SELECT set_config('ipapp.test', 'xact', true)")
+            # чтение внутри транзакции выполняется в ее соединении и видит
+            # незафиксированные изменения
+            res = await db.query_one(
+                "SELECT pg_backend_pid() pid,"
+                "current_setting('ipapp.test', true) v"
+            )
+            assert res['pid'] == conn.pid
+            assert res['v'] == 'xact'
+            res = await db.query_all(query)
+            assert res[0]['a'] != 'replica'
+            # явный выбор реплики выполняет запрос вне транзакции
+            res = await db.query_one(query, replica=True)
+            assert res['a'] == 'replica'
+        res = await db.query_one(query)
+        assert res['a'] == 'replica'
+
+    # реплика исключается из балансировки при превышении отставания
+    monkeypatch.setattr(pg, 'REPLICA_LAG_QUERY', 'SELECT 60::float8')
+    await db._check_replicas()  # noqa
+    assert not replica.healthy
+    assert replica.lag == 60
+    res = await db.query_one(query, replica=True)
+    assert res['a'] != 'replica'
+
+    db.cfg.replica_max_lag = 0
+    await db._check_replicas()  # noqa
+    assert replica.healthy
+    assert not dead.healthy
+
+    await app.stop()
+
+
+async def test_xact_reads(loop, postgres_url):
+    app = BaseApplication(BaseConfig())
+    app.add('db', Postgres(PostgresConfig(url=postgres_url)))
+    await app.start()
+    db: Postgres = app.get('db')  # type: ignore
+
+    query = 'SELECT pg_backend_pid() pid'
+    started = asyncio.Event()
+
+    async def read_later():
+        await started.wait()
+        return await db.query_one(query)
+
+    async with db.connection() as conn:
+        async with conn.xact():
+            # задача наследует контекст транзакции, но выполняется после
+            # ее завершения
+            in_conn = asyncio.ensure_future(read_later())
+            released = asyncio.ensure_future(read_later())
+        started.set()
+        res = await asyncio.wait_for(in_conn, 5)
+        assert res['pid'] != conn.pid
+    res = await asyncio.wait_for(released, 5)
+    assert res['pid'] != conn.pid
+
+    # чтение в цикле по курсору транзакции выполняется в другом соединении
+    async with db.connection() as conn:
+        async with conn.xact():
+            async for _ in conn.iterate(
+                'SELECT generate_series(1, 3)', prefetch=1
+            ):
+                res = await asyncio.wait_for(db.query_one(query), 5)
+                assert res['pid'] != conn.pid
+            res = await db.query_one(query)
+            assert res['pid'] == conn.pid
+
+    await app.stop()
+
+
+async def test_replica_connect_timeout(loop, postgres_url, monkeypatch):
+    sep = '&' if '?' in postgres_url else '?'
+    replica_url = postgres_url + sep + 'application_name=replica'
+    create_pool = asyncpg.create_pool
+    hang = True
+
+    async def create_pool_hanging(dsn, **kwargs):
+        # подключение к реплике зависает
+        if hang and dsn == replica_url:
+            await asyncio.sleep(3600)
+        return await create_pool(dsn, **kwargs)
+
+    monkeypatch.setattr(pg.asyncpg, 'create_pool', create_pool_hanging)
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'db',
+        Postgres(
+            PostgresConfig(
+                url=postgres_url,
+                replica_urls=[replica_url],
+                replica_connect_timeout=0.1,
+            )
+        ),
+    )
+    await asyncio.wait_for(app.start(), 5)
+    db: Postgres = app.get('db')  # type: ignore
+    replica = db._replicas[0]  # noqa
+    assert not replica.healthy
+    assert replica.pool is None
+    res = await db.query_one("SELECT current_setting('application_name') a")
+    assert res['a'] != 'replica'
+
+    # подключение повторяется при следующей проверке
+    hang = False
+    await db._check_replicas()  # noqa
+    assert replica.healthy
+
+    await app.stop()
+
+
+async def test_pool_metrics(loop, postgres_url, monkeypatch):
+    sampled = []
+    monkeypatch.setattr(
+        Postgres, '_sample_pools', lambda self: sampled.append(self)
+    )
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'db',
+        Postgres(PostgresConfig(url=postgres_url, pool_metrics_interval=0.1)),
+    )
+    await app.start()
+    # метрики пулов публикуются и без реплик
+    await asyncio.sleep(0.35)
+    assert len(sampled) >= 2
+    await app.stop()
@@ -368,6 +368,52 @@ async def test_span():
     assert 'ms' in str(span)
 
 
+async def test_span_lazy_annotations():
+    class TestAdapter(AbcAdapter):
+        name = 'test_adapter'
+
+        async def start(self, logger: 'Logger'):
+            pass
+
+        def handle(self, span: Span):
+            pass
+
+        async def stop(self):
+            pass
+
+    app = BaseApplication(BaseConfig())
+    lgr = app.logger
+    lgr.add(TestAdapter())
+    await lgr.start()
+
+    calls = []
+
+    def value(res):
+        def _value():
+            calls.append(res)
+            return res
+
+        return _value
+
+    span = Span(lgr, '1234')
+    span.annotate('k1', value('1'), ts=1)
+    span.annotate4adapter(TestAdapter.name, 'k2', value('2'), ts=2)
+    # аннотации для неподключенного адаптера не сохраняются
+    span.annotate4adapter('unknown...', 'k3', value('3'), ts=3)
+    assert calls == []
+
+    assert span.get_annotations4adapter(TestAdapter.name) == {
+        'k1': [('1', 1)],
+        'k2': [('2', 2)],
+    }
+    assert span.annotations == {'k1': [('1', 1)]}
+    assert span.get_annotations4adapter('unknown...', merge=False) == {}
+    # значения вычисляются один раз
+    assert sorted(calls) == ['1', '2']
+
+    await lgr.stop()
+
+
 async def test_span_ctx():
     app = BaseApplication(BaseConfig())
     lgr = app.logger
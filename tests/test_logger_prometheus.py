@@ -18,6 +18,13 @@ async def test_success(loop, unused_tcp_port):
                 'tag1': 'some_tag1',
             }
         },
+        gauge_labels={
+            'test_gauge': {
+                'span': 'test_gauge_span',
+                'value': 'some_value',
+                'tag1': 'some_tag1',
+            }
+        },
     )
     adapter = PrometheusAdapter(cfg)
     app = BaseApplication(BaseConfig())
@@ -33,6 +40,19 @@ async def test_success(loop, unused_tcp_port):
     with app.logger.span_new(name='test_span') as span3:
         span3.tag('some_tag1', '123')
 
+    with app.logger.span_new(name='test_gauge_span') as span4:
+        span4.tag('some_tag1', 'a')
+        span4.tag('some_value', 1)
+    with app.logger.span_new(name='test_gauge_span') as span4:
+        span4.tag('some_tag1', 'a')
+        span4.tag('some_value', 5)
+    with app.logger.span_new(name='test_gauge_span') as span4:
+        span4.tag('some_tag1', 'b')
+        span4.tag('some_value', 2.5)
+    with app.logger.span_new(name='test_gauge_span') as span4:
+        # без значения метрика не меняется
+        span4.tag('some_tag1', 'b')
+
     async with ClientSession() as sess:
         resp = await sess.get('http://127.0.0.1:%d/' % port)
         txt = await resp.text()
@@ -49,4 +69,7 @@ async def test_success(loop, unused_tcp_port):
         'test_span_sum{tag1="123"} %s' % (span2.duration + span3.duration)
     ) in txt
 
+    assert 'test_gauge{tag1="a"} 5.0' in txt
+    assert 'test_gauge{tag1="b"} 2.5' in txt
+
     await app.stop()
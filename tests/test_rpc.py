@@ -1,3 +1,4 @@
+import threading
 from functools import wraps
 
 import pytest
@@ -193,3 +194,54 @@ async def test_decorator():
 
     res = await ex.exec('sum', kwargs={'a': 3, 'b': 4})
     assert res == 7
+
+
+def square(a: int) -> int:
+    return a * a
+
+
+async def test_exec_in_thread():
+    reg = RpcRegistry()
+
+    @reg.method(executor='thread')
+    def sum(a: int, b: int) -> dict:
+        return {'sum': a + b, 'thread': threading.get_ident()}
+
+    ex = Executor(reg, thread_pool_size=2)
+
+    res = await ex.exec('sum', kwargs={'a': '3', 'b': 4})
+    assert res['sum'] == 7
+    assert res['thread'] != threading.get_ident()
+
+    with pytest.raises(InvalidArguments):
+        await ex.exec('sum', kwargs={'a': 3})
+
+    ex.shutdown()
+
+
+async def test_exec_in_process():
+    reg = RpcRegistry()
+    reg.method(executor='process')(square)
+
+    ex = Executor(reg, process_pool_size=1)
+
+    res = await ex.exec('square', args=[5])
+    assert res == 25
+
+    ex.shutdown()
+
+
+async def test_executor_validation():
+    reg = RpcRegistry()
+
+    with pytest.raises(UserWarning):
+
+        @reg.method(executor='unknown')
+        def sum(a: int, b: int) -> int:
+            return a + b
+
+    with pytest.raises(UserWarning):
+
+        @reg.method(executor='thread')
+        async def sum2(a: int, b: int) -> int:
+            return a + b
@@ -1,22 +1,32 @@
 import time
 import uuid
-from asyncio import Future, wait_for
-from datetime import datetime, timezone
+from asyncio import Event, Future, ensure_future, sleep, wait_for
+from datetime import date, datetime, timedelta, timezone
 from functools import wraps
 
 import asyncpg
 import pytest
+from crontab import CronTab
 
 from ipapp import BaseApplication, BaseConfig
 from ipapp.db.pg import Postgres
 from ipapp.logger import Span
+from ipapp.rpc.main import Executor
 from ipapp.task.db import (
     CREATE_TABLE_QUERY,
+    LOG_ERRORS_ONLY,
+    LOG_SAMPLED,
     STATUS_CANCELED,
     STATUS_ERROR,
     STATUS_PENDING,
     STATUS_SUCCESSFUL,
+    Db,
+    PeriodicTask,
     Retry,
+    RetryPolicy,
+    ScheduleItem,
+    TaskError,
+    TaskLimit,
     TaskManager,
     TaskManagerConfig,
     TaskRegistry,
@@ -643,3 +653,1097 @@ async def test_propagate_trace(loop, postgres_url: str, with_trace_id: bool):
 
     res = await wait_for(fut, 10)
     assert res == 123
+
+
+async def test_notify(loop, postgres_url: str):
+    test_schema_name = await prepare(postgres_url, with_trace_id=True)
+
+    fut = Future()
+
+    reg = TaskRegistry()
+
+    @reg.task()
+    async def test(arg):
+        fut.set_result(arg)
+        return arg
+
+    worker = BaseApplication(BaseConfig())
+    worker.add(
+        'tm',
+        TaskManager(
+            reg,
+            TaskManagerConfig(
+                db_url=postgres_url,
+                db_schema=test_schema_name,
+                max_scan_interval=60.0,
+            ),
+        ),
+    )
+    producer = BaseApplication(BaseConfig())
+    producer.add(
+        'tm',
+        TaskManager(
+            TaskRegistry(),
+            TaskManagerConfig(
+                db_url=postgres_url,
+                db_schema=test_schema_name,
+                idle=True,
+            ),
+        ),
+    )
+    await worker.start()
+    await producer.start()
+    tm: TaskManager = producer.get('tm')  # type: ignore
+
+    # воркер уже простаивает до max_scan_interval и должен проснуться
+    # по уведомлению от другого экземпляра приложения
+    await tm.schedule('test', {'arg': 123})
+
+    res = await wait_for(fut, 5)
+    assert res == 123
+
+    await producer.stop()
+    await worker.stop()
+
+
+@pytest.mark.parametrize(
+    "with_trace_id",
+    [True, False],
+)
+async def test_schedule_many(loop, postgres_url: str, with_trace_id: bool):
+    test_schema_name = await prepare(postgres_url, with_trace_id=with_trace_id)
+
+    fut = Future()
+    results = []
+
+    reg = TaskRegistry()
+
+    @reg.task(max_retries=3)
+    async def test(arg):
+        results.append(arg)
+        if len(results) == 3:
+            fut.set_result(sorted(results))
+        return arg
+
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'tm',
+        TaskManager(
+            reg,
+            TaskManagerConfig(
+                db_url=postgres_url,
+                db_schema=test_schema_name,
+                create_database_objects=True,
+                batch_size=10,
+            ),
+        ),
+    )
+    await app.start()
+    tm: TaskManager = app.get('tm')  # type: ignore
+
+    assert await tm.schedule_many([]) == []
+
+    ref = str(uuid.uuid4())
+    task_ids = await tm.schedule_many(
+        [
+            ScheduleItem(test, {'arg': 1}, eta=time.time() + 2),
+            ScheduleItem(test, {'arg': 2}, reference=ref),
+            ScheduleItem('test', {'arg': 3}, max_retries=0, retry_delay=1.0),
+        ]
+    )
+    assert len(set(task_ids)) == 3
+
+    tasks = await get_tasks_by_reference(postgres_url, test_schema_name, ref)
+    assert len(tasks) == 1
+    assert tasks[0]['id'] == task_ids[1]
+    assert tasks[0]['params'] == {'arg': 2}
+    assert tasks[0]['max_retries'] == 3
+
+    res = await wait_for(fut, 10)
+    assert res == [1, 2, 3]
+
+    await wait_no_pending(postgres_url, test_schema_name)
+
+    tasks = await get_tasks_arch(postgres_url, test_schema_name)
+    assert sorted(task['id'] for task in tasks) == sorted(task_ids)
+    assert [task['status'] for task in tasks] == [STATUS_SUCCESSFUL] * 3
+    by_id = {task['id']: task for task in tasks}
+    assert by_id[task_ids[2]]['max_retries'] == 0
+
+    await app.stop()
+
+
+@pytest.mark.parametrize(
+    "with_trace_id",
+    [True, False],
+)
+async def test_batch_finalize(loop, postgres_url: str, with_trace_id: bool):
+    test_schema_name = await prepare(postgres_url, with_trace_id=with_trace_id)
+
+    class Api:
+        attempts = 0
+
+    reg = TaskRegistry()
+
+    @reg.task()
+    async def ok(arg):
+        return arg
+
+    @reg.task()
+    async def fail():
+        raise Exception('Failed')
+
+    @reg.task(max_retries=1, retry_delay=0.2)
+    async def retry():
+        Api.attempts += 1
+        if Api.attempts == 1:
+            raise Retry(Exception('Attempt 1'))
+        return 'done'
+
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'tm',
+        TaskManager(
+            reg,
+            TaskManagerConfig(
+                db_url=postgres_url,
+                db_schema=test_schema_name,
+                create_database_objects=True,
+                batch_size=10,
+                batch_finalize=True,
+            ),
+        ),
+    )
+    await app.start()
+    tm: TaskManager = app.get('tm')  # type: ignore
+
+    await tm.schedule_many(
+        [
+            ScheduleItem(ok, {'arg': 1}),
+            ScheduleItem(ok, {'arg': 2}),
+            ScheduleItem(fail, {}),
+            ScheduleItem(retry, {}),
+        ]
+    )
+
+    await wait_no_pending(postgres_url, test_schema_name)
+
+    tasks = await get_tasks_arch(postgres_url, test_schema_name)
+    assert sorted((task['name'], task['status']) for task in tasks) == [
+        ('fail', STATUS_ERROR),
+        ('ok', STATUS_SUCCESSFUL),
+        ('ok', STATUS_SUCCESSFUL),
+        ('retry', STATUS_SUCCESSFUL),
+    ]
+    assert [task['retries'] for task in tasks if task['name'] == 'retry'] == [
+        1
+    ]
+
+    logs = await get_tasks_log(postgres_url, test_schema_name)
+    assert len(logs) == 5
+    assert sorted(
+        log['result'] for log in logs if log['result'] is not None
+    ) == [1, 2, 'done']
+    assert sorted(log['error'] for log in logs if log['error']) == [
+        'Attempt 1',
+        'Failed',
+    ]
+
+    await app.stop()
+
+
+async def test_max_concurrency(loop, postgres_url: str):
+    test_schema_name = await prepare(postgres_url, with_trace_id=True)
+
+    release = Event()
+    fut = Future()
+    done = []
+
+    reg = TaskRegistry()
+
+    @reg.task()
+    async def slow():
+        await release.wait()
+        return 'slow'
+
+    @reg.task()
+    async def fast(arg):
+        done.append(arg)
+        if len(done) == 3:
+            fut.set_result(sorted(done))
+        return arg
+
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'tm',
+        TaskManager(
+            reg,
+            TaskManagerConfig(
+                db_url=postgres_url,
+                db_schema=test_schema_name,
+                create_database_objects=True,
+                batch_size=2,
+                max_concurrency=2,
+            ),
+        ),
+    )
+    await app.start()
+    tm: TaskManager = app.get('tm')  # type: ignore
+
+    await tm.schedule(slow, {})
+    await tm.schedule_many([ScheduleItem(fast, {'arg': i}) for i in range(3)])
+
+    # медленная задача не мешает выполнению остальных
+    res = await wait_for(fut, 10)
+    assert res == [0, 1, 2]
+
+    tasks = await get_tasks_pending(postgres_url, test_schema_name)
+    assert [task['name'] for task in tasks] == ['slow']
+
+    release.set()
+    await wait_no_pending(postgres_url, test_schema_name)
+
+    tasks = await get_tasks_arch(postgres_url, test_schema_name)
+    assert len(tasks) == 4
+    assert all(task['status'] == STATUS_SUCCESSFUL for task in tasks)
+
+    await app.stop()
+
+
+async def test_partitioning(loop, postgres_url: str):
+    test_schema_name = await prepare(postgres_url, with_trace_id=True)
+    today = datetime.now(timezone.utc).strftime('%Y%m%d')
+
+    fut = Future()
+    reg = TaskRegistry()
+
+    @reg.task()
+    async def some_method(arg):
+        fut.set_result(arg)
+        return arg
+
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'tm',
+        TaskManager(
+            reg,
+            TaskManagerConfig(
+                db_url=postgres_url,
+                db_schema=test_schema_name,
+                create_database_objects=True,
+                partitioning=True,
+                partition_premake=1,
+                partition_retention_days=7,
+            ),
+        ),
+    )
+    await app.start()
+    tm: TaskManager = app.get('tm')  # type: ignore
+
+    await tm.schedule(some_method, {'arg': 1})
+    assert await wait_for(fut, 10) == 1
+    await wait_no_pending(postgres_url, test_schema_name)
+
+    conn = await connect(postgres_url)
+    arch = await conn.fetch(
+        'SELECT * FROM %s.task_arch_p%s' % (test_schema_name, today)
+    )
+    assert len(arch) == 1
+    assert arch[0]['status'] == STATUS_SUCCESSFUL
+    log = await conn.fetch(
+        'SELECT * FROM %s.task_log_p%s' % (test_schema_name, today)
+    )
+    assert len(log) == 1
+    assert log[0]['task_id'] == arch[0]['id']
+    await conn.close()
+
+    # секции старше срока хранения удаляются целиком
+    await tm._db.partition_create('task_arch', date(2000, 1, 1))
+    await tm._maintain_partitions()
+    assert sorted(await tm._db.partition_list('task_arch'))[0] > date(
+        2000, 1, 1
+    )
+    assert len(await tm._db.partition_list('task_log')) == 2
+
+    await app.stop()
+
+
+async def test_partition_rollover(loop, postgres_url: str):
+    test_schema_name = await prepare(postgres_url, with_trace_id=True)
+    day = datetime.now(timezone.utc).date()
+    today = day.strftime('%Y%m%d')
+
+    fut = Future()
+    reg = TaskRegistry()
+
+    @reg.task()
+    async def some_method(arg):
+        fut.set_result(arg)
+        return arg
+
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'tm',
+        TaskManager(
+            reg,
+            TaskManagerConfig(
+                db_url=postgres_url,
+                db_schema=test_schema_name,
+                create_database_objects=True,
+                partitioning=True,
+                partition_premake=0,
+                partition_maintenance_interval=3600,
+            ),
+        ),
+    )
+    await app.start()
+    tm: TaskManager = app.get('tm')  # type: ignore
+
+    # наступили новые сутки, а обслуживание секций еще не выполнялось
+    for table in ('task_arch', 'task_log'):
+        await tm._db.partition_drop(table, day)
+    tm._db.set_partitions([])
+
+    await tm.schedule(some_method, {'arg': 1})
+    assert await wait_for(fut, 10) == 1
+    await wait_no_pending(postgres_url, test_schema_name)
+
+    conn = await connect(postgres_url)
+    for table in ('task_arch', 'task_log'):
+        rows = await conn.fetch(
+            'SELECT * FROM %s.%s_p%s' % (test_schema_name, table, today)
+        )
+        assert len(rows) == 1
+        # в родительскую таблицу строки не попадают
+        assert (
+            await conn.fetchval(
+                'SELECT count(*) FROM ONLY %s.%s' % (test_schema_name, table)
+            )
+            == 0
+        )
+    await conn.close()
+
+    await app.stop()
+
+
+async def test_priority_and_queues(loop, postgres_url: str):
+    test_schema_name = await prepare(postgres_url, with_trace_id=True)
+
+    done = []
+    fut = Future()
+    reg = TaskRegistry()
+
+    @reg.task(queue='hot')
+    async def hot(arg):
+        done.append(arg)
+        if len(done) == 3:
+            fut.set_result(done)
+        return arg
+
+    @reg.task()
+    async def bulk():
+        return 'bulk'
+
+    def make_app(**kwargs):
+        app = BaseApplication(BaseConfig())
+        app.add(
+            'tm',
+            TaskManager(
+                reg,
+                TaskManagerConfig(
+                    db_url=postgres_url,
+                    db_schema=test_schema_name,
+                    create_database_objects=True,
+                    **kwargs,
+                ),
+            ),
+        )
+        return app
+
+    app = make_app(idle=True)
+    await app.start()
+    tm: TaskManager = app.get('tm')  # type: ignore
+    await tm.schedule(bulk, {})
+    await tm.schedule(hot, {'arg': 'low'}, priority=10)
+    await tm.schedule_many(
+        [
+            ScheduleItem(hot, {'arg': 'middle'}),
+            ScheduleItem(hot, {'arg': 'high'}, priority=-10),
+        ]
+    )
+    await app.stop()
+
+    app = make_app(queues=['hot'])
+    await app.start()
+
+    res = await wait_for(fut, 10)
+    assert res == ['high', 'middle', 'low']
+
+    # задачи из других очередей не берутся в работу
+    tasks = await get_tasks_pending(postgres_url, test_schema_name)
+    assert len(tasks) == 1
+    assert tasks[0]['name'] == 'bulk'
+    assert tasks[0]['queue'] == 'default'
+    assert tasks[0]['status'] == STATUS_PENDING
+
+    await app.stop()
+
+    # приоритет и очередь сохраняются в архиве
+    arch = await get_tasks_arch(postgres_url, test_schema_name)
+    assert sorted((t['priority'], t['queue']) for t in arch) == [
+        (-10, 'hot'),
+        (0, 'hot'),
+        (10, 'hot'),
+    ]
+
+
+async def test_outdated_schema(loop, postgres_url: str):
+    test_schema_name = await prepare(postgres_url)
+    conn = await connect(postgres_url)
+    await conn.execute(
+        'ALTER TABLE %s.task DROP COLUMN depends_on' % test_schema_name
+    )
+    await conn.close()
+
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'tm',
+        TaskManager(
+            TaskRegistry(),
+            TaskManagerConfig(db_url=postgres_url, db_schema=test_schema_name),
+        ),
+    )
+    # колонки добавляются при запуске и без create_database_objects
+    await app.start()
+    await app.stop()
+
+    conn = await connect(postgres_url)
+    assert (
+        await conn.fetchval(
+            'SELECT count(*) FROM %s.task WHERE depends_on IS NULL'
+            % test_schema_name
+        )
+        == 0
+    )
+    await conn.close()
+
+
+async def test_stuck_task_reaper(loop, postgres_url: str):
+    test_schema_name = await prepare(postgres_url)
+
+    calls = []
+    fut = Future()
+    reg = TaskRegistry()
+
+    @reg.task(retry_backoff=2)
+    async def some_method(arg):
+        calls.append(arg)
+        if arg == 'long':
+            # выполняется дольше lease_timeout, но отметка обновляется
+            await sleep(1.5)
+        if len(calls) == 2:
+            fut.set_result(sorted(calls))
+        return arg
+
+    # задачи, оставшиеся в работе после падения обработчика: падение
+    # расходует попытку, у второй задачи попыток не осталось. Повтор
+    # первой откладывается на retry_delay * retry_backoff ^ retries
+    conn = await connect(postgres_url)
+    await conn.execute(
+        "INSERT INTO %s.task_pending"
+        "(name,params,status,last_stamp,max_retries,retries,retry_delay) "
+        "VALUES('some_method','{\"arg\": \"stuck\"}'::jsonb,'progress',"
+        "NOW()-interval '1 hour',2,0,interval '1 second'),"
+        "('some_method','{\"arg\": \"dead\"}'::jsonb,'progress',"
+        "NOW()-interval '1 hour',0,NULL,interval '1 second')"
+        % test_schema_name
+    )
+    reaped_after = await conn.fetchval('SELECT NOW()')
+    await conn.close()
+
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'tm',
+        TaskManager(
+            reg,
+            TaskManagerConfig(
+                db_url=postgres_url,
+                db_schema=test_schema_name,
+                lease_timeout=0.6,
+                max_concurrency=2,
+                batch_size=2,
+            ),
+        ),
+    )
+    await app.start()
+    tm: TaskManager = app.get('tm')  # type: ignore
+
+    await tm.schedule(some_method, {'arg': 'long'})
+
+    res = await wait_for(fut, 10)
+    assert res == ['long', 'stuck']
+
+    await wait_no_pending(postgres_url, test_schema_name)
+    tasks = await get_tasks_arch(postgres_url, test_schema_name)
+    assert len(tasks) == 3
+    statuses = {task['params']['arg']: task['status'] for task in tasks}
+    assert statuses == {
+        'stuck': STATUS_SUCCESSFUL,
+        'dead': STATUS_ERROR,
+        'long': STATUS_SUCCESSFUL,
+    }
+    retries = {task['params']['arg']: task['retries'] for task in tasks}
+    assert retries['stuck'] == 2
+    assert retries['dead'] == 0
+    stuck = [task for task in tasks if task['params']['arg'] == 'stuck'][0]
+    assert stuck['eta'] >= reaped_after + timedelta(seconds=2)
+    assert stuck['eta'] < reaped_after + timedelta(seconds=5)
+    assert sorted(calls) == ['long', 'stuck']
+    logs = await get_tasks_log(postgres_url, test_schema_name)
+    assert 'Lease expired' in [log['error'] for log in logs]
+
+    await app.stop()
+
+
+async def test_schedule_dedupe(loop, postgres_url: str):
+    test_schema_name = await prepare(postgres_url)
+
+    reg = TaskRegistry()
+
+    @reg.task()
+    async def some_method(arg):
+        return arg
+
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'tm',
+        TaskManager(
+            reg,
+            TaskManagerConfig(
+                db_url=postgres_url,
+                db_schema=test_schema_name,
+                idle=True,
+            ),
+        ),
+    )
+    await app.start()
+    tm: TaskManager = app.get('tm')  # type: ignore
+
+    task_id = await tm.schedule(
+        some_method, {'arg': 1}, reference='ref', dedupe=True
+    )
+    # повторное планирование возвращает уже существующую задачу
+    assert (
+        await tm.schedule(
+            some_method, {'arg': 2}, reference='ref', dedupe=True
+        )
+        == task_id
+    )
+    # без dedupe задачи с той же reference создаются как раньше
+    other_id = await tm.schedule(some_method, {'arg': 3}, reference='ref')
+    assert other_id != task_id
+
+    tasks = await get_tasks_pending(postgres_url, test_schema_name)
+    assert [(task['id'], task['params']) for task in tasks] == [
+        (task_id, {'arg': 1}),
+        (other_id, {'arg': 3}),
+    ]
+
+    with pytest.raises(UserWarning):
+        await tm.schedule(some_method, {'arg': 4}, dedupe=True)
+
+    await app.stop()
+
+
+def test_tick_task():
+    def fn():
+        pass
+
+    tz = timezone.utc
+    last = datetime(2020, 1, 1, 0, 0, 30, tzinfo=tz)
+    now = datetime(2020, 1, 1, 0, 3, 30, tzinfo=tz)
+
+    # пропущенные запуски выполняются только для crontab_do_not_miss
+    to_exec = []
+    task = PeriodicTask(fn, 'fn', CronTab('* * * * *'), strict=True)
+    next_dt = TaskManager._tick_task(task, False, now, last, to_exec)
+    assert [dt.minute for _, dt, _ in to_exec] == [1, 2, 3]
+    assert next_dt == datetime(2020, 1, 1, 0, 4, tzinfo=tz)
+
+    to_exec = []
+    task = PeriodicTask(fn, 'fn', CronTab('* * * * *'))
+    next_dt = TaskManager._tick_task(task, False, now, last, to_exec)
+    assert [dt.minute for _, dt, _ in to_exec] == [1]
+    assert next_dt == datetime(2020, 1, 1, 0, 4, tzinfo=tz)
+
+    # при запуске обработчика пропущенные запуски не выполняются
+    to_exec = []
+    next_dt = TaskManager._tick_task(task, True, now, last, to_exec)
+    assert to_exec == []
+    assert next_dt == datetime(2020, 1, 1, 0, 4, tzinfo=tz)
+
+
+async def test_result(loop, postgres_url: str):
+    test_schema_name = await prepare(postgres_url)
+
+    reg = TaskRegistry()
+
+    @reg.task()
+    async def some_method(arg):
+        if arg is None:
+            raise Exception('Some error')
+        return {'arg': arg}
+
+    def make_app(**kwargs):
+        app = BaseApplication(BaseConfig())
+        app.add(
+            'tm',
+            TaskManager(
+                reg,
+                TaskManagerConfig(
+                    db_url=postgres_url,
+                    db_schema=test_schema_name,
+                    notify_results=True,
+                    **kwargs,
+                ),
+            ),
+        )
+        return app
+
+    worker = make_app()
+    await worker.start()
+    # задачи планируются обработчиком, который их не выполняет
+    producer = make_app(idle=True)
+    await producer.start()
+    tm: TaskManager = producer.get('tm')  # type: ignore
+    tm_worker: TaskManager = worker.get('tm')  # type: ignore
+
+    task_id = await tm.schedule(some_method, {'arg': 1})
+    assert await tm.result(task_id, timeout=10) == {'arg': 1}
+    # результат завершенной задачи берется из базы данных
+    assert await tm.result(task_id, timeout=10) == {'arg': 1}
+
+    task_id = await tm_worker.schedule(some_method, {'arg': 2})
+    assert await tm_worker.result(task_id, timeout=10) == {'arg': 2}
+
+    task_id = await tm.schedule(some_method, {'arg': None})
+    with pytest.raises(TaskError) as exc:
+        await tm.result(task_id, timeout=10)
+    assert exc.value.status == STATUS_ERROR
+    assert exc.value.error == 'Some error'
+
+    task_id = await tm.schedule(some_method, {'arg': 3}, eta=time.time() + 60)
+    fut = ensure_future(tm.result(task_id, timeout=10))
+    await tm.cancel(task_id)
+    with pytest.raises(TaskError) as exc:
+        await fut
+    assert exc.value.status == STATUS_CANCELED
+
+    await worker.stop()
+
+    # успешное выполнение не записано в task_log, результат в другом
+    # экземпляре неизвестен
+    worker = make_app(log_policy=LOG_ERRORS_ONLY)
+    await worker.start()
+    task_id = await tm.schedule(some_method, {'arg': 4})
+    with pytest.raises(TaskError) as exc:
+        await tm.result(task_id, timeout=10)
+    assert exc.value.status == STATUS_SUCCESSFUL
+    assert exc.value.error == 'Result is not logged'
+
+    await producer.stop()
+    await worker.stop()
+
+
+def test_task_limit():
+    limit = TaskLimit(max_concurrency=2)
+    assert limit.slots(0, 10) == 2
+    limit.acquire()
+    assert limit.slots(0, 10) == 1
+    assert limit.slots(0, 1) == 1
+    limit.acquire()
+    assert limit.slots(0, 10) == 0
+    assert limit.wait(0) is None
+    limit.release()
+    assert limit.slots(0, 10) == 1
+
+    limit = TaskLimit(rate_limit=2, tokens=2, stamp=0)
+    assert limit.slots(0, 10) == 2
+    limit.acquire()
+    limit.acquire()
+    assert limit.slots(0, 10) == 0
+    assert limit.wait(0) == 0.5
+    assert limit.slots(0.5, 10) == 1
+    # запас не превышает количество задач в секунду
+    assert limit.slots(100, 10) == 2
+
+
+async def test_task_limits(loop, postgres_url: str):
+    test_schema_name = await prepare(postgres_url)
+
+    running = {'limited': 0, 'max': 0}
+    done = []
+    fut = Future()
+    reg = TaskRegistry()
+
+    @reg.task(max_concurrency=1)
+    async def limited(arg):
+        running['limited'] += 1
+        running['max'] = max(running['max'], running['limited'])
+        await sleep(0.2)
+        running['limited'] -= 1
+        done.append(arg)
+        if len(done) == 6:
+            fut.set_result(True)
+
+    @reg.task()
+    async def free(arg):
+        done.append(arg)
+        if len(done) == 6:
+            fut.set_result(True)
+
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'tm',
+        TaskManager(
+            reg,
+            TaskManagerConfig(
+                db_url=postgres_url,
+                db_schema=test_schema_name,
+                batch_size=10,
+                max_concurrency=10,
+            ),
+        ),
+    )
+    await app.start()
+    tm: TaskManager = app.get('tm')  # type: ignore
+
+    await tm.schedule_many(
+        [ScheduleItem(limited, {'arg': 'l%s' % i}) for i in range(3)]
+        + [ScheduleItem(free, {'arg': 'f%s' % i}) for i in range(3)]
+    )
+
+    await wait_for(fut, 10)
+    assert running['max'] == 1
+    # задачи без ограничений не ждут задачи с ограничением
+    assert set(done[:3]) == {'f0', 'f1', 'f2'}
+
+    await app.stop()
+
+
+async def test_queue_stats(loop, postgres_url: str):
+    test_schema_name = await prepare(postgres_url)
+
+    reg = TaskRegistry()
+
+    @reg.task()
+    async def some_method():
+        pass
+
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'tm',
+        TaskManager(
+            reg,
+            TaskManagerConfig(
+                db_url=postgres_url,
+                db_schema=test_schema_name,
+                idle=True,
+            ),
+        ),
+    )
+    await app.start()
+    tm: TaskManager = app.get('tm')  # type: ignore
+
+    await tm.schedule(some_method, {}, eta=time.time() - 10)
+    await tm.schedule(some_method, {}, eta=time.time() + 60)
+    await tm.schedule(some_method, {}, queue='other', eta=time.time() + 60)
+
+    stats = await tm._db.task_queue_stats(100)
+    assert set(stats.keys()) == {'default', 'other'}
+    pending, due, lag = stats['default']
+    assert (pending, due) == (2, 1)
+    assert 10 <= lag < 20
+    assert stats['other'] == (1, 0, 0.0)
+
+    stats = await tm._db.task_queue_stats(1)
+    assert stats['default'][:2] == (1, 1)
+
+    # метрики собирает только один экземпляр
+    other = Db(tm, tm.cfg)
+    await other.init()
+    assert await tm._db.lock_metrics()
+    assert await tm._db.lock_metrics()
+    assert not await other.lock_metrics()
+    await other.close()
+
+    await app.stop()
+
+
+def test_retry_policy():
+    assert RetryPolicy().delay(10, 5) == 10
+    policy = RetryPolicy(backoff=2, max_delay=100)
+    assert [policy.delay(10, i) for i in range(5)] == [10, 20, 40, 80, 100]
+    policy = RetryPolicy(backoff=2, jitter=0.5)
+    for _ in range(100):
+        assert 20 <= policy.delay(10, 2) <= 40
+
+
+async def test_retry_backoff(loop, postgres_url: str):
+    test_schema_name = await prepare(postgres_url)
+
+    reg = TaskRegistry()
+
+    @reg.task(max_retries=3, retry_delay=10, retry_backoff=3)
+    async def some_method(delay=None):
+        raise Retry(Exception('Some error'), delay=delay)
+
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'tm',
+        TaskManager(
+            reg,
+            TaskManagerConfig(db_url=postgres_url, db_schema=test_schema_name),
+        ),
+    )
+    await app.start()
+    tm: TaskManager = app.get('tm')  # type: ignore
+
+    async def wait_retry(task_id):
+        for _ in range(100):
+            tasks = await get_tasks_pending(postgres_url, test_schema_name)
+            for task in tasks:
+                if task['id'] == task_id and task['status'] == 'retry':
+                    return task
+            await sleep(0.1)
+        raise TimeoutError()
+
+    conn = await connect(postgres_url)
+    task_id = await tm.schedule(some_method, {})
+    await wait_retry(task_id)
+    # вторая попытка: retry_delay * retry_backoff
+    await conn.execute(
+        "UPDATE %s.task_pending SET eta=NOW(),retries=0 WHERE id=$1"
+        % test_schema_name,
+        task_id,
+    )
+    tm._scan_in(0)
+    for _ in range(100):
+        task = await wait_retry(task_id)
+        if task['retries'] == 1:
+            break
+        await sleep(0.1)
+    delay = (task['eta'] - task['last_stamp']).total_seconds()
+    assert 29 < delay <= 30
+
+    # задержка из исключения заменяет политику задачи
+    task_id = await tm.schedule(some_method, {'delay': 100})
+    task = await wait_retry(task_id)
+    delay = (task['eta'] - task['last_stamp']).total_seconds()
+    assert 99 < delay <= 100
+
+    await conn.close()
+    await app.stop()
+
+
+async def test_log_policy(loop, postgres_url: str):
+    test_schema_name = await prepare(postgres_url)
+
+    reg = TaskRegistry()
+
+    @reg.task()
+    async def some_method(fail: bool):
+        if fail:
+            raise Exception('Some error')
+        return 'ok'
+
+    @reg.task(log_policy=LOG_SAMPLED)
+    async def sampled_method():
+        return 'ok'
+
+    with pytest.raises(UserWarning):
+        reg.task(log_policy='never')(sampled_method)
+
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'tm',
+        TaskManager(
+            reg,
+            TaskManagerConfig(
+                db_url=postgres_url,
+                db_schema=test_schema_name,
+                log_policy=LOG_ERRORS_ONLY,
+                log_sample_rate=1,
+            ),
+        ),
+    )
+    await app.start()
+    tm: TaskManager = app.get('tm')  # type: ignore
+
+    ok_id = await tm.schedule(some_method, {'fail': False})
+    err_id = await tm.schedule(some_method, {'fail': True})
+    sampled_id = await tm.schedule(sampled_method, {})
+    await wait_no_pending(postgres_url, test_schema_name)
+
+    arch = await get_tasks_arch(postgres_url, test_schema_name)
+    assert {t['id'] for t in arch} == {ok_id, err_id, sampled_id}
+
+    logs = await get_tasks_log(postgres_url, test_schema_name)
+    assert sorted(log['task_id'] for log in logs) == sorted(
+        [err_id, sampled_id]
+    )
+
+    await app.stop()
+
+
+async def test_shards(loop, postgres_url: str):
+    test_schema_name = await prepare(postgres_url)
+
+    reg = TaskRegistry()
+
+    @reg.task()
+    async def some_method():
+        return 'ok'
+
+    with pytest.raises(UserWarning):
+        TaskManager(reg, TaskManagerConfig(shards=2, shard=2))
+    with pytest.raises(UserWarning):
+        TaskManager(reg, TaskManagerConfig(shard=1))
+
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'tm',
+        TaskManager(
+            reg,
+            TaskManagerConfig(
+                db_url=postgres_url,
+                db_schema=test_schema_name,
+                idle=True,
+                shards=2,
+                shard=0,
+            ),
+        ),
+    )
+    await app.start()
+    tm: TaskManager = app.get('tm')  # type: ignore
+
+    task_ids = await tm.schedule_many(
+        [ScheduleItem(some_method, {}) for _ in range(6)]
+    )
+    async with tm._db.transaction() as db:
+        tasks = await db.task_search(10, None, (2, 0))
+    assert sorted(task.id for task in tasks) == [
+        task_id for task_id in task_ids if task_id % 2 == 0
+    ]
+    conn = await connect(postgres_url)
+    await conn.execute(
+        "UPDATE %s.task_pending SET status='pending'" % test_schema_name
+    )
+    await conn.close()
+
+    # задачи из чужой секции забираются, если своих не хватило на пачку
+    tm.cfg.idle = False
+    tm._scan_in(0)
+    await wait_no_pending(postgres_url, test_schema_name)
+    arch = await get_tasks_arch(postgres_url, test_schema_name)
+    assert [task['id'] for task in arch] == task_ids
+
+    await app.stop()
+
+
+async def test_depends_on(loop, postgres_url: str):
+    test_schema_name = await prepare(postgres_url)
+
+    reg = TaskRegistry()
+    done = []
+
+    @reg.task()
+    async def step(name: str, fail: bool = False):
+        if fail:
+            raise Exception('Some error')
+        done.append(name)
+        return name
+
+    app = BaseApplication(BaseConfig())
+    app.add(
+        'tm',
+        TaskManager(
+            reg,
+            TaskManagerConfig(db_url=postgres_url, db_schema=test_schema_name),
+        ),
+    )
+    await app.start()
+    tm: TaskManager = app.get('tm')  # type: ignore
+
+    with pytest.raises(UserWarning):
+        await tm.schedule(step, {'name': 'x'}, depends_on=[100500])
+    with pytest.raises(UserWarning, match='depend'):
+        await tm.schedule(
+            step, {'name': 'x'}, reference='x', dedupe=True, depends_on=[1]
+        )
+
+    a = await tm.schedule(step, {'name': 'a'}, eta=time.time() + 0.5)
+    b = await tm.schedule(step, {'name': 'b'}, eta=time.time() + 0.5)
+    # задача ждет завершения обеих родительских задач
+    c = await tm.schedule(step, {'name': 'c'}, depends_on=[a, b])
+    assert await tm.result(c, timeout=10) == 'c'
+    assert done[-1] == 'c'
+    assert sorted(done) == ['a', 'b', 'c']
+
+    # после ошибки родительской задачи зависимые отменяются
+    f = await tm.schedule(
+        step, {'name': 'f', 'fail': True}, eta=time.time() + 0.5
+    )
+    g = await tm.schedule(step, {'name': 'g'}, depends_on=[f])
+    h = await tm.schedule(step, {'name': 'h'}, depends_on=[g])
+    with pytest.raises(TaskError) as exc:
+        await tm.result(h, timeout=10)
+    assert exc.value.status == STATUS_CANCELED
+    with pytest.raises(TaskError):
+        await tm.schedule(step, {'name': 'i'}, depends_on=[f])
+    assert 'g' not in done and 'h' not in done
+
+    # связи сохраняются в архиве
+    arch = {
+        t['id']: t
+        for t in await get_tasks_arch(postgres_url, test_schema_name)
+    }
+    assert sorted(arch[c]['depends_on']) == sorted([a, b])
+    assert arch[h]['depends_on'] == [g]
+
+    # задача, родительская задача которой удалена из архива, отменяется
+    # при обходе
+    j = await tm.schedule(step, {'name': 'j'}, eta=time.time() + 60)
+    k = await tm.schedule(step, {'name': 'k'}, depends_on=[j])
+    conn = await connect(postgres_url)
+    await conn.execute(
+        'DELETE FROM %s.task_pending WHERE id=$1' % test_schema_name, j
+    )
+    await conn.close()
+    await tm._cancel_orphans()
+    with pytest.raises(TaskError) as exc:
+        await tm.result(k, timeout=10)
+    assert exc.value.status == STATUS_CANCELED
+
+    await app.stop()
+
+
+def retry_in_process(arg):
+    raise Retry(ValueError(arg), delay=5, backoff=2, max_delay=50, jitter=0.1)
+
+
+async def test_retry_from_process(loop):
+    reg = TaskRegistry()
+    reg.task(executor='process')(retry_in_process)
+    ex = Executor(reg, process_pool_size=1)
+
+    # параметры повтора не теряются при передаче исключения из процесса
+    with pytest.raises(Retry) as exc:
+        await ex.exec('retry_in_process', kwargs={'arg': 'x'})
+    assert str(exc.value.err) == 'x'
+    assert exc.value.delay == 5
+    assert exc.value.backoff == 2
+    assert exc.value.max_delay == 50
+    assert exc.value.jitter == 0.1
+
+    ex.shutdown()